@@ -1,15 +1,27 @@
 from flask import Flask, redirect
+import atexit
+import click
 from flask_mail import Mail
 import os
 from database import db
+from database.backends import configure_database
 from config import Config
 from data_tables.answer import Answer
 from data_tables.question import Question
 from data_tables.response import Response
 from data_tables.survey import Survey 
 from data_tables.section import Section
+from data_tables.question_tally import QuestionTally
+from data_tables.survey_version import SurveyVersion
+from data_tables.report_job import ReportJob
+from data_tables.response_revision import ResponseRevision
+from data_tables.outbound_email import OutboundEmail
+from data_tables.invitation_batch import InvitationBatch
+from data_tables.invitation import Invitation
+from data_tables.results_snapshot import ResultsSnapshot
 from routes.admin import admin_bp
 from routes.take_survey import survey_bp 
+from routes.metrics import metrics_bp
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -18,12 +30,38 @@ app.secret_key = 'dev-secret-key-change-in-production'
 # Initialize Flask-Mail
 mail = Mail(app)
 
-# connect database to app
+# connect database to app (SQLite file by default, DATABASE_URL for another backend)
+configure_database(app)
 db.init_app(app)
 
+# size the survey structure cache from the config
+from utils.survey_cache import survey_cache
+survey_cache.configure(app.config['SURVEY_CACHE_SIZE'], app.config['SURVEY_CACHE_REVALIDATE_SECONDS'])
+
+# background PDF / Excel report generation
+from utils.reports import report_queue
+report_queue.init_app(app)
+
+# live results pushed to the results page
+from utils.live_results import live_results
+live_results.poll_seconds = app.config['LIVE_RESULTS_POLL_SECONDS']
+
+# background email sending, over the Mail instance above
+from utils.mail_queue import mail_queue
+mail_queue.init_app(app)
+
+# SQL counts / timings per request, only when QUERY_STATS=true
+from utils.query_stats import query_stats
+query_stats.init_app(app)
+
+# request latency etc. for /metrics
+from utils.metrics import metrics
+metrics.init_app(app)
+
 # register blueprints
 app.register_blueprint(admin_bp)
 app.register_blueprint(survey_bp)
+app.register_blueprint(metrics_bp)
 
 #create database for folder if it doesnt exist
 database_folder = os.path.join(os.path.dirname(__file__), 'database')
@@ -41,8 +79,105 @@ def home():
 
 # create database tables when app starts
 with app.app_context():
+    # WAL, busy timeout etc. on every connection, before the first one is opened
+    from utils.sqlite_profile import apply_sqlite_pragmas, optimize_sqlite
+    apply_sqlite_pragmas(db.engine, app.config.get('SQLITE_PRAGMAS'))
+
     db.create_all()
     print("database tables created")
 
+    # columns and indexes added to the models after the database file was made
+    # (databases with duplicate answers need "flask remove-duplicate-answers" once first)
+    from utils.schema import create_missing_columns, create_missing_indexes
+    create_missing_columns()
+    create_missing_indexes()
+
+    # reports whose worker process stopped before they were finished
+    report_queue.resume_unfinished()
+
+    # emails that were still waiting to be sent, or whose mailer process stopped
+    mail_queue.resume_pending()
+
+    # databases from before the tally table existed need their tallies built once
+    from utils.tallies import backfill_tallies
+    backfill_tallies()
+
+
+@atexit.register
+def optimize_database():
+    """Refresh SQLite's query planner statistics when the app stops."""
+    with app.app_context():
+        optimize_sqlite(db.engine)
+
+
+# flask verify-tallies / flask rebuild-tallies
+@app.cli.command('verify-tallies')
+@click.option('--survey-id', type=int, default=None, help='Only check this survey.')
+def verify_tallies_command(survey_id):
+    """Recount the answers and report any question whose tally has drifted."""
+    from utils.tallies import verify_tallies
+
+    drift = verify_tallies(survey_id)
+    for item in drift:
+        click.echo(f"question {item['question_id']} {item['column']}: stored {item['stored']}, actual {item['actual']}")
+
+    if drift:
+        click.echo(f'{len(drift)} tally values have drifted. Run "flask rebuild-tallies" to fix them.')
+        raise SystemExit(1)
+    click.echo('All tallies match the answers.')
+
+
+@app.cli.command('rebuild-tallies')
+@click.option('--survey-id', type=int, default=None, help='Only rebuild this survey.')
+def rebuild_tallies_command(survey_id):
+    """Recompute the tallies from the answers table."""
+    from utils.tallies import rebuild_tallies
+
+    from utils.results_snapshot import discard_results_snapshot
+
+    drift = rebuild_tallies(survey_id)
+    # closed surveys' frozen statistics came from the old tallies
+    discard_results_snapshot(survey_id)
+    db.session.commit()
+    click.echo(f'Tallies rebuilt ({len(drift)} drifted values corrected).')
+
+@app.cli.command('remove-duplicate-answers')
+def remove_duplicate_answers_command():
+    """Keep the latest answer per question of each response, then create the unique index on answers."""
+    from utils.schema import remove_duplicate_answers, create_missing_indexes
+
+    removed = remove_duplicate_answers()
+    failed = create_missing_indexes()
+    click.echo(f'Removed {removed} duplicate answers.')
+    if failed:
+        click.echo(f'Could still not create: {", ".join(failed)}')
+        raise SystemExit(1)
+
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Run EXPLAIN QUERY PLAN on the hot queries and fail if any does a full table scan."""
+    from utils.schema import check_query_plans
+
+    if db.engine.dialect.name != 'sqlite':
+        click.echo('Query plans are only checked on SQLite (EXPLAIN QUERY PLAN).')
+        return
+
+    report = check_query_plans()
+    failures = 0
+    for name, result in report.items():
+        status = 'FULL SCAN' if result['full_scans'] else 'ok'
+        click.echo(f'{status:10} {name}')
+        for detail in result['plan']:
+            click.echo(f'           {detail}')
+        if result['full_scans']:
+            failures += 1
+
+    if failures:
+        click.echo(f'{failures} queries do a full table scan.')
+        raise SystemExit(1)
+    click.echo('All hot queries use an index.')
+
+
 if __name__ == '__main__':
     app.run(debug=True, port=5001, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,154 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+"""
+runs the same survey workload against each database backend and checks they
+all end up with the same results.
+
+the workload imports a survey with the bulk import, has respondents answer and
+re-save every section through show_section (answer saves, tally upserts),
+submits their responses, bumps the survey version and then compares the
+statistics, tallies and response counts. SQLite always runs. PostgreSQL runs
+when a URL is given, e.g. a local stand-in:
+
+    WORKLOAD_POSTGRES_URL=postgresql+psycopg2://postgres@localhost/eacts_workload \\
+        python benchmarks/backend_workload.py
+
+every table of the PostgreSQL database is dropped first, so never point it at
+real data.
+"""
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_workload(database_url, respondents, sections, questions, results):
+    """Run the workload in a fresh process (the app reads its database URL once, at import)."""
+    sys.path.insert(0, REPO_DIR)
+    os.chdir(tempfile.mkdtemp(prefix='eacts-workload-'))
+
+    import config
+    config.Config.SQLALCHEMY_DATABASE_URI = database_url
+
+    from app import app
+    from database import db
+    from data_tables.response import Response
+    from data_tables.survey import Survey
+    from utils.bulk_import import insert_sections_with_questions
+    from utils.statistics import get_survey_statistics
+    from utils.survey_cache import bump_survey_version, survey_cache
+    from utils.tallies import verify_tallies
+
+    app.config['TESTING'] = True
+    timings = {}
+
+    with app.app_context():
+        # start from empty tables
+        db.drop_all()
+        db.create_all()
+
+        started = time.perf_counter()
+        survey = Survey(title='Workload survey', description='', is_active=True)
+        db.session.add(survey)
+        db.session.flush()
+        pairs = ((f'Section {s}', f'Statement {s}.{q}') for s in range(1, sections + 1) for q in range(1, questions + 1))
+        insert_sections_with_questions(survey.id, pairs)
+        db.session.commit()
+        survey_id = survey.id
+        timings['bulk import'] = time.perf_counter() - started
+
+        structure = survey_cache.get(survey_id)
+
+    started = time.perf_counter()
+    for respondent in range(respondents):
+        client = app.test_client()
+        for section_num, section in enumerate(structure.sections, start=1):
+            url = f'/survey/{survey_id}/section/{section_num}'
+            # save once, then change some answers and move on / submit
+            for attempt in range(2):
+                form = {'participant_name': f'Respondent {respondent}'}
+                for question in section.questions:
+                    form[f'question_{question.id}'] = ('Yes', 'No', 'Abstain')[(respondent + question.id + attempt) % 3]
+                if attempt == 0:
+                    form['action'] = 'save'
+                else:
+                    last = section_num == len(structure.sections)
+                    form['action'] = 'submit' if last and respondent % 4 else 'next'
+                response = client.post(url, data=form)
+                if response.status_code >= 500:
+                    raise RuntimeError(f'{url} failed with {response.status_code}')
+    timings['answer saves'] = time.perf_counter() - started
+
+    with app.app_context():
+        bump_survey_version(survey_id)
+        db.session.commit()
+
+        started = time.perf_counter()
+        statistics = get_survey_statistics(survey_id)
+        complete_statistics = get_survey_statistics(survey_id, completed_only=True)
+        timings['statistics'] = time.perf_counter() - started
+
+        results.put({
+            'backend': db.engine.dialect.name,
+            'timings': timings,
+            'tally_drift': len(verify_tallies(survey_id)),
+            'responses': Response.query.filter_by(survey_id=survey_id).count(),
+            'complete': Response.query.filter_by(survey_id=survey_id, is_complete=True).count(),
+            'statistics': [[s['question_text'], s['yes_count'], s['no_count'], s['abstain_count']] for s in statistics],
+            'complete_statistics': [[s['yes_count'], s['no_count'], s['abstain_count']] for s in complete_statistics],
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--respondents', type=int, default=30)
+    parser.add_argument('--sections', type=int, default=3)
+    parser.add_argument('--questions', type=int, default=10, help='questions per section')
+    args = parser.parse_args()
+
+    database_urls = [f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='eacts-workload-'), 'workload.db')}"]
+    if os.environ.get('WORKLOAD_POSTGRES_URL'):
+        database_urls.append(os.environ['WORKLOAD_POSTGRES_URL'])
+    else:
+        print('WORKLOAD_POSTGRES_URL not set, PostgreSQL skipped')
+
+    context = multiprocessing.get_context('spawn')
+    outcomes = []
+    for database_url in database_urls:
+        results = context.Queue()
+        process = context.Process(target=run_workload,
+                                  args=(database_url, args.respondents, args.sections, args.questions, results))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            print(f'workload failed on {database_url}')
+            raise SystemExit(1)
+        outcomes.append(results.get())
+
+    failed = False
+    for outcome in outcomes:
+        timings = ', '.join(f'{name} {seconds:.2f}s' for name, seconds in outcome['timings'].items())
+        print(f"{outcome['backend']:12} {outcome['responses']} responses ({outcome['complete']} complete), "
+              f"tally drift {outcome['tally_drift']}, {timings}")
+        if outcome['tally_drift']:
+            failed = True
+
+    reference = outcomes[0]
+    for outcome in outcomes[1:]:
+        for key in ['responses', 'complete', 'statistics', 'complete_statistics']:
+            if outcome[key] != reference[key]:
+                print(f"{outcome['backend']} differs from {reference['backend']} in {key}:")
+                print(json.dumps({reference['backend']: reference[key], outcome['backend']: outcome[key]})[:2000])
+                failed = True
+
+    if failed:
+        raise SystemExit(1)
+    print('all backends agree')
+
+
+if __name__ == '__main__':
+    main()
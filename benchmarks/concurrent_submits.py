@@ -0,0 +1,170 @@
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+"""
+benchmark of many respondents answering the same survey at the same time.
+
+starts several worker processes (like the processes of a production server),
+each running a few threads, and every simulated respondent posts all the
+sections of a survey through show_section and submits it. prints how many
+requests failed and how long they took, for the tuned SQLite profile in
+config.py and for SQLite's defaults:
+
+    python benchmarks/concurrent_submits.py
+    python benchmarks/concurrent_submits.py --profile default
+
+each run uses a fresh database in a temporary folder, never database/eacts_survey.db.
+"""
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app(database_path, profile):
+    """Import the app against the benchmark database with the chosen profile."""
+    sys.path.insert(0, REPO_DIR)
+    os.chdir(os.path.dirname(database_path))
+
+    import config
+    config.Config.SQLALCHEMY_DATABASE_URI = f'sqlite:///{database_path}'
+    if profile == 'default':
+        # what the app used before the tuning profile: sqlite3's 5 second
+        # lock timeout, rollback journal and the default pool
+        config.Config.SQLITE_PRAGMAS = {}
+        config.Config.SQLITE_CONNECT_ARGS = {}
+        config.Config.SQLALCHEMY_ENGINE_OPTIONS = {}
+
+    from app import app
+    return app
+
+
+def create_survey(app, sections, questions_per_section):
+    from database import db
+    from data_tables.survey import Survey
+    from data_tables.section import Section
+    from utils.bulk_import import insert_questions
+
+    with app.app_context():
+        survey = Survey(title='Benchmark survey', description='', is_active=True)
+        db.session.add(survey)
+        db.session.flush()
+
+        for section_number in range(1, sections + 1):
+            section = Section(survey_id=survey.id, section_number=section_number, title=f'Section {section_number}')
+            db.session.add(section)
+            db.session.flush()
+            insert_questions(section.id, (f'Statement {section_number}.{n}' for n in range(1, questions_per_section + 1)))
+
+        db.session.commit()
+        return survey.id
+
+
+def respond(client, survey_structure, respondent, timings):
+    """Answer every section of the survey and submit. Returns the number of failed requests."""
+    failures = 0
+    sections = survey_structure.sections
+
+    for section_num, section in enumerate(sections, start=1):
+        form = {'action': 'submit' if section_num == len(sections) else 'next'}
+        if section_num == 1:
+            form['participant_name'] = f'Respondent {respondent}'
+        for question in section.questions:
+            form[f'question_{question.id}'] = ('Yes', 'No', 'Abstain')[(respondent + question.id) % 3]
+
+        started = time.perf_counter()
+        response = client.post(f'/survey/{survey_structure.id}/section/{section_num}', data=form)
+        timings.append(time.perf_counter() - started)
+
+        if response.status_code >= 500:
+            failures += 1
+
+    return failures
+
+
+def run_worker(database_path, profile, survey_id, threads, respondents, worker_number, results):
+    """One server process: `threads` threads sharing `respondents` respondents."""
+    import threading
+
+    app = load_app(database_path, profile)
+    from utils.survey_cache import survey_cache
+
+    with app.app_context():
+        survey_structure = survey_cache.get(survey_id)
+
+    timings = []
+    failures = []
+    barrier = threading.Barrier(threads)
+
+    def thread_main(thread_number):
+        client = app.test_client()
+        barrier.wait()
+        for respondent in range(thread_number, respondents, threads):
+            # a new client per respondent, so each one gets their own session
+            client = app.test_client()
+            failures.append(respond(client, survey_structure, worker_number * respondents + respondent, timings))
+
+    workers = [threading.Thread(target=thread_main, args=(n,)) for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    results.put({'timings': timings, 'failures': sum(failures)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profile', choices=['tuned', 'default'], default='tuned')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8, help='threads per process')
+    parser.add_argument('--respondents', type=int, default=40, help='respondents per process')
+    parser.add_argument('--sections', type=int, default=4)
+    parser.add_argument('--questions', type=int, default=15, help='questions per section')
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix='eacts-benchmark-')
+    database_path = os.path.join(folder, 'benchmark.db')
+
+    app = load_app(database_path, args.profile)
+    survey_id = create_survey(app, args.sections, args.questions)
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [
+        context.Process(target=run_worker,
+                        args=(database_path, args.profile, survey_id, args.threads, args.respondents, n, results))
+        for n in range(args.processes)
+    ]
+
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    worker_results = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+
+    timings = sorted(t for result in worker_results for t in result['timings'])
+    failures = sum(result['failures'] for result in worker_results)
+
+    from data_tables.response import Response
+    with app.app_context():
+        complete = Response.query.filter_by(survey_id=survey_id, is_complete=True).count()
+
+    print(f'profile:            {args.profile}')
+    print(f'concurrency:        {args.processes} processes x {args.threads} threads')
+    print(f'requests:           {len(timings)} ({failures} failed)')
+    print(f'complete responses: {complete} of {args.processes * args.respondents}')
+    print(f'elapsed:            {elapsed:.2f}s ({len(timings) / elapsed:.0f} requests/s)')
+    if timings:
+        print(f'latency p50:        {statistics.median(timings) * 1000:.1f}ms')
+        print(f'latency p95:        {timings[int(len(timings) * 0.95) - 1] * 1000:.1f}ms')
+        print(f'latency max:        {timings[-1] * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
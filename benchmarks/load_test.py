@@ -0,0 +1,433 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import resource
+import secrets
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+"""
+load test of a respondent wave with admins reporting at the same time.
+
+builds a synthetic survey of --sections x --questions with --respondents
+earlier responses in a fresh SQLite database, then drives the real app through
+its test client from several threads:
+
+- respondents open the survey, autosave a few answers, go through every
+  section with next, save one section for later and submit
+- admins load the dashboard, results and responses pages and export the
+  reports, waiting for the background report jobs to finish
+
+every request is timed and its SQL statements counted, and the summary
+(p50 / p95 / p99 latency and queries per request for each step, peak memory)
+is printed as JSON. keep the output of a commit to compare a later one with:
+
+    python benchmarks/load_test.py --output before.json
+    python benchmarks/load_test.py --compare before.json
+
+the same --seed gives the same survey, answers and journeys. each run uses a
+fresh database in a temporary folder, never database/eacts_survey.db.
+"""
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# how long to wait for one background report before counting it as failed
+REPORT_TIMEOUT_SECONDS = 120
+
+CHOICES = ['Yes', 'Yes', 'No', 'Abstain']
+
+
+def load_app(database_path):
+    """Import the app against the benchmark database."""
+    sys.path.insert(0, REPO_DIR)
+    os.chdir(os.path.dirname(database_path))
+
+    import config
+    config.Config.SQLALCHEMY_DATABASE_URI = f'sqlite:///{database_path}'
+
+    # the app prints while it starts, stdout is only for the JSON summary
+    with contextlib.redirect_stdout(sys.stderr):
+        from app import app
+    app.config['TESTING'] = True
+    return app
+
+
+def seed_survey(app, sections, questions_per_section, respondents, rng):
+    """
+    Create the survey and its earlier responses with bulk inserts.
+
+    About 80% of the responses are complete and every respondent skips some
+    questions and leaves some comments, so the reports have real work to do.
+
+    Returns:
+        Id of the survey
+    """
+    from database import db
+    from data_tables.answer import Answer
+    from data_tables.question import Question
+    from data_tables.response import Response
+    from data_tables.section import Section
+    from data_tables.survey import Survey
+    from utils.bulk_import import insert_rows, insert_rows_returning_ids, insert_sections_with_questions
+    from utils.tallies import rebuild_tallies
+
+    with app.app_context():
+        survey = Survey(title='Load test survey', description='Synthetic survey', is_active=True)
+        db.session.add(survey)
+        db.session.flush()
+
+        pairs = ((f'Section {s}', f'Statement {s}.{q}')
+                 for s in range(1, sections + 1) for q in range(1, questions_per_section + 1))
+        insert_sections_with_questions(survey.id, pairs)
+
+        question_ids = [
+            question_id for question_id, in
+            db.session.query(Question.id).join(Section, Question.section_id == Section.id)
+            .filter(Section.survey_id == survey.id).order_by(Question.id)
+        ]
+
+        response_ids = insert_rows_returning_ids(Response.__table__, (
+            {
+                'survey_id': survey.id,
+                'participant_name': f'Respondent {n}',
+                'resume_token': secrets.token_urlsafe(24),
+                'submitted_at': datetime.utcnow(),
+                'is_complete': rng.random() < 0.8,
+            }
+            for n in range(respondents)
+        ))
+
+        def answer_rows():
+            for response_id in response_ids:
+                for question_id in question_ids:
+                    if rng.random() < 0.9:
+                        yield {
+                            'response_id': response_id,
+                            'question_id': question_id,
+                            'choice': rng.choice(CHOICES),
+                            'elaboration': f'Comment from {response_id}' if rng.random() < 0.15 else None,
+                        }
+
+        insert_rows(Answer.__table__, answer_rows())
+        rebuild_tallies(survey.id)
+        db.session.commit()
+
+        return survey.id
+
+
+class Recorder:
+    """
+    Collects the latency and SQL statement count of every request.
+
+    The test client runs the request in the calling thread, so the statements
+    are counted per thread; report jobs run in their own threads and aren't
+    counted against the request that queued them.
+    """
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.samples = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._count_query)
+
+    def _count_query(self, conn, cursor, statement, parameters, context, executemany):
+        self.local.queries = getattr(self.local, 'queries', 0) + 1
+
+    def request(self, client, label, method, url, **kwargs):
+        """Send one request and record it. Returns the response."""
+        self.local.queries = 0
+        started = time.perf_counter()
+        response = client.open(url, method=method, **kwargs)
+        elapsed = time.perf_counter() - started
+
+        self.add(label, elapsed, self.local.queries, response.status_code >= 400)
+        return response
+
+    def add(self, label, seconds, queries=None, failed=False):
+        with self.lock:
+            self.samples.append((label, seconds, queries, failed))
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return None
+    rank = max(1, int(round(p / 100 * len(values) + 0.4999)))
+    return values[min(rank, len(values)) - 1]
+
+
+def respondent_journey(client, recorder, survey_structure, respondent, rng):
+    """Open the survey, autosave, go through every section, save once and submit."""
+    survey_id = survey_structure.id
+    sections = survey_structure.sections
+    save_at = rng.randint(1, len(sections))
+
+    recorder.request(client, 'open', 'GET', f'/survey/{survey_id}')
+
+    for section_num, section in enumerate(sections, start=1):
+        url = f'/survey/{survey_id}/section/{section_num}'
+        recorder.request(client, 'section', 'GET', url)
+
+        form = {}
+        if section_num == 1:
+            form['participant_name'] = f'Wave respondent {respondent}'
+        for question in section.questions:
+            form[f'question_{question.id}'] = rng.choice(CHOICES)
+            if rng.random() < 0.15:
+                form[f'elaboration_{question.id}'] = f'Comment from wave respondent {respondent}'
+
+        # the first answers of a section arrive through autosave while they click
+        for question in section.questions[:2]:
+            recorder.request(client, 'autosave', 'POST', f'/survey/{survey_id}/autosave', json={
+                'question_id': question.id,
+                'choice': form[f'question_{question.id}'],
+                'elaboration': form.get(f'elaboration_{question.id}', ''),
+            })
+
+        if section_num == save_at:
+            recorder.request(client, 'save', 'POST', url, data=dict(form, action='save'))
+
+        last = section_num == len(sections)
+        recorder.request(client, 'submit' if last else 'next', 'POST', url,
+                         data=dict(form, action='submit' if last else 'next'))
+
+
+def wait_for_report(app, recorder, survey_id, report_format, started):
+    """Wait for the newest report job of a format and record how long it took. Returns the job id."""
+    from data_tables.report_job import ReportJob
+
+    while time.perf_counter() - started < REPORT_TIMEOUT_SECONDS:
+        # a new app context is a new session, so every poll sees the worker's commits
+        with app.app_context():
+            job = (ReportJob.query.filter_by(survey_id=survey_id, report_format=report_format)
+                   .order_by(ReportJob.id.desc()).first())
+            status = job.status if job else None
+            job_id = job.id if job else None
+
+        if status in ('done', 'failed'):
+            recorder.add(f'report_{report_format}', time.perf_counter() - started, failed=status == 'failed')
+            return job_id if status == 'done' else None
+        time.sleep(0.05)
+
+    recorder.add(f'report_{report_format}', time.perf_counter() - started, failed=True)
+    return None
+
+
+def admin_round(app, client, recorder, survey_id, pages, rng):
+    """One admin looking through the results and exporting the reports."""
+    recorder.request(client, 'dashboard', 'GET', '/admin/')
+    recorder.request(client, 'results', 'GET', f'/admin/results/{survey_id}')
+    recorder.request(client, 'responses', 'GET', f'/admin/responses/{survey_id}?page={rng.randint(1, pages)}')
+    recorder.request(client, 'responses_filtered', 'GET',
+                     f'/admin/responses/{survey_id}?status=complete&name=Respondent+{rng.randint(1, 9)}')
+
+    exports = [
+        ('xlsx', f'/admin/export-excel/{survey_id}'),
+        ('xlsx_raw', f'/admin/export-excel/{survey_id}?raw=1'),
+        ('pdf', f'/admin/export-pdf/{survey_id}'),
+    ]
+    for report_format, url in exports:
+        started = time.perf_counter()
+        response = recorder.request(client, f'export_{report_format}', 'GET', url)
+
+        # a report made earlier for the same answers comes straight back
+        if response.status_code == 200:
+            continue
+
+        job_id = wait_for_report(app, recorder, survey_id, report_format, started)
+        if job_id is not None:
+            recorder.request(client, 'download', 'GET', f'/admin/report/{job_id}')
+
+
+def run_threads(count, target):
+    """Run target(thread_number) on `count` threads started together."""
+    barrier = threading.Barrier(count)
+    errors = []
+
+    def thread_main(thread_number):
+        barrier.wait()
+        try:
+            target(thread_number)
+        except Exception as error:
+            errors.append(error)
+            print(f'Load test thread {thread_number} failed: {error!r}', file=sys.stderr)
+
+    threads = [threading.Thread(target=thread_main, args=(n,)) for n in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, errors
+
+
+def summarize(samples):
+    """Latency percentiles and queries per request for every step."""
+    by_label = {}
+    for label, seconds, queries, failed in samples:
+        by_label.setdefault(label, []).append((seconds, queries, failed))
+
+    endpoints = {}
+    for label in sorted(by_label):
+        rows = by_label[label]
+        timings = sorted(seconds * 1000 for seconds, _, _ in rows)
+        queries = [count for _, count, _ in rows if count is not None]
+
+        endpoints[label] = {
+            'count': len(rows),
+            'failed': sum(1 for _, _, failed in rows if failed),
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'max_ms': round(timings[-1], 2),
+            'queries_mean': round(sum(queries) / len(queries), 2) if queries else None,
+            'queries_max': max(queries) if queries else None,
+        }
+    return endpoints
+
+
+def git_commit():
+    """Commit the benchmark ran against, if the repo is a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(baseline, current):
+    """Print the p95 latency and queries per request next to a baseline run."""
+    if baseline.get('config') != current['config']:
+        print('warning: the runs used different settings, the numbers may not be comparable', file=sys.stderr)
+
+    print(f"{'step':<20} {'p95 before':>11} {'p95 now':>9} {'change':>8} {'queries':>15}", file=sys.stderr)
+
+    for label, now in current['endpoints'].items():
+        before = baseline.get('endpoints', {}).get(label)
+        if before is None:
+            print(f'{label:<20} {"-":>11} {now["p95_ms"]:>9.1f}', file=sys.stderr)
+            continue
+
+        change = (now['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0
+        queries = f"{before['queries_mean']} -> {now['queries_mean']}" if now['queries_mean'] is not None else ''
+        print(f"{label:<20} {before['p95_ms']:>11.1f} {now['p95_ms']:>9.1f} {change:>+7.0f}% {queries:>15}",
+              file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sections', type=int, default=5)
+    parser.add_argument('--questions', type=int, default=20, help='questions per section')
+    parser.add_argument('--respondents', type=int, default=500, help='earlier responses in the database')
+    parser.add_argument('--wave', type=int, default=40, help='respondents taking the survey during the test')
+    parser.add_argument('--threads', type=int, default=8, help='threads the wave is spread over')
+    parser.add_argument('--admins', type=int, default=2, help='admin threads running at the same time')
+    parser.add_argument('--admin-rounds', type=int, default=3, help='rounds of pages and exports per admin')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='also measure peak Python allocations with tracemalloc (slower)')
+    parser.add_argument('--output', help='write the JSON summary to this file as well')
+    parser.add_argument('--compare', help='JSON summary of an earlier run to compare with')
+    args = parser.parse_args()
+
+    # the app runs from the temporary folder, so keep the paths relative to here
+    output_path = os.path.abspath(args.output) if args.output else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    folder = tempfile.mkdtemp(prefix='eacts-load-test-')
+    database_path = os.path.join(folder, 'load_test.db')
+
+    app = load_app(database_path)
+    rng = random.Random(args.seed)
+
+    seeding_started = time.perf_counter()
+    survey_id = seed_survey(app, args.sections, args.questions, args.respondents, rng)
+    seeding_seconds = time.perf_counter() - seeding_started
+
+    from database import db
+    from utils.response_pivot import RESPONSES_PER_PAGE
+    from utils.survey_cache import survey_cache
+
+    with app.app_context():
+        recorder = Recorder(db.engine)
+        survey_structure = survey_cache.get(survey_id)
+
+    pages = max(1, -(-args.respondents // RESPONSES_PER_PAGE))
+
+    if args.trace_memory:
+        tracemalloc.start()
+
+    def respondent_thread(thread_number):
+        for respondent in range(thread_number, args.wave, args.threads):
+            # a new client per respondent, so each one gets their own session
+            journey_rng = random.Random(args.seed * 100003 + respondent)
+            respondent_journey(app.test_client(), recorder, survey_structure, respondent, journey_rng)
+
+    def admin_thread(thread_number):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['admin_logged_in'] = True
+
+        admin_rng = random.Random(args.seed * 7919 + thread_number)
+        for _ in range(args.admin_rounds):
+            admin_round(app, client, recorder, survey_id, pages, admin_rng)
+
+    started = time.perf_counter()
+    threads, errors = run_threads(args.threads, respondent_thread)
+    if args.admins:
+        admin_threads, admin_errors = run_threads(args.admins, admin_thread)
+        threads += admin_threads
+        errors += admin_errors
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_bytes = max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+    memory = {'peak_rss_mb': round(rss_bytes / 1024 / 1024, 1), 'peak_traced_mb': None}
+    if args.trace_memory:
+        memory['peak_traced_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+        tracemalloc.stop()
+
+    endpoints = summarize(recorder.samples)
+    summary = {
+        'commit': git_commit(),
+        'config': {
+            'sections': args.sections,
+            'questions': args.questions,
+            'respondents': args.respondents,
+            'wave': args.wave,
+            'threads': args.threads,
+            'admins': args.admins,
+            'admin_rounds': args.admin_rounds,
+            'seed': args.seed,
+        },
+        'seeding_seconds': round(seeding_seconds, 2),
+        'elapsed_seconds': round(elapsed, 2),
+        'requests': sum(1 for sample in recorder.samples if sample[2] is not None),
+        'failed': sum(endpoint['failed'] for endpoint in endpoints.values()) + len(errors),
+        'endpoints': endpoints,
+        'memory': memory,
+    }
+
+    output = json.dumps(summary, indent=2)
+    print(output)
+    if output_path:
+        with open(output_path, 'w') as output_file:
+            output_file.write(output + '\n')
+
+    if compare_path:
+        with open(compare_path) as baseline_file:
+            print_comparison(json.load(baseline_file), summary)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+"""
+checks that the main routes stay within a fixed number of SQL statements.
+
+the budgets below are what the routes run today, with a little room. they
+don't depend on how many sections, questions or responses a survey has, so a
+route that goes over its budget on a bigger survey is running a query per
+row (N+1) somewhere:
+
+    python benchmarks/query_budgets.py
+    python benchmarks/query_budgets.py --respondents 2000 --sections 10
+
+exits with 1 when any route is over budget and lists its statements. runs on a
+fresh database in a temporary folder, never database/eacts_survey.db.
+"""
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import load_app, seed_survey
+
+# most SQL statements each route may run, whatever the size of the survey
+RESPONDENT_BUDGETS = [
+    ('open survey', 'GET', '/survey/{survey_id}', {}, 2),
+    ('section page', 'GET', '/survey/{survey_id}/section/1', {}, 3),
+    ('autosave', 'POST', '/survey/{survey_id}/autosave', {'json': 'autosave'}, 10),
+    ('next', 'POST', '/survey/{survey_id}/section/1', {'data': 'next'}, 10),
+    ('save', 'POST', '/survey/{survey_id}/section/2', {'data': 'save'}, 12),
+    ('submit', 'POST', '/survey/{survey_id}/section/{last_section}', {'data': 'submit'}, 12),
+]
+
+ADMIN_BUDGETS = [
+    ('dashboard', 'GET', '/admin/', {}, 6),
+    ('results', 'GET', '/admin/results/{survey_id}', {}, 6),
+    ('responses', 'GET', '/admin/responses/{survey_id}', {}, 6),
+    ('responses page 2', 'GET', '/admin/responses/{survey_id}?page=2&status=complete', {}, 6),
+    ('edit survey', 'GET', '/admin/edit/{survey_id}', {}, 4),
+    ('invitations', 'GET', '/admin/invite/{survey_id}', {}, 8),
+    ('excel export', 'GET', '/admin/export-excel/{survey_id}', {}, 10),
+]
+
+
+def section_form(section, action):
+    """Answers to every question of a section."""
+    form = {'action': action}
+    for question in section.questions:
+        form[f'question_{question.id}'] = 'Yes'
+    return form
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sections', type=int, default=4)
+    parser.add_argument('--questions', type=int, default=15, help='questions per section')
+    parser.add_argument('--respondents', type=int, default=200, help='earlier responses in the database')
+    args = parser.parse_args()
+
+    database_path = os.path.join(tempfile.mkdtemp(prefix='eacts-query-budgets-'), 'query_budgets.db')
+    app = load_app(database_path)
+    survey_id = seed_survey(app, args.sections, args.questions, args.respondents, random.Random(1))
+
+    from utils.query_stats import assert_query_budget
+    from utils.survey_cache import survey_cache
+
+    with app.app_context():
+        structure = survey_cache.get(survey_id)
+    sections = structure.sections
+    first_question = sections[0].questions[0]
+
+    bodies = {
+        'autosave': {'question_id': first_question.id, 'choice': 'No', 'elaboration': ''},
+        'next': section_form(sections[0], 'next'),
+        'save': section_form(sections[1 % len(sections)], 'save'),
+        'submit': section_form(sections[-1], 'submit'),
+    }
+
+    respondent = app.test_client()
+    admin = app.test_client()
+    with admin.session_transaction() as session:
+        session['admin_logged_in'] = True
+
+    failures = 0
+    for client, budgets in [(respondent, RESPONDENT_BUDGETS), (admin, ADMIN_BUDGETS)]:
+        for name, method, url, body, max_queries in budgets:
+            url = url.format(survey_id=survey_id, last_section=len(sections))
+            kwargs = {key: bodies[value] for key, value in body.items()}
+            try:
+                assert_query_budget(client, url, max_queries, method=method, **kwargs)
+                print(f'ok          {name}')
+            except AssertionError as error:
+                failures += 1
+                print(f'OVER BUDGET {name}\n{error}')
+
+    if failures:
+        print(f'{failures} routes are over their query budget.')
+        raise SystemExit(1)
+    print('All routes are within their query budget.')
+
+
+if __name__ == '__main__':
+    main()
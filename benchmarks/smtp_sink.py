@@ -0,0 +1,135 @@
+import argparse
+import socketserver
+import threading
+import time
+
+"""
+a local SMTP server that accepts every email and keeps it in memory, to try
+the mailer without a real mail server. it can be made slow (--delay) or fail
+the first attempts at each message (--fail-first) to see the retries.
+
+    python benchmarks/smtp_sink.py --port 8025 --delay 3
+    MAIL_SERVER=localhost MAIL_PORT=8025 MAIL_USE_TLS=false \\
+        MAIL_DEFAULT_SENDER=survey@localhost python app.py
+
+it can also be started from a script: sink = SMTPSink(port=0).start(), then
+sink.messages holds (sender, recipients, data) for every accepted email.
+"""
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: HELO/EHLO, MAIL, RCPT, DATA, RSET, NOOP, QUIT."""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode('utf-8'))
+
+    def handle(self):
+        sink = self.server.sink
+        sender, recipients = None, []
+        self.reply('220 smtp-sink ready')
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command[:4].upper()
+
+            if verb in ('HELO', 'EHLO'):
+                self.reply('250 smtp-sink')
+            elif verb == 'MAIL':
+                sender, recipients = command[10:].strip(' <>'), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command[8:].strip(' <>'))
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b'.\r\n', b'.\n'):
+                        break
+                    data.append(data_line)
+                time.sleep(sink.delay)
+                if sink.should_fail():
+                    self.reply('451 Temporary failure, try again later')
+                else:
+                    sink.accept(sender, recipients, b''.join(data))
+                    self.reply('250 OK queued')
+            elif verb == 'RSET':
+                sender, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class SMTPSink:
+    """SMTP server on a background thread that stores what it receives."""
+
+    def __init__(self, host='localhost', port=8025, delay=0.0, fail_first=0):
+        self.delay = delay
+        self.fail_first = fail_first
+        self.messages = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._failed = 0
+
+        self.server = socketserver.ThreadingTCPServer((host, port), SMTPSinkHandler)
+        self.server.daemon_threads = True
+        self.server.sink = self
+        self.port = self.server.server_address[1]
+
+        original_process_request = self.server.process_request
+
+        def process_request(request, client_address):
+            with self._lock:
+                self.connections += 1
+            original_process_request(request, client_address)
+
+        self.server.process_request = process_request
+
+    def should_fail(self):
+        with self._lock:
+            if self._failed < self.fail_first:
+                self._failed += 1
+                return True
+            return False
+
+    def accept(self, sender, recipients, data):
+        with self._lock:
+            self.messages.append((sender, recipients, data))
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='smtp-sink', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to wait before accepting each email')
+    parser.add_argument('--fail-first', type=int, default=0, help='reject this many emails with a temporary error')
+    args = parser.parse_args()
+
+    sink = SMTPSink(port=args.port, delay=args.delay, fail_first=args.fail_first)
+    print(f'SMTP sink listening on localhost:{sink.port}')
+    try:
+        sink.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    for sender, recipients, data in sink.messages:
+        print(f'{sender} -> {", ".join(recipients)} ({len(data)} bytes)')
+
+
+if __name__ == '__main__':
+    main()
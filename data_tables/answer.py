@@ -8,6 +8,12 @@ class Answer(db.Model):
 
     __tablename__ = 'answers'
 
+    # one answer per person per question, and fast lookups by response or question
+    __table_args__ = (
+        db.Index('uq_answers_response_question', 'response_id', 'question_id', unique=True),
+        db.Index('ix_answers_question_choice', 'question_id', 'choice'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     response_id = db.Column(db.Integer, db.ForeignKey('responses.id'), nullable=False)
     question_id= db.Column(db.Integer, db.ForeignKey('questions.id'), nullable=False)
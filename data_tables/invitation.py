@@ -0,0 +1,24 @@
+from database import db
+
+class Invitation(db.Model):
+    """
+    one person invited to a survey and the email that sends them their personal
+    link. their response is only made once they save a first answer, with the
+    invitation's token as its resume token, so people who never open the link
+    aren't counted as responses.
+    """
+
+    __tablename__ = 'invitations'
+
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.Integer, db.ForeignKey('invitation_batches.id'), nullable=False, index=True)
+    email_id = db.Column(db.Integer, db.ForeignKey('outbound_emails.id'), nullable=False)
+
+    email = db.Column(db.String(200), nullable=False)
+    name = db.Column(db.String(200))
+
+    # the personal link, and the resume token of their response once they start
+    token = db.Column(db.String(64), unique=True, nullable=False)
+
+    def __repr__(self):
+        return f'<Invitation {self.id}: {self.email} in Batch {self.batch_id}>'
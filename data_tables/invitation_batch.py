@@ -0,0 +1,28 @@
+from database import db
+from datetime import datetime
+
+class InvitationBatch(db.Model):
+    """
+    one recipient list uploaded by an admin to invite people to a survey.
+
+    every recipient gets an Invitation (their own link and email), and the
+    invitations page shows how far the sending of each batch has got.
+    """
+
+    __tablename__ = 'invitation_batches'
+
+    id = db.Column(db.Integer, primary_key=True)
+    survey_id = db.Column(db.Integer, db.ForeignKey('surveys.id'), nullable=False, index=True)
+
+    file_name = db.Column(db.String(255))
+
+    # recipients invited, and the ones left out (invalid or already invited)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    skipped = db.Column(db.Integer, nullable=False, default=0)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    invitations = db.relationship('Invitation', backref='batch', lazy=True, cascade='all, delete-orphan')
+
+    def __repr__(self):
+        return f'<InvitationBatch {self.id} for Survey {self.survey_id}: {self.total} recipients>'
@@ -0,0 +1,42 @@
+from database import db
+from datetime import datetime
+
+class OutboundEmail(db.Model):
+    """
+    one email waiting to be sent, or already sent, by the background mailer.
+
+    requests only add a row here and return, the mail queue (utils/mail_queue.py)
+    sends it over SMTP and records how delivery went.
+    """
+
+    __tablename__ = 'outbound_emails'
+
+    # the mailer looks for queued emails that are due
+    __table_args__ = (
+        db.Index('ix_outbound_emails_status_due', 'status', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    # what the email is for, e.g. 'resume'
+    kind = db.Column(db.String(20), nullable=False)
+
+    recipient = db.Column(db.String(200), nullable=False)
+    subject = db.Column(db.String(300), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+
+    # 'queued', 'sending', 'sent' or 'failed' (gave up after MAIL_MAX_ATTEMPTS)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    # when a mailer marked it 'sending'. one still sending after
+    # MAIL_STALE_SECONDS lost its process and is queued again
+    claimed_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<OutboundEmail {self.id}: {self.kind} to {self.recipient} ({self.status})>'
@@ -6,12 +6,19 @@ this is for one question of one survey and its linked its responses (yes/no.abst
 class Question(db.Model):
     __tablename__ = 'questions'
 
+    # questions of a section are always loaded in order
+    __table_args__ = (
+        db.Index('ix_questions_section_number', 'section_id', 'question_number'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     section_id = db.Column(db.Integer, db.ForeignKey('sections.id'), nullable=False)
     question_number = db.Column(db.Integer, nullable=False)
     question_text = db.Column(db.Text, nullable=False)
     # each question is connected to answers from responders  
     answers = db.relationship('Answer', backref='question', lazy=True, cascade='all, delete-orphan')
+    # running yes/no/abstain counts, removed together with the question
+    tally = db.relationship('QuestionTally', backref='question', lazy=True, uselist=False, cascade='all, delete-orphan')
 
     def __repr__(self):
         return f'<Question: {self.question_number}: {self.question_text[:50]}...'
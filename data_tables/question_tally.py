@@ -0,0 +1,27 @@
+from database import db
+
+class QuestionTally(db.Model):
+    """
+    running yes/no/abstain counts for one question so results don't have to
+    recount every answer.
+
+    the counts are kept up to date when answers are saved (see utils/tallies.py).
+    the complete_* columns only count answers from responses that were submitted.
+    """
+
+    __tablename__ = 'question_tallies'
+
+    question_id = db.Column(db.Integer, db.ForeignKey('questions.id'), primary_key=True)
+
+    # every saved answer, including surveys still in progress
+    yes_count = db.Column(db.Integer, nullable=False, default=0)
+    no_count = db.Column(db.Integer, nullable=False, default=0)
+    abstain_count = db.Column(db.Integer, nullable=False, default=0)
+
+    # only answers of submitted (is_complete) responses
+    complete_yes_count = db.Column(db.Integer, nullable=False, default=0)
+    complete_no_count = db.Column(db.Integer, nullable=False, default=0)
+    complete_abstain_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<QuestionTally for Question {self.question_id}: {self.yes_count}/{self.no_count}/{self.abstain_count}>'
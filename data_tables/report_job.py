@@ -0,0 +1,43 @@
+from database import db
+from datetime import datetime
+
+class ReportJob(db.Model):
+    """
+    one PDF or Excel report of a survey generated in the background.
+
+    the finished file is stored under the upload folder and served again for
+    as long as the survey's data_version hasn't changed (no new answers).
+    """
+
+    __tablename__ = 'report_jobs'
+
+    __table_args__ = (
+        db.Index('ix_report_jobs_survey_format', 'survey_id', 'report_format'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    survey_id = db.Column(db.Integer, db.ForeignKey('surveys.id'), nullable=False)
+
+    # 'pdf', 'xlsx' or 'xlsx_raw' (see REPORT_FORMATS in utils/reports.py)
+    report_format = db.Column(db.String(20), nullable=False)
+
+    # 'queued', 'running', 'done' or 'failed'
+    status = db.Column(db.String(20), nullable=False, default='queued')
+
+    # version of the survey's answers the report was made from
+    data_version = db.Column(db.String(100), nullable=False)
+
+    file_path = db.Column(db.String(500))
+    error = db.Column(db.Text)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # when a worker last queued or started the job. a queued or running job
+    # not taken up again for REPORT_STALE_SECONDS lost its process and is
+    # picked up by another one
+    claimed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<ReportJob {self.id}: {self.report_format} for Survey {self.survey_id} ({self.status})>'
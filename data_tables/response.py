@@ -10,6 +10,11 @@ class Response(db.Model):
 
     __tablename__ = 'responses'
 
+    # counting / listing the complete or in-progress responses of a survey
+    __table_args__ = (
+        db.Index('ix_responses_survey_complete', 'survey_id', 'is_complete'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     survey_id = db.Column(db.Integer, db.ForeignKey('surveys.id'), nullable=False)
 
@@ -29,9 +34,17 @@ class Response(db.Model):
 
     answers = db.relationship('Answer', backref='response', lazy=True, cascade='all, delete-orphan')
 
+    # how many times the answers were changed, removed together with the response
+    revision = db.relationship('ResponseRevision', lazy=True, uselist=False, cascade='all, delete-orphan')
+
+    @staticmethod
+    def new_resume_token():
+        """A new random resume token, for a response that doesn't exist yet."""
+        return secrets.token_urlsafe(32)
+
     def generate_resume_token(self):
         """Generate unique token for resuming."""
-        self.resume_token = secrets.token_urlsafe(32)
+        self.resume_token = Response.new_resume_token()
         return self.resume_token
     
 
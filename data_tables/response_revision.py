@@ -0,0 +1,18 @@
+from database import db
+
+class ResponseRevision(db.Model):
+    """
+    counter that goes up every time a response's answers are changed.
+
+    answers are updated in place, so their ids and count don't show that a
+    choice or comment was edited. reports use the sum of these counters (see
+    get_data_version in utils/reports.py) to know the answers changed.
+    """
+
+    __tablename__ = 'response_revisions'
+
+    response_id = db.Column(db.Integer, db.ForeignKey('responses.id'), primary_key=True)
+    revision = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ResponseRevision {self.revision} for Response {self.response_id}>'
@@ -0,0 +1,25 @@
+from database import db
+from datetime import datetime
+
+class ResultsSnapshot(db.Model):
+    """
+    frozen results of a closed survey: statistics, comments and every
+    respondent's answers, as zlib-compressed JSON.
+
+    made when the survey is deactivated and thrown away when it is reopened or
+    its answers change, so while it exists it matches the database (see
+    utils/results_snapshot.py).
+    """
+
+    __tablename__ = 'results_snapshots'
+
+    survey_id = db.Column(db.Integer, db.ForeignKey('surveys.id'), primary_key=True)
+
+    # get_data_version() of the survey when the snapshot was made
+    data_version = db.Column(db.String(100), nullable=False)
+
+    payload = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ResultsSnapshot of Survey {self.survey_id} ({self.data_version})>'
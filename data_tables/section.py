@@ -12,6 +12,11 @@ class Section(db.Model):
     """
     
     __tablename__ = 'sections'
+
+    # sections of a survey are always loaded in order
+    __table_args__ = (
+        db.Index('ix_sections_survey_number', 'survey_id', 'section_number'),
+    )
     
     # Columns
     id = db.Column(db.Integer, primary_key=True)
@@ -22,7 +27,8 @@ class Section(db.Model):
     
     # Relationships
     # This section has many questions
-    questions = db.relationship('Question', backref='section', lazy=True, cascade='all, delete-orphan')
+    questions = db.relationship('Question', backref='section', lazy=True, cascade='all, delete-orphan',
+                                order_by='Question.question_number')
     
     def __repr__(self):
         return f'<Section {self.section_number}: {self.title}>'
\ No newline at end of file
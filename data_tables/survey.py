@@ -10,6 +10,11 @@ class Survey(db.Model):
     """
     
     __tablename__ = 'surveys'
+
+    # the dashboard lists surveys newest first, a page at a time
+    __table_args__ = (
+        db.Index('ix_surveys_created_id', 'created_at', 'id'),
+    )
     
     # Columns
     id = db.Column(db.Integer, primary_key=True)
@@ -19,8 +24,13 @@ class Survey(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     
     # Relationships
-    sections = db.relationship('Section', backref='survey', lazy=True, cascade='all, delete-orphan')
+    sections = db.relationship('Section', backref='survey', lazy=True, cascade='all, delete-orphan',
+                               order_by='Section.section_number')
     responses = db.relationship('Response', backref='survey', lazy=True, cascade='all, delete-orphan')
+    structure_version = db.relationship('SurveyVersion', lazy=True, uselist=False, cascade='all, delete-orphan')
+    report_jobs = db.relationship('ReportJob', backref='survey', lazy=True, cascade='all, delete-orphan')
+    invitation_batches = db.relationship('InvitationBatch', backref='survey', lazy=True, cascade='all, delete-orphan')
+    results_snapshot = db.relationship('ResultsSnapshot', lazy=True, uselist=False, cascade='all, delete-orphan')
     
     def get_all_questions(self):
         """Get all questions across all sections in order."""
@@ -36,14 +46,10 @@ class Survey(db.Model):
     
     def get_all_statistics(self):
         """Get statistics for all questions in this survey."""
-        all_stats = []
-        
-        # FIXED: Use get_all_questions() instead of self.questions
-        for question in self.get_all_questions():
-            question_stats = question.calculate_statistics()
-            all_stats.append(question_stats)
-        
-        return all_stats
+        from utils.statistics import get_survey_statistics
+
+        # read from the per-question tallies kept up to date on every answer save
+        return get_survey_statistics(self.id)
     
     def __repr__(self):
         return f'<Survey: {self.title}>'
\ No newline at end of file
@@ -0,0 +1,18 @@
+from database import db
+
+class SurveyVersion(db.Model):
+    """
+    counter that goes up every time the structure of a survey (title, sections,
+    questions, active flag) is changed by an admin.
+
+    the survey structure cache (utils/survey_cache.py) compares it with the
+    version it has cached to know when to reload.
+    """
+
+    __tablename__ = 'survey_versions'
+
+    survey_id = db.Column(db.Integer, db.ForeignKey('surveys.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<SurveyVersion {self.version} for Survey {self.survey_id}>'
@@ -0,0 +1,63 @@
+from sqlalchemy.engine import make_url
+
+"""
+picks the engine options for the database the app is pointed at.
+
+the app runs on a SQLite file by default, and on PostgreSQL (or any other
+SQLAlchemy backend) when DATABASE_URL is set. pool settings from
+SQLALCHEMY_ENGINE_OPTIONS apply to every backend, and the options that only
+one driver understands are added here so Config doesn't have to know which
+backend it will get.
+"""
+
+# options of the SQLAlchemy pool, which SQLite in-memory databases don't use
+POOL_OPTIONS = ['pool_size', 'max_overflow', 'pool_timeout']
+
+
+def normalize_database_url(url):
+    """Accept postgres:// URLs (as hosting providers give them) as postgresql://."""
+    if url and url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def get_backend_name(url):
+    """'sqlite', 'postgresql', 'mysql'... for a database URL."""
+    return make_url(url).get_backend_name()
+
+
+def get_engine_options(config):
+    """
+    Engine options for the configured database.
+
+    Parameters:
+        config: The app config (SQLALCHEMY_DATABASE_URI, SQLALCHEMY_ENGINE_OPTIONS
+                and SQLITE_CONNECT_ARGS are used)
+
+    Returns:
+        Dict to pass to create_engine / SQLALCHEMY_ENGINE_OPTIONS
+    """
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+
+    if url.get_backend_name() == 'sqlite':
+        connect_args = dict(config.get('SQLITE_CONNECT_ARGS') or {})
+        connect_args.update(options.get('connect_args') or {})
+        if connect_args:
+            options['connect_args'] = connect_args
+
+        # an in-memory database lives in a single connection (StaticPool)
+        if url.database in (None, '', ':memory:'):
+            for name in POOL_OPTIONS:
+                options.pop(name, None)
+    else:
+        # server connections can be dropped (restarts, idle timeouts)
+        options.setdefault('pool_pre_ping', True)
+
+    return options
+
+
+def configure_database(app):
+    """Set the database URL and engine options of the app. Call before db.init_app(app)."""
+    app.config['SQLALCHEMY_DATABASE_URI'] = normalize_database_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = get_engine_options(app.config)
@@ -0,0 +1,98 @@
+from sqlalchemy import and_, exists, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from database import db
+
+"""
+insert-or-update statements that work on every database the app supports.
+
+SQLite and PostgreSQL both have INSERT ... ON CONFLICT, which does the whole
+thing in one statement (and one executemany for many rows) without a race
+between checking and inserting. other backends get a portable fallback that
+updates first and inserts the rows that weren't there.
+"""
+
+# dialects whose insert() has on_conflict_do_nothing / on_conflict_do_update
+ON_CONFLICT_INSERTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+
+def get_table(table):
+    """Accept a model class as well as a Table."""
+    return getattr(table, '__table__', table)
+
+
+def get_on_conflict_insert():
+    """The ON CONFLICT insert() of the current database, or None if it doesn't have one."""
+    return ON_CONFLICT_INSERTS.get(db.engine.dialect.name)
+
+
+def key_clause(table, row, index_elements):
+    return and_(*(table.c[column] == row[column] for column in index_elements))
+
+
+def insert_ignore(table, rows, index_elements):
+    """
+    Insert rows, skipping the ones whose key already exists. Caller is
+    responsible for committing.
+
+    Parameters:
+        table: Model or Table to insert into
+        rows: List of column dicts
+        index_elements: Columns of the primary key / unique index that decide a conflict
+    """
+    table = get_table(table)
+    rows = list(rows)
+    if not rows:
+        return
+
+    insert = get_on_conflict_insert()
+    if insert is not None:
+        statement = insert(table).on_conflict_do_nothing(index_elements=index_elements)
+        db.session.execute(statement, rows)
+        return
+
+    for row in rows:
+        if not db.session.execute(select(exists().where(key_clause(table, row, index_elements)))).scalar():
+            db.session.execute(table.insert().values(row))
+
+
+def upsert(table, rows, index_elements, update_columns=(), set_=None):
+    """
+    Insert rows, or update the existing row when the key is already there.
+    Caller is responsible for committing.
+
+    Parameters:
+        table: Model or Table to upsert into
+        rows: List of column dicts (all with the same keys)
+        index_elements: Columns of the primary key / unique index that decide a conflict
+        update_columns: Columns copied from the new row onto an existing one
+        set_: Extra column -> expression to set on an existing row,
+              e.g. {'version': table.c.version + 1}
+    """
+    table = get_table(table)
+    rows = list(rows)
+    if not rows:
+        return
+
+    if not update_columns and not set_:
+        insert_ignore(table, rows, index_elements)
+        return
+
+    insert = get_on_conflict_insert()
+    if insert is not None:
+        statement = insert(table)
+        values = {column: statement.excluded[column] for column in update_columns}
+        values.update(set_ or {})
+        statement = statement.on_conflict_do_update(index_elements=index_elements, set_=values)
+        db.session.execute(statement, rows)
+        return
+
+    # portable fallback: update the row if it's there, insert it if not
+    for row in rows:
+        values = {column: row[column] for column in update_columns}
+        values.update(set_ or {})
+        result = db.session.execute(update(table).where(key_clause(table, row, index_elements)).values(values))
+        if result.rowcount == 0:
+            db.session.execute(table.insert().values(row))
@@ -3,7 +3,18 @@ from database import db
 from data_tables.survey import Survey
 from data_tables.question import Question
 from data_tables.response import Response
-from utils.excel_upload import process_excel_file, check_if_excel_file
+from utils.excel_upload import (process_excel_file, iter_excel_questions, process_excel_sections,
+                                iter_excel_sections, can_stream_excel_file, check_if_excel_file)
+from utils.bulk_import import insert_questions, insert_sections_with_questions
+from utils.statistics import get_survey_statistics, get_survey_elaborations, count_responses
+from utils.tallies import remove_response_from_tallies
+from utils.survey_cache import survey_cache, bump_survey_version
+from utils.reports import REPORT_FORMATS, request_report, get_latest_reports, remove_report_files, report_etag, touch_report
+from data_tables.report_job import ReportJob
+from utils.response_pivot import get_response_page, STATUS_FILTERS
+from utils.dashboard import get_dashboard_page
+from utils.live_results import results_notifier, stream_results
+from utils.results_snapshot import get_results_snapshot, snapshot_builder, discard_results_snapshot
 from werkzeug.utils import secure_filename
 import os
 
@@ -71,11 +82,22 @@ def dashboard():
    URL: /admin/
     """
     
-    # get all survey and order by created date 
-    all_surveys = Survey.query.order_by(Survey.created_at.desc()).all()
+    # one page of surveys (newest first) with their response counts, ?after= for older ones
+    cursor = request.args.get('after')
+    dashboard_page = get_dashboard_page(cursor)
+    surveys = dashboard_page['surveys']
 
-    # show the dashboard page with all the surveys
-    return render_template('admin_dashboard.html', surveys=all_surveys)
+    # status of the background PDF / Excel reports of each survey
+    report_jobs = get_latest_reports([survey.id for survey in surveys])
+
+    # show the dashboard page with the surveys
+    return render_template('admin_dashboard.html',
+                           surveys=surveys,
+                           response_counts=dashboard_page['response_counts'],
+                           next_cursor=dashboard_page['next_cursor'],
+                           is_first_page=not cursor,
+                           report_jobs=report_jobs,
+                           report_formats=REPORT_FORMATS)
 
 
 # route 2) upload survey
@@ -115,44 +137,56 @@ def upload_survey():
             temp_file_path = os.path.join(upload_folder, safe_filename)
             uploaded_file.save(temp_file_path)
             
-            questions_list = process_excel_file(temp_file_path)
-            
-            if len(questions_list) == 0:
-                flash('No questions found in Excel file', 'error')
-                os.remove(temp_file_path)
-                return redirect(request.url)
-            
             survey_title = request.form.get('title', 'EACTS Consensus Survey')
             survey_description = request.form.get('description', '')
+            import_mode = request.form.get('import_mode', 'single')
+            
+            # .xlsx files are streamed row by row, .xls files go through pandas
+            streaming = can_stream_excel_file(safe_filename)
             
             # Create survey
             new_survey = Survey(title=survey_title, description=survey_description)
             db.session.add(new_survey)
             db.session.flush()
             
-            # Create one default section
-            new_section = Section(
-                survey_id=new_survey.id,
-                section_number=1,
-                title="Questions",
-                description=""
-            )
-            db.session.add(new_section)
-            db.session.flush()
-            
-            # Add all questions to this section
-            for index, question_text in enumerate(questions_list):
-                new_question = Question(
-                    section_id=new_section.id,
-                    question_number=index + 1,
-                    question_text=question_text
+            if import_mode == 'sections':
+                # Each worksheet (or value of a "Section" column) becomes a section
+                if streaming:
+                    section_questions = iter_excel_sections(temp_file_path)
+                else:
+                    section_questions = process_excel_sections(temp_file_path)
+                
+                section_count, question_count = insert_sections_with_questions(new_survey.id, section_questions)
+            else:
+                if streaming:
+                    questions = iter_excel_questions(temp_file_path)
+                else:
+                    questions = process_excel_file(temp_file_path)
+                
+                # Create one default section
+                new_section = Section(
+                    survey_id=new_survey.id,
+                    section_number=1,
+                    title="Questions",
+                    description=""
                 )
-                db.session.add(new_question)
+                db.session.add(new_section)
+                db.session.flush()
+                
+                # Add all questions to this section with batched inserts
+                section_count = 1
+                question_count = insert_questions(new_section.id, questions)
+            
+            if question_count == 0:
+                db.session.rollback()
+                flash('No questions found in Excel file', 'error')
+                os.remove(temp_file_path)
+                return redirect(request.url)
             
             db.session.commit()
             os.remove(temp_file_path)
             
-            flash(f'Survey "{survey_title}" created with {len(questions_list)} questions!', 'success')
+            flash(f'Survey "{survey_title}" created with {section_count} section(s) and {question_count} questions!', 'success')
             return redirect(url_for('admin.dashboard'))
             
         except Exception as error:
@@ -162,49 +196,136 @@ def upload_survey():
             flash(f'Error creating survey: {str(error)}', 'error')
             return redirect(request.url)
 
+@admin_bp.route('/invite/<int:survey_id>', methods=['GET', 'POST'])
+def invite_recipients(survey_id):
+    """Upload a recipient list and email everyone their own survey link."""
+    
+    from flask import current_app
+    from data_tables.invitation_batch import InvitationBatch
+    from utils.invitations import check_if_recipient_file, read_recipients, create_invitations, get_batch_progress
+    from utils.mail_queue import missing_mail_settings, mail_queue
+    
+    survey = Survey.query.get_or_404(survey_id)
+    
+    if request.method == 'POST':
+        uploaded_file = request.files.get('file')
+        
+        if uploaded_file is None or uploaded_file.filename == '':
+            flash('No file selected', 'error')
+            return redirect(request.url)
+        
+        if not check_if_recipient_file(uploaded_file.filename):
+            flash('Invalid file type. Please upload a CSV or Excel (.xlsx or .xls) list', 'error')
+            return redirect(request.url)
+        
+        missing = missing_mail_settings()
+        if missing:
+            flash(f'Email is not configured: set {" and ".join(missing)}', 'error')
+            return redirect(request.url)
+        
+        safe_filename = secure_filename(uploaded_file.filename)
+        upload_folder = current_app.config['UPLOAD_FOLDER']
+        
+        if not os.path.exists(upload_folder):
+            os.makedirs(upload_folder)
+        
+        temp_file_path = os.path.join(upload_folder, safe_filename)
+        uploaded_file.save(temp_file_path)
+        
+        try:
+            recipients, skipped = read_recipients(temp_file_path)
+            
+            if not recipients:
+                flash('No email addresses found in the list', 'error')
+                return redirect(request.url)
+            
+            # invitations, tokens and emails for the whole list in batched inserts
+            batch = create_invitations(
+                survey,
+                recipients,
+                link_for=lambda token: url_for('survey.take_survey', survey_id=survey.id, token=token, _external=True),
+                file_name=uploaded_file.filename,
+                skipped=skipped
+            )
+            
+            if batch.total == 0:
+                db.session.rollback()
+                flash('Everyone on the list has already been invited', 'error')
+                return redirect(request.url)
+            
+            db.session.commit()
+            
+            # the background mailer sends them in rate-limited batches
+            mail_queue.notify()
+            
+            flash(f'{batch.total} invitations queued ({batch.skipped} skipped)', 'success')
+            return redirect(url_for('admin.invite_recipients', survey_id=survey.id))
+        
+        except Exception as error:
+            db.session.rollback()
+            flash(f'Error sending invitations: {str(error)}', 'error')
+            return redirect(request.url)
+        
+        finally:
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+    
+    batches = InvitationBatch.query.filter_by(survey_id=survey.id).order_by(InvitationBatch.id.desc()).all()
+    progress = get_batch_progress([batch.id for batch in batches])
+    
+    return render_template('invite_recipients.html', survey=survey, batches=batches, progress=progress)
+
+
+@admin_bp.route('/invite/<int:survey_id>/progress')
+def invitation_progress(survey_id):
+    """Sending progress of the invitation lists of a survey, for the invitations page."""
+    
+    from flask import jsonify
+    from data_tables.invitation_batch import InvitationBatch
+    from utils.invitations import get_batch_progress
+    
+    batch_ids = [batch_id for (batch_id,) in
+                 db.session.query(InvitationBatch.id).filter_by(survey_id=survey_id).all()]
+    return jsonify(get_batch_progress(batch_ids))
+
+
 @admin_bp.route('/results/<int:survey_id>')
 def view_results(survey_id):
     """Show statistics and check which questions meet the 75% threshold."""
     
     survey = Survey.query.get_or_404(survey_id)
     
-    # Get all statistics
-    all_statistics = survey.get_all_statistics()
+    # closed surveys are shown from their frozen results
+    snapshot = get_results_snapshot(survey_id, survey.is_active)
+    
+    # Get all statistics (one grouped query for the whole survey)
+    all_statistics = snapshot.statistics if snapshot else get_survey_statistics(survey_id)
     
     # Count total responses
-    total_responses = len(survey.responses)
+    total_responses = snapshot.total_responses if snapshot else count_responses(survey_id)
     
     # Count passed/failed questions
     passed_count = sum(1 for stat in all_statistics if stat['meets_threshold'])
     failed_count = sum(1 for stat in all_statistics if not stat['meets_threshold'])
     
     # Get elaborations organized by section and question
+    elaborations = snapshot.elaborations if snapshot else get_survey_elaborations(survey_id)
     sections_with_elaborations = []
     
-    for section in sorted(survey.sections, key=lambda s: s.section_number):
-        section_data = {
-            'section_title': section.title,
-            'questions': []
-        }
-        
-        for question in sorted(section.questions, key=lambda q: q.question_number):
-            answers_with_text = []
-            
-            for answer in question.answers:
-                if answer.elaboration and answer.elaboration.strip():
-                    answers_with_text.append({
-                        'choice': answer.choice,
-                        'elaboration': answer.elaboration,
-                        'submitted_at': answer.response.submitted_at
-                    })
-            
-            section_data['questions'].append({
-                'question_number': question.question_number,
-                'question_text': question.question_text,
-                'elaborations': answers_with_text
+    for stat in all_statistics:
+        # statistics come back in section order so start a new group when the section changes
+        if not sections_with_elaborations or sections_with_elaborations[-1]['section_number'] != stat['section_number']:
+            sections_with_elaborations.append({
+                'section_number': stat['section_number'],
+                'section_title': stat['section_title'],
+                'questions': []
             })
         
-        sections_with_elaborations.append(section_data)
+        sections_with_elaborations[-1]['questions'].append({
+            'question_number': stat['question_number'],
+            'question_text': stat['question_text'],
+            'elaborations': elaborations.get(stat['question_id'], [])
+        })
 
     return render_template('view_results.html',
                           survey=survey,
@@ -214,43 +335,54 @@ def view_results(survey_id):
                           failed_count=failed_count,
                           sections_with_elaborations=sections_with_elaborations)
 
+@admin_bp.route('/results/<int:survey_id>/live')
+def live_results_stream(survey_id):
+    """
+    Server-Sent Events stream of the results page: pushes the tallies of the
+    questions that changed as answers come in.
+    """
+    
+    from flask import Response as FlaskResponse, current_app, stream_with_context
+    
+    Survey.query.get_or_404(survey_id)
+    heartbeat = current_app.config.get('LIVE_RESULTS_HEARTBEAT_SECONDS', 15)
+    
+    return FlaskResponse(
+        stream_with_context(stream_results(survey_id, heartbeat)),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # nginx must not buffer the stream
+        }
+    )
+
 @admin_bp.route('/responses/<int:survey_id>')
 def view_responses(survey_id):
-    """Show all individual responses for a survey."""
+    """
+    Show the individual responses for a survey, one page at a time.
+
+    Query string: ?page=, ?status=all|complete|incomplete and ?name= (search).
+    """
 
     survey = Survey.query.get_or_404(survey_id)
 
-    individual_responses = []
-    for resp in sorted(survey.responses, key=lambda r: r.submitted_at, reverse=True):
-        display_name = resp.participant_name or 'Anonymous'
-
-        resp_sections = []
-        for section in sorted(survey.sections, key=lambda s: s.section_number):
-            section_answers = []
-            for question in sorted(section.questions, key=lambda q: q.question_number):
-                answer = next((a for a in resp.answers if a.question_id == question.id), None)
-                section_answers.append({
-                    'question_number': question.question_number,
-                    'question_text':   question.question_text,
-                    'choice':          answer.choice if answer else '—',
-                    'elaboration':     answer.elaboration if answer else ''
-                })
-            resp_sections.append({
-                'section_title': section.title,
-                'answers': section_answers
-            })
+    page = request.args.get('page', 1, type=int)
+    status = request.args.get('status', 'all')
+    if status not in STATUS_FILTERS:
+        status = 'all'
+    name = request.args.get('name', '').strip()
 
-        individual_responses.append({
-            'id':           resp.id,
-            'name':         display_name,
-            'submitted_at': resp.submitted_at,
-            'is_complete':  resp.is_complete,
-            'sections':     resp_sections
-        })
+    # all answers of the page come from one query and are looked up in a dict
+    response_page = get_response_page(survey_id, page=page, status=status, name=name)
 
     return render_template('individual_responses.html',
                            survey=survey,
-                           individual_responses=individual_responses)
+                           individual_responses=response_page['responses'],
+                           page=response_page['page'],
+                           pages=response_page['pages'],
+                           total_responses=response_page['total'],
+                           status=status,
+                           name=name)
 
 
 @admin_bp.route('/create-manual', methods=['GET', 'POST'])
@@ -343,88 +475,67 @@ def create_manual_survey():
             return redirect(request.url)
         
 
-@admin_bp.route('/export-excel/<int:survey_id>')
-def export_excel(survey_id):
-    """Export survey results to Excel file (questions as rows)."""
-
-    survey = Survey.query.get_or_404(survey_id)
+def send_report(job, survey):
+    """
+    Send the finished file of a report job as a download.
 
-    import openpyxl
-    from openpyxl.styles import Font, PatternFill, Alignment
+    The ETag is the report's cache key, so a browser that already has this
+    version gets a 304 Not Modified instead of the file.
+    """
     from flask import send_file
-    import io
-
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = 'Results'
-
-    # Header row
-    headers = ['Q#', 'Section', 'Question Text', 'Total Responses',
-               'Yes %', 'No %', 'Abstain', 'Comments']
-    ws.append(headers)
-
-    # Style header row
-    header_fill = PatternFill(start_color='1B3A5C', end_color='1B3A5C', fill_type='solid')
-    header_font = Font(bold=True, color='FFFFFF')
-    for cell in ws[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-
-    # Data rows
-    for question in survey.get_all_questions():
-        stats = question.calculate_statistics()
-
-        # Calculate no percentage (same denominator as yes — excludes abstains)
-        total_yes_no = stats['yes_count'] + stats['no_count']
-        if total_yes_no > 0:
-            no_pct = round((stats['no_count'] / total_yes_no) * 100, 1)
-        else:
-            no_pct = 0.0
-
-        # Gather comments
-        comments = [
-            a.elaboration.strip()
-            for a in question.answers
-            if a.elaboration and a.elaboration.strip()
-        ]
-        comments_text = ' | '.join(comments) if comments else ''
-
-        ws.append([
-            stats['question_number'],
-            question.section.title,
-            stats['question_text'],
-            stats['total_responses'],
-            f"{stats['yes_percentage']}%",
-            f"{no_pct}%",
-            stats['abstain_count'],
-            comments_text,
-        ])
-
-    # Auto-fit column widths (approximate)
-    col_widths = [6, 18, 60, 16, 10, 10, 10, 60]
-    for i, width in enumerate(col_widths, start=1):
-        ws.column_dimensions[openpyxl.utils.get_column_letter(i)].width = width
-
-    # Wrap text on Question Text and Comments columns
-    for row in ws.iter_rows(min_row=2):
-        row[2].alignment = Alignment(wrap_text=True, vertical='top')  # Question Text
-        row[7].alignment = Alignment(wrap_text=True, vertical='top')  # Comments
-
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
 
+    report_format = REPORT_FORMATS[job.report_format]
     safe_title = survey.title.replace(' ', '_').replace('/', '_')
-    filename = f'{safe_title}_Results.xlsx'
+    filename = f"{safe_title}_{report_format.get('file_suffix', 'Results')}.{report_format['extension']}"
 
-    return send_file(
-        output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    touch_report(job)
+
+    response = send_file(
+        job.file_path,
+        mimetype=report_format['mimetype'],
         as_attachment=True,
-        download_name=filename
+        download_name=filename,
+        etag=report_etag(job),
+        conditional=True
     )
 
+    # results are private, and must be revalidated because new answers change them
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.cache_control.max_age = None
+    return response
+
+
+def send_or_queue_report(survey, report_format):
+    """
+    Send the report if it is already made for the current answers,
+    otherwise start generating it in the background.
+    """
+    job = request_report(survey.id, report_format)
+
+    if job.status == 'done':
+        return send_report(job, survey)
+
+    label = REPORT_FORMATS[report_format]['label']
+    flash(f'The {label} report of "{survey.title}" is being generated. '
+          f'It will be ready to download from the dashboard in a moment.', 'success')
+    return redirect(url_for('admin.dashboard'))
+
+
+@admin_bp.route('/export-excel/<int:survey_id>')
+def export_excel(survey_id):
+    """
+    Export survey results to Excel file (questions as rows).
+
+    Add ?raw=1 to also get a 'Raw Answers' sheet with one row per respondent.
+    """
+
+    survey = Survey.query.get_or_404(survey_id)
+
+    report_format = 'xlsx_raw' if request.args.get('raw') == '1' else 'xlsx'
+    return send_or_queue_report(survey, report_format)
+
 
 @admin_bp.route('/export-pdf/<int:survey_id>')
 def export_pdf(survey_id):
@@ -432,182 +543,34 @@ def export_pdf(survey_id):
 
     survey = Survey.query.get_or_404(survey_id)
 
-    from flask import send_file
-    import io
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib.units import cm
-    from reportlab.lib import colors
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, HRFlowable
-
-    output = io.BytesIO()
-    doc = SimpleDocTemplate(
-        output,
-        pagesize=A4,
-        leftMargin=2 * cm,
-        rightMargin=2 * cm,
-        topMargin=2 * cm,
-        bottomMargin=2 * cm,
-    )
+    return send_or_queue_report(survey, 'pdf')
 
-    styles = getSampleStyleSheet()
 
-    style_title = ParagraphStyle(
-        'SurveyTitle',
-        parent=styles['Title'],
-        fontSize=20,
-        textColor=colors.HexColor('#1B3A5C'),
-        spaceAfter=6,
-    )
-    style_subtitle = ParagraphStyle(
-        'Subtitle',
-        parent=styles['Normal'],
-        fontSize=11,
-        textColor=colors.HexColor('#555555'),
-        spaceAfter=16,
-    )
-    style_section_fail = ParagraphStyle(
-        'SectionFail',
-        parent=styles['Heading1'],
-        fontSize=14,
-        textColor=colors.HexColor('#C0392B'),
-        spaceBefore=18,
-        spaceAfter=6,
-    )
-    style_section_pass = ParagraphStyle(
-        'SectionPass',
-        parent=styles['Heading1'],
-        fontSize=14,
-        textColor=colors.HexColor('#27AE60'),
-        spaceBefore=18,
-        spaceAfter=6,
-    )
-    style_question = ParagraphStyle(
-        'QuestionText',
-        parent=styles['Normal'],
-        fontSize=11,
-        textColor=colors.HexColor('#2C3E50'),
-        fontName='Helvetica-Bold',
-        spaceBefore=10,
-        spaceAfter=3,
-    )
-    style_stats = ParagraphStyle(
-        'StatsLine',
-        parent=styles['Normal'],
-        fontSize=10,
-        textColor=colors.HexColor('#444444'),
-        spaceAfter=4,
-        leftIndent=12,
-    )
-    style_comment_label = ParagraphStyle(
-        'CommentLabel',
-        parent=styles['Normal'],
-        fontSize=10,
-        fontName='Helvetica-Bold',
-        textColor=colors.HexColor('#555555'),
-        spaceBefore=4,
-        spaceAfter=2,
-        leftIndent=12,
-    )
-    style_comment = ParagraphStyle(
-        'Comment',
-        parent=styles['Normal'],
-        fontSize=10,
-        textColor=colors.HexColor('#333333'),
-        spaceAfter=3,
-        leftIndent=24,
-        bulletIndent=14,
-    )
+@admin_bp.route('/export-raw/<int:survey_id>')
+def export_raw(survey_id):
+    """
+    Export the raw answers as a Parquet file for analysis tools, one row per
+    answer. Add ?layout=wide for one row per respondent instead.
+    """
 
-    # Collect question data
-    all_questions = survey.get_all_questions()
-    total_responses = len(survey.responses)
-
-    failed_questions = []
-    passed_questions = []
-
-    for question in all_questions:
-        stats = question.calculate_statistics()
-        total_yes_no = stats['yes_count'] + stats['no_count']
-        no_pct = round((stats['no_count'] / total_yes_no) * 100, 1) if total_yes_no > 0 else 0.0
-        comments = [
-            a.elaboration.strip()
-            for a in question.answers
-            if a.elaboration and a.elaboration.strip()
-        ]
-        entry = {
-            'number': stats['question_number'],
-            'text': stats['question_text'],
-            'total': stats['total_responses'],
-            'yes_pct': stats['yes_percentage'],
-            'no_pct': no_pct,
-            'abstain': stats['abstain_count'],
-            'comments': comments,
-        }
-        if stats['meets_threshold']:
-            passed_questions.append(entry)
-        else:
-            failed_questions.append(entry)
-
-    passed_count = len(passed_questions)
-    failed_count = len(failed_questions)
-
-    story = []
-
-    # Title
-    story.append(Paragraph(survey.title, style_title))
-    story.append(Paragraph(
-        f"Total Responses: {total_responses} &nbsp;&nbsp;|&nbsp;&nbsp; "
-        f"Passed: {passed_count} &nbsp;&nbsp;|&nbsp;&nbsp; Did Not Pass: {failed_count}",
-        style_subtitle
-    ))
-    story.append(HRFlowable(width='100%', thickness=1, color=colors.HexColor('#DDDDDD'), spaceAfter=10))
-
-    def add_questions(question_list):
-        for q in question_list:
-            story.append(Paragraph(
-                f"Q{q['number']}. {q['text']}",
-                style_question
-            ))
-            story.append(Paragraph(
-                f"Respondents: {q['total']} &nbsp;&nbsp;|&nbsp;&nbsp; "
-                f"Yes: {q['yes_pct']}% &nbsp;&nbsp;|&nbsp;&nbsp; "
-                f"No: {q['no_pct']}% &nbsp;&nbsp;|&nbsp;&nbsp; "
-                f"Abstained: {q['abstain']}",
-                style_stats
-            ))
-            if q['comments']:
-                story.append(Paragraph('Comments:', style_comment_label))
-                for comment in q['comments']:
-                    # Escape any HTML special characters in comment text
-                    safe_comment = comment.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
-                    story.append(Paragraph(f"\u2022 {safe_comment}", style_comment))
-            story.append(Spacer(1, 6))
-
-    # Did Not Pass section
-    if failed_questions:
-        story.append(Paragraph('DID NOT PASS', style_section_fail))
-        story.append(HRFlowable(width='100%', thickness=1, color=colors.HexColor('#E8A0A0'), spaceAfter=6))
-        add_questions(failed_questions)
-
-    # Passed section
-    if passed_questions:
-        story.append(Paragraph('PASSED', style_section_pass))
-        story.append(HRFlowable(width='100%', thickness=1, color=colors.HexColor('#A0D8AF'), spaceAfter=6))
-        add_questions(passed_questions)
-
-    doc.build(story)
-    output.seek(0)
+    survey = Survey.query.get_or_404(survey_id)
 
-    safe_title = survey.title.replace(' ', '_').replace('/', '_')
-    filename = f'{safe_title}_Results.pdf'
+    report_format = 'parquet_wide' if request.args.get('layout') == 'wide' else 'parquet'
+    return send_or_queue_report(survey, report_format)
+
+
+@admin_bp.route('/report/<int:job_id>')
+def download_report(job_id):
+    """Download the file of a finished background report."""
+
+    job = ReportJob.query.get_or_404(job_id)
+
+    if job.status != 'done' or not job.file_path or not os.path.exists(job.file_path):
+        flash('This report is not ready yet.', 'error')
+        return redirect(url_for('admin.dashboard'))
+
+    return send_report(job, job.survey)
 
-    return send_file(
-        output,
-        mimetype='application/pdf',
-        as_attachment=True,
-        download_name=filename
-    )
 
 @admin_bp.route('/toggle/<int:survey_id>', methods=['POST'])
 def toggle_survey(survey_id):
@@ -617,7 +580,17 @@ def toggle_survey(survey_id):
 
     # Flip the active status
     survey.is_active = not survey.is_active
+    bump_survey_version(survey.id)
+    
+    if survey.is_active:
+        discard_results_snapshot(survey.id)
     db.session.commit()
+    survey_cache.invalidate(survey.id)
+
+    # a closed survey's answers are frozen, so its results are worked out once
+    # in the background (pages show the live results until it's done)
+    if not survey.is_active:
+        snapshot_builder.queue(survey.id)
 
     status_word = 'activated' if survey.is_active else 'deactivated'
     flash(f'Survey "{survey.title}" has been {status_word}.', 'success')
@@ -638,12 +611,16 @@ def delete_survey(survey_id):
         
         # Step 2: Store the title for the success message
         survey_title = survey.title
+        report_files = [job.file_path for job in survey.report_jobs]
         
         # Step 3: Delete it
         # Because of cascade='all, delete-orphan' in our relationships,
         # this automatically deletes all questions, responses, and answers
         db.session.delete(survey)
         db.session.commit()
+        survey_cache.invalidate(survey_id)
+        results_notifier.publish(survey_id)
+        remove_report_files(report_files)
         
         # Step 4: Show success message
         flash(f'Survey "{survey_title}" deleted successfully', 'success')
@@ -662,23 +639,33 @@ def delete_response(response_id):
     try:
         resp = Response.query.get_or_404(response_id)
         survey_id = resp.survey_id
+        remove_response_from_tallies(resp)
         db.session.delete(resp)
+        discard_results_snapshot(survey_id)
         db.session.commit()
+        results_notifier.publish(survey_id)
         flash('Response deleted successfully', 'success')
     except Exception as error:
         db.session.rollback()
         flash(f'Error deleting response: {str(error)}', 'error')
-    return redirect(url_for('admin.individual_responses', survey_id=survey_id))
+    return redirect(url_for('admin.view_responses', survey_id=survey_id))
 
 
 @admin_bp.route('/edit/<int:survey_id>')
 def edit_survey(survey_id):
     """Edit survey - organize questions into sections."""
     
+    from sqlalchemy.orm import selectinload
+    from data_tables.section import Section
+    
     survey = Survey.query.get_or_404(survey_id)
     
-    # Get sections in order
-    sections = sorted(survey.sections, key=lambda s: s.section_number)
+    # Get sections in order, with the questions of all of them in one more query
+    sections = (Section.query
+                .filter_by(survey_id=survey_id)
+                .options(selectinload(Section.questions))
+                .order_by(Section.section_number)
+                .all())
     
     return render_template('edit_survey.html', survey=survey, sections=sections)
 
@@ -687,7 +674,7 @@ def edit_survey(survey_id):
 def update_survey(survey_id):
     """Process survey edits."""
     
-    from data_tables.section import Section
+    from utils.survey_edit import parse_survey_form, apply_survey_edit
     
     survey = Survey.query.get_or_404(survey_id)
     
@@ -696,62 +683,41 @@ def update_survey(survey_id):
         survey.title = request.form.get('title', survey.title)
         survey.description = request.form.get('description', '')
         
-        # Delete all existing sections and questions
-        # We'll recreate them from the form
-        for section in survey.sections:
-            db.session.delete(section)
-        
-        db.session.flush()
-        
-        # Rebuild sections from form
-        section_index = 1
-        
-        while True:
-            section_title_key = f'section_{section_index}_title'
-            section_title = request.form.get(section_title_key)
-            
-            if section_title is None:
-                break
-            
-            section_description = request.form.get(f'section_{section_index}_description', '')
-            
-            # Create section
-            new_section = Section(
-                survey_id=survey.id,
-                section_number=section_index,
-                title=section_title,
-                description=section_description
-            )
-            db.session.add(new_section)
-            db.session.flush()
-            
-            # Add questions for this section
-            question_index = 1
-            while True:
-                question_key = f'section_{section_index}_question_{question_index}'
-                question_text = request.form.get(question_key)
-                
-                if question_text is None:
-                    break
-                
-                question_text = question_text.strip()
-                if question_text:
-                    new_question = Question(
-                        section_id=new_section.id,
-                        question_number=question_index,
-                        question_text=question_text
-                    )
-                    db.session.add(new_question)
-                
-                question_index += 1
-            
-            section_index += 1
+        # Match the form to the existing sections / questions by id and only
+        # write what changed, so answers to unchanged questions are kept
+        form_sections = parse_survey_form(request.form)
+        apply_survey_edit(survey.id, form_sections)
         
+        bump_survey_version(survey.id)
+        discard_results_snapshot(survey.id)
         db.session.commit()
+        survey_cache.invalidate(survey.id)
+        results_notifier.publish(survey.id)
         flash('Survey updated successfully!', 'success')
         return redirect(url_for('admin.dashboard'))
         
     except Exception as error:
         db.session.rollback()
         flash(f'Error updating survey: {str(error)}', 'error')
-        return redirect(url_for('admin.edit_survey', survey_id=survey_id))
\ No newline at end of file
+        return redirect(url_for('admin.edit_survey', survey_id=survey_id))
+
+@admin_bp.route('/diagnostics')
+def diagnostics():
+    """SQL statement counts and timings per endpoint (when QUERY_STATS=true)."""
+    
+    from utils.query_stats import query_stats
+    
+    return render_template('admin_diagnostics.html',
+                           enabled=query_stats.enabled,
+                           endpoints=query_stats.snapshot())
+
+
+@admin_bp.route('/diagnostics/reset', methods=['POST'])
+def reset_diagnostics():
+    """Start counting the diagnostics from zero again."""
+    
+    from utils.query_stats import query_stats
+    
+    query_stats.reset()
+    flash('Diagnostics reset', 'success')
+    return redirect(url_for('admin.diagnostics'))
\ No newline at end of file
@@ -0,0 +1,25 @@
+import hmac
+from flask import Blueprint, Response as FlaskResponse, current_app, request, session, abort
+from utils.metrics import render_metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics')
+def prometheus_metrics():
+    """
+    Request, answer, submit, report, mail queue and connection pool numbers
+    in the Prometheus text format (see utils/metrics.py).
+
+    The numbers include survey ids, so they are only shown to a logged in
+    admin, or to a scraper that sends "Authorization: Bearer <token>" when
+    METRICS_TOKEN is set.
+    """
+
+    if not session.get('admin_logged_in'):
+        token = current_app.config.get('METRICS_TOKEN')
+        given = request.headers.get('Authorization', '')
+        if not token or not hmac.compare_digest(given.encode('utf-8'), f'Bearer {token}'.encode('utf-8')):
+            abort(401)
+
+    return FlaskResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,17 +1,62 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
 from database import db
-from data_tables.survey import Survey
+from database.upsert import insert_ignore
 from data_tables.response import Response
 from data_tables.answer import Answer
+from utils.survey_cache import get_survey_structure_or_404
+from utils.answers import save_answers
+from utils.tallies import add_response_to_complete_tallies
+from utils.live_results import results_notifier
+from utils.metrics import metrics
+from utils.results_snapshot import discard_results_snapshot
 
 survey_bp = Blueprint('survey', __name__, url_prefix='/survey')
 
 
+def resume_response_query(resume_token, **filters):
+    """Query of the response a resume token belongs to, with extra filter_by filters."""
+    return Response.query.filter_by(resume_token=resume_token, **filters)
+
+
+def start_response(survey_id):
+    """
+    The response of this session, created on its first save. Caller is
+    responsible for committing.
+
+    The resume token is put in the session when a section page is shown, before
+    the response exists, so a form POST and an autosave racing each other carry
+    the same token and the unique index on resume_token lets only one of them
+    insert the response (in any process). An invitee's token is the one of
+    their invitation, whose email and name the response starts with.
+    """
+    from utils.invitations import invitation_query
+
+    resume_token = session.get('resume_token')
+    if resume_token:
+        values = {'survey_id': survey_id, 'resume_token': resume_token}
+        invitation = invitation_query(resume_token, survey_id).first()
+        if invitation is not None:
+            values.update(email=invitation.email, participant_name=invitation.name)
+
+        insert_ignore(Response, [values], ['resume_token'])
+        response = resume_response_query(resume_token, survey_id=survey_id).first()
+        if response is not None:
+            return response
+
+    # no token yet, or it belongs to a response of another survey
+    response = Response(survey_id=survey_id)
+    response.generate_resume_token()
+    db.session.add(response)
+    db.session.flush()
+    session['resume_token'] = response.resume_token
+    return response
+
+
 @survey_bp.route('/<int:survey_id>')
 def take_survey(survey_id):
     """Show survey - redirects to the correct section."""
 
-    survey = Survey.query.get_or_404(survey_id)
+    survey = get_survey_structure_or_404(survey_id)
 
     # Allow admins to preview inactive surveys
     if not survey.is_active and not session.get('admin_logged_in'):
@@ -22,32 +67,56 @@ def take_survey(survey_id):
     resume_token = request.args.get('token')
 
     if resume_token:
-        existing_response = Response.query.filter_by(
-            resume_token=resume_token,
-            survey_id=survey_id,
-            is_complete=False
-        ).first()
+        existing_response = resume_response_query(resume_token, survey_id=survey_id).first()
 
-        if existing_response:
+        if existing_response is not None and not existing_response.is_complete:
             session['resume_token'] = resume_token
             session['resume_email'] = existing_response.email
 
+        elif existing_response is None:
+            # an invitation link opened before any answer was saved: the
+            # response is made with its token on the first save
+            from utils.invitations import invitation_query
+            invitation = invitation_query(resume_token, survey_id).first()
+            if invitation is not None:
+                session['resume_token'] = resume_token
+                session['resume_email'] = invitation.email
+
     # Land on the section they saved at (default 1 for fresh starts)
     target_section = request.args.get('section', 1, type=int)
     return redirect(url_for('survey.show_section', survey_id=survey_id, section_num=target_section))
 
 
+def get_existing_answers(existing_response, section):
+    """
+    Get the saved answers of a response for one section in a single query.
+
+    Returns:
+        Dict of question_id -> Answer (empty if there is no response yet)
+    """
+    if not existing_response or existing_response.id is None:
+        return {}
+
+    question_ids = [q.id for q in section.questions]
+    answers = Answer.query.filter(
+        Answer.response_id == existing_response.id,
+        Answer.question_id.in_(question_ids)
+    ).all()
+    return {answer.question_id: answer for answer in answers}
+
+
 @survey_bp.route('/<int:survey_id>/section/<int:section_num>', methods=['GET', 'POST'])
 def show_section(survey_id, section_num):
     """Show one section at a time."""
 
-    survey = Survey.query.get_or_404(survey_id)
+    # sections and questions come from the in-process cache, not the database
+    survey = get_survey_structure_or_404(survey_id)
+    sections = survey.sections
 
     if not survey.is_active and not session.get('admin_logged_in'):
         flash('This survey is no longer active', 'error')
         return redirect(url_for('home'))
 
-    sections = sorted(survey.sections, key=lambda s: s.section_number)
     total_sections = len(sections)
 
     if section_num < 1 or section_num > total_sections:
@@ -61,7 +130,7 @@ def show_section(survey_id, section_num):
     resume_token = session.get('resume_token')
 
     if resume_token:
-        existing_response = Response.query.filter_by(resume_token=resume_token).first()
+        existing_response = resume_response_query(resume_token).first()
 
     # ── POST ──────────────────────────────────────────────────────────────────
     if request.method == 'POST':
@@ -70,11 +139,7 @@ def show_section(survey_id, section_num):
         if action == 'save':
             # Create response record if this is the first save
             if not existing_response:
-                existing_response = Response(survey_id=survey.id)
-                existing_response.generate_resume_token()
-                db.session.add(existing_response)
-                db.session.flush()
-                session['resume_token'] = existing_response.resume_token
+                existing_response = start_response(survey.id)
 
             save_section_answers(current_section, existing_response)
 
@@ -83,7 +148,18 @@ def show_section(survey_id, section_num):
                 if name:
                     existing_response.participant_name = name
 
+            # an admin previewing a closed survey changes its frozen results
+            if not survey.is_active:
+                discard_results_snapshot(survey_id)
+
+            # Optional email to send the resume link to
+            email = request.form.get('email', '').strip()
+            if email:
+                existing_response.email = email
+                session['resume_email'] = email
+
             db.session.commit()
+            results_notifier.publish(survey_id)
 
             # Resume link — encodes the current section so they land here when they return
             resume_link = url_for('survey.take_survey',
@@ -92,8 +168,10 @@ def show_section(survey_id, section_num):
                                   section=section_num,
                                   _external=True)
 
-            # Refresh so existing_response.answers reflects the just-saved answers
-            db.session.refresh(existing_response)
+            # queued for the background mailer, the page doesn't wait for SMTP
+            email_sent = None
+            if email:
+                email_sent = send_resume_email(email, survey.title, resume_link, section_num, total_sections)
 
             return render_template('take_survey_section.html',
                                    survey=survey,
@@ -101,17 +179,17 @@ def show_section(survey_id, section_num):
                                    section_num=section_num,
                                    total_sections=total_sections,
                                    existing_response=existing_response,
-                                   resume_link=resume_link)
+                                   existing_answers=get_existing_answers(existing_response, current_section),
+                                   resume_link=resume_link,
+                                   resume_email=email,
+                                   email_sent=email_sent,
+                                   saved_email=session.get('resume_email', ''))
 
         else:
             # next / previous / submit
             # Ensure a response record exists before saving answers
             if not existing_response:
-                existing_response = Response(survey_id=survey.id)
-                existing_response.generate_resume_token()
-                db.session.add(existing_response)
-                db.session.flush()
-                session['resume_token'] = existing_response.resume_token
+                existing_response = start_response(survey.id)
 
             save_section_answers(current_section, existing_response)
 
@@ -120,10 +198,19 @@ def show_section(survey_id, section_num):
                 if name:
                     existing_response.participant_name = name
 
-            if action == 'submit':
+            if action == 'submit' and not existing_response.is_complete:
                 existing_response.is_complete = True
+                # count this response in the completed-only tallies as well
+                add_response_to_complete_tallies(existing_response.id)
+
+            if not survey.is_active:
+                discard_results_snapshot(survey_id)
 
             db.session.commit()
+            results_notifier.publish(survey_id)
+
+            if action == 'submit':
+                metrics.inc('eacts_submits_total', (('survey_id', str(survey_id)),))
 
             if action == 'next':
                 return redirect(url_for('survey.show_section',
@@ -141,37 +228,89 @@ def show_section(survey_id, section_num):
                 return redirect(url_for('survey.thank_you'))
 
     # ── GET ───────────────────────────────────────────────────────────────────
+    # the token of the response the first save will create (see start_response)
+    if not resume_token:
+        session['resume_token'] = Response.new_resume_token()
+
     return render_template('take_survey_section.html',
                            survey=survey,
                            section=current_section,
                            section_num=section_num,
                            total_sections=total_sections,
                            existing_response=existing_response,
+                           existing_answers=get_existing_answers(existing_response, current_section),
                            saved_email=session.get('resume_email', ''))
 
 
 def save_section_answers(section, existing_response):
     """Save answers for the current section. Caller is responsible for committing."""
 
-    # Delete old answers for this section so we can replace them
-    question_ids = [q.id for q in section.questions]
-    Answer.query.filter(
-        Answer.response_id == existing_response.id,
-        Answer.question_id.in_(question_ids)
-    ).delete(synchronize_session=False)
-
-    # Save new answers
+    # only new, changed or cleared answers are written (see utils/answers.py)
+    submitted = {}
     for question in section.questions:
         choice = request.form.get(f'question_{question.id}')
         elaboration = request.form.get(f'elaboration_{question.id}', '').strip()
 
         if choice:
-            db.session.add(Answer(
-                response_id=existing_response.id,
-                question_id=question.id,
-                choice=choice,
-                elaboration=elaboration if elaboration else None
-            ))
+            submitted[question.id] = (choice, elaboration if elaboration else None)
+
+    save_answers(existing_response, [q.id for q in section.questions], submitted)
+
+
+# choices a respondent can give to a statement
+VALID_CHOICES = ['Yes', 'No', 'Abstain']
+
+
+@survey_bp.route('/<int:survey_id>/autosave', methods=['POST'])
+def autosave(survey_id):
+    """
+    Save one answer as soon as it changes (called by static/style.js).
+
+    Takes JSON {"question_id": 12, "choice": "Yes", "elaboration": "..."} and
+    answers with a few bytes of JSON instead of a whole section page.
+    """
+
+    survey = get_survey_structure_or_404(survey_id)
+
+    if not survey.is_active and not session.get('admin_logged_in'):
+        return jsonify(saved=False, error='This survey is no longer active'), 403
+
+    data = request.get_json(silent=True) or {}
+    question_id = data.get('question_id')
+    choice = data.get('choice')
+    elaboration = (data.get('elaboration') or '').strip()
+
+    question_ids = {question.id for section in survey.sections for question in section.questions}
+    if question_id not in question_ids:
+        return jsonify(saved=False, error='Unknown question'), 400
+
+    # an elaboration is kept with its choice, so nothing is saved before a choice is made
+    if choice not in VALID_CHOICES:
+        return jsonify(saved=False, error='Choose Yes, No or Abstain first'), 400
+
+    existing_response = None
+    resume_token = session.get('resume_token')
+    if resume_token:
+        existing_response = resume_response_query(resume_token, survey_id=survey_id).first()
+
+    if existing_response is not None and existing_response.is_complete:
+        return jsonify(saved=False, error='This response has already been submitted'), 409
+
+    # the first autosave starts the response, like the first section save does
+    if existing_response is None:
+        existing_response = start_response(survey_id)
+
+    # only this question's row is upserted (nothing is written if it didn't change)
+    changed = save_answers(existing_response, [question_id],
+                           {question_id: (choice, elaboration if elaboration else None)})
+    if changed and not survey.is_active:
+        discard_results_snapshot(survey_id)
+    db.session.commit()
+
+    if changed:
+        results_notifier.publish(survey_id)
+
+    return jsonify(saved=True, changed=changed)
 
 
 @survey_bp.route('/thank-you')
@@ -181,23 +320,24 @@ def thank_you():
 
 
 def send_resume_email(to_email, survey_title, resume_link, current_section, total_sections):
-    """Send resume link via email. Returns True if sent, False if not configured or failed."""
+    """
+    Queue the resume link email. The background mailer sends it, so this returns straight away.
+    Returns True if queued, False if email isn't configured.
+    """
 
-    from flask import current_app
+    from utils.mail_queue import missing_mail_settings, queue_email, mail_queue
 
-    # Don't even try if credentials aren't configured
-    if not current_app.config.get('MAIL_USERNAME') or not current_app.config.get('MAIL_PASSWORD'):
-        print("Email not configured: set MAIL_USERNAME and MAIL_PASSWORD environment variables.")
+    # Don't even try if there is no address to send from
+    missing = missing_mail_settings()
+    if missing:
+        print(f"Email not configured: set {' and '.join(missing)} environment variables.")
         return False
 
-    try:
-        from flask_mail import Mail, Message
-        mail = Mail(current_app)
-
-        msg = Message(
-            subject=f'Resume Your Survey: {survey_title}',
-            recipients=[to_email],
-            body=f'''Hello,
+    queue_email(
+        kind='resume',
+        recipient=to_email,
+        subject=f'Resume Your Survey: {survey_title}',
+        body=f'''Hello,
 
 You have saved your progress on: {survey_title}
 
@@ -211,10 +351,7 @@ This link is unique to you and can be used at any time to resume the survey.
 Best regards,
 EACTS Survey System
 '''
-        )
-        mail.send(msg)
-        return True
-
-    except Exception as e:
-        print(f"Email send failed: {e}")
-        return False
+    )
+    db.session.commit()
+    mail_queue.notify()
+    return True
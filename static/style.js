@@ -0,0 +1,149 @@
+/*
+ * Autosave for the survey section page.
+ *
+ * Every answer is sent to the autosave endpoint on its own as soon as it
+ * changes: a choice straight away, an elaboration once the respondent stops
+ * typing for a moment. Only one request is in flight at a time, and changes
+ * made meanwhile are merged, so the first save (which starts the response)
+ * finishes before the next one is sent. Submitting the form waits for the
+ * request in flight too.
+ */
+(function() {
+    var CHOICE_DELAY = 300;        // ms after clicking Yes / No / Abstain
+    var ELABORATION_DELAY = 1500;  // ms after the last key press in an elaboration
+
+    var form = document.getElementById('sectionForm');
+    if (!form || !form.getAttribute('data-autosave-url')) return;
+
+    var url = form.getAttribute('data-autosave-url');
+    var timers = {};    // question id -> debounce timer
+    var pending = {};   // question id -> waiting to be sent
+    var sending = null;  // promise of the autosave request in flight
+    var submitting = false;
+
+    function setStatus(questionId, text, isError) {
+        var status = document.getElementById('autosave-status-' + questionId);
+        if (!status) return;
+        status.textContent = text;
+        status.className = 'autosave-status' + (isError ? ' autosave-error' : '');
+    }
+
+    function readAnswer(questionId) {
+        var checked = form.querySelector('input[name="question_' + questionId + '"]:checked');
+        var elaboration = form.querySelector('textarea[name="elaboration_' + questionId + '"]');
+        return {
+            question_id: parseInt(questionId, 10),
+            choice: checked ? checked.value : null,
+            elaboration: elaboration ? elaboration.value : ''
+        };
+    }
+
+    function sendNext() {
+        if (sending) return;
+        var questionId = Object.keys(pending)[0];
+        if (!questionId) return;
+        delete pending[questionId];
+
+        var answer = readAnswer(questionId);
+        // an elaboration is saved together with its choice
+        if (!answer.choice) {
+            sendNext();
+            return;
+        }
+
+        setStatus(questionId, 'Saving…');
+
+        sending = fetch(url, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            credentials: 'same-origin',
+            keepalive: true,
+            body: JSON.stringify(answer)
+        }).then(function(response) {
+            return response.json().then(function(result) {
+                if (response.ok && result.saved) {
+                    setStatus(questionId, 'Saved');
+                } else {
+                    setStatus(questionId, result.error || 'Not saved', true);
+                }
+            });
+        }).catch(function() {
+            // the answer is still sent with the form on Save / Next
+            setStatus(questionId, 'Not saved (offline?)', true);
+        }).then(function() {
+            sending = null;
+            sendNext();
+        });
+    }
+
+    function schedule(questionId, delay) {
+        clearTimeout(timers[questionId]);
+        timers[questionId] = setTimeout(function() {
+            delete timers[questionId];
+            pending[questionId] = true;
+            sendNext();
+        }, delay);
+    }
+
+    function flush() {
+        Object.keys(timers).forEach(function(questionId) {
+            clearTimeout(timers[questionId]);
+            delete timers[questionId];
+            pending[questionId] = true;
+        });
+        sendNext();
+    }
+
+    form.querySelectorAll('.question-box[data-question-id]').forEach(function(box) {
+        var questionId = box.getAttribute('data-question-id');
+
+        box.querySelectorAll('input[type="radio"]').forEach(function(radio) {
+            radio.addEventListener('change', function() { schedule(questionId, CHOICE_DELAY); });
+        });
+
+        var elaboration = box.querySelector('textarea');
+        if (elaboration) {
+            elaboration.addEventListener('input', function() { schedule(questionId, ELABORATION_DELAY); });
+            elaboration.addEventListener('blur', function() {
+                if (timers[questionId]) schedule(questionId, 0);
+            });
+        }
+    });
+
+    // the form sends every answer itself, so nothing is left to autosave
+    // (a late autosave after Submit would otherwise start a new response)
+    form.addEventListener('submit', function(event) {
+        if (submitting) {
+            event.preventDefault();
+            return;
+        }
+
+        Object.keys(timers).forEach(function(questionId) { clearTimeout(timers[questionId]); });
+        timers = {};
+        pending = {};
+        form.removeAttribute('data-autosave-url');
+        if (!sending) return;
+
+        // a save still in flight may be the one that starts the response, so
+        // the form is only sent once it has finished
+        event.preventDefault();
+        submitting = true;
+
+        // form.submit() leaves out the button that was pressed
+        var button = event.submitter;
+        if (button && button.name) {
+            var action = document.createElement('input');
+            action.type = 'hidden';
+            action.name = button.name;
+            action.value = button.value;
+            form.appendChild(action);
+        }
+
+        sending.then(function() { form.submit(); });
+    });
+
+    // don't lose the last few key presses when the page is closed
+    window.addEventListener('pagehide', function() {
+        if (form.hasAttribute('data-autosave-url')) flush();
+    });
+})();
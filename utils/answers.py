@@ -0,0 +1,129 @@
+from sqlalchemy import delete, select
+from database import db
+from database.upsert import upsert
+from data_tables.answer import Answer
+from data_tables.response import Response
+from data_tables.response_revision import ResponseRevision
+from utils.tallies import update_tallies
+from utils.metrics import metrics
+
+"""
+saves the answers a respondent gives on one section.
+
+answers are keyed on (response_id, question_id), so instead of deleting the
+section's answers and inserting them all again, the submitted answers are
+compared with the saved ones: new and changed answers are written with one
+batched upsert, answers that were cleared are deleted, and answers that are
+the same are not touched at all. going back and forth between sections
+without changing anything writes nothing.
+
+the saved answers decide the tally deltas, so they are read only after taking
+the write lock on the response (see lock_response): two saves of the same
+response at once take turns instead of both counting from the same old answers.
+"""
+
+
+def lock_response_statement(response_id):
+    """
+    Statement that takes the write lock on a response: a no-op UPDATE on SQLite
+    (pysqlite doesn't BEGIN before a SELECT, only before a write, and a write
+    takes SQLite's database-wide write lock), SELECT ... FOR UPDATE elsewhere.
+    """
+    if db.engine.dialect.name == 'sqlite':
+        responses = Response.__table__
+        # a column no foreign key points at, so the child tables aren't checked
+        return responses.update().where(responses.c.id == response_id).values(is_complete=responses.c.is_complete)
+    return select(Response.id).where(Response.id == response_id).with_for_update()
+
+
+def lock_response(response_id):
+    """
+    Hold the write lock on a response until the transaction ends, so nothing
+    else changes its answers in between. Caller is responsible for committing.
+    """
+    db.session.execute(lock_response_statement(response_id))
+
+
+def bump_response_revision(response_id):
+    """Mark the answers of a response as changed. Caller is responsible for committing."""
+    upsert(ResponseRevision, [{'response_id': response_id, 'revision': 1}],
+           index_elements=['response_id'],
+           set_={'revision': ResponseRevision.__table__.c.revision + 1})
+
+
+def saved_answers_query(response_id, question_ids):
+    """Query of (question_id, choice, elaboration) of the saved answers of some questions of a response."""
+    return (
+        db.session.query(Answer.question_id, Answer.choice, Answer.elaboration)
+        .filter(Answer.response_id == response_id, Answer.question_id.in_(question_ids))
+    )
+
+
+def delete_answers_statement(response_id, question_ids):
+    """DELETE of the answers of some questions of a response."""
+    return delete(Answer).where(Answer.response_id == response_id, Answer.question_id.in_(question_ids))
+
+
+def save_answers(response, question_ids, submitted):
+    """
+    Save the answers of a response for a set of questions. Caller is responsible for committing.
+
+    Parameters:
+        response: Response the answers belong to
+        question_ids: Questions being saved (the questions of a section)
+        submitted: Dict of question_id -> (choice, elaboration) for the questions
+                   that were answered; the others are cleared
+
+    Returns:
+        Number of answers written or deleted (0 if nothing changed)
+    """
+    question_ids = list(question_ids)
+    if not question_ids:
+        return 0
+
+    lock_response(response.id)
+
+    saved = {
+        question_id: (choice, elaboration)
+        for question_id, choice, elaboration in saved_answers_query(response.id, question_ids)
+    }
+
+    changed_rows = []
+    cleared = []
+    for question_id in question_ids:
+        answer = submitted.get(question_id)
+        if answer is None:
+            if question_id in saved:
+                cleared.append(question_id)
+        elif saved.get(question_id) != answer:
+            changed_rows.append({
+                'response_id': response.id,
+                'question_id': question_id,
+                'choice': answer[0],
+                'elaboration': answer[1]
+            })
+
+    if not changed_rows and not cleared:
+        return 0
+
+    # one INSERT ... ON CONFLICT DO UPDATE for every new or changed answer
+    upsert(Answer, changed_rows,
+           index_elements=['response_id', 'question_id'],
+           update_columns=['choice', 'elaboration'])
+
+    if cleared:
+        db.session.execute(delete_answers_statement(response.id, cleared),
+                           execution_options={'synchronize_session': False})
+
+    # keep the per-question tallies in step, in the same transaction
+    # (an edited comment with the same choice doesn't change them)
+    old_answers = [(question_id, saved[question_id][0]) for question_id in cleared]
+    old_answers += [(row['question_id'], saved[row['question_id']][0]) for row in changed_rows if row['question_id'] in saved]
+    new_answers = [(row['question_id'], row['choice']) for row in changed_rows]
+    update_tallies(old_answers, new_answers, is_complete=response.is_complete)
+
+    bump_response_revision(response.id)
+
+    written = len(changed_rows) + len(cleared)
+    metrics.inc('eacts_answers_saved_total', (('survey_id', str(response.survey_id)),), written)
+    return written
@@ -0,0 +1,126 @@
+from database import db
+from data_tables.question import Question
+from data_tables.section import Section
+
+"""
+writes imported questions to the database in batches.
+
+each batch is one INSERT executed with many rows (executemany) instead of
+adding one Question object at a time to the session, so importing thousands
+of statements doesn't go through the ORM unit of work row by row.
+"""
+
+# how many rows are sent to the database per INSERT
+BATCH_SIZE = 1000
+
+
+def insert_rows(table, rows, batch_size=BATCH_SIZE):
+    """
+    Insert rows into a table in batches. Caller is responsible for committing.
+
+    Parameters:
+        table: SQLAlchemy Table to insert into
+        rows: Iterable of column dicts (can be a generator, it is read batch by batch)
+        batch_size: Rows per INSERT
+
+    Returns:
+        Number of rows inserted
+    """
+    statement = table.insert()
+    total = 0
+    batch = []
+
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            db.session.execute(statement, batch)
+            total += len(batch)
+            batch = []
+
+    if batch:
+        db.session.execute(statement, batch)
+        total += len(batch)
+
+    return total
+
+
+def insert_rows_returning_ids(table, rows):
+    """
+    Insert rows with one executemany INSERT and get their new ids back, in the
+    same order as the rows. Caller is responsible for committing.
+
+    Backends that can't return ids from an executemany get one INSERT per row.
+
+    Returns:
+        List of primary key values
+    """
+    rows = list(rows)
+    if not rows:
+        return []
+
+    dialect = db.engine.dialect
+    if dialect.insert_executemany_returning_sort_by_parameter_order:
+        statement = table.insert().returning(table.c.id, sort_by_parameter_order=True)
+        return [row.id for row in db.session.execute(statement, rows)]
+
+    return [db.session.execute(table.insert().values(row)).inserted_primary_key[0] for row in rows]
+
+
+def insert_questions(section_id, question_texts, first_number=1, batch_size=BATCH_SIZE):
+    """
+    Add questions to a section with batched inserts. Caller is responsible for committing.
+
+    Parameters:
+        section_id: Id of the section the questions belong to
+        question_texts: Iterable of question texts in order (can be a generator)
+        first_number: question_number of the first question
+
+    Returns:
+        Number of questions inserted
+    """
+    rows = (
+        {'section_id': section_id, 'question_number': number, 'question_text': text}
+        for number, text in enumerate(question_texts, start=first_number)
+    )
+    return insert_rows(Question.__table__, rows, batch_size)
+
+
+def insert_sections_with_questions(survey_id, section_questions, batch_size=BATCH_SIZE):
+    """
+    Build the sections of a survey and their questions from one pass over
+    (section_title, question_text) pairs. Caller is responsible for committing.
+
+    A section is created the first time its title appears (numbered in that
+    order) and questions are numbered from 1 within their section. Questions
+    are written with batched inserts while the pairs are still being read.
+
+    Parameters:
+        survey_id: Id of the survey the sections belong to
+        section_questions: Iterable of (section_title, question_text) pairs
+
+    Returns:
+        (number of sections, number of questions) inserted
+    """
+    section_table = Section.__table__
+    sections = {}  # title -> [section_id, next question number]
+
+    def question_rows():
+        for section_title, question_text in section_questions:
+            section = sections.get(section_title)
+
+            if section is None:
+                # the section has to exist before any of its questions are flushed
+                result = db.session.execute(section_table.insert().values(
+                    survey_id=survey_id,
+                    section_number=len(sections) + 1,
+                    title=section_title[:200],
+                    description=''
+                ))
+                section = [result.inserted_primary_key[0], 1]
+                sections[section_title] = section
+
+            yield {'section_id': section[0], 'question_number': section[1], 'question_text': question_text}
+            section[1] += 1
+
+    question_count = insert_rows(Question.__table__, question_rows(), batch_size)
+    return len(sections), question_count
@@ -0,0 +1,135 @@
+from datetime import datetime
+from sqlalchemy import case, func, tuple_
+from database import db
+from data_tables.response import Response
+from data_tables.survey import Survey
+
+"""
+the admin dashboard's list of surveys, one page at a time.
+
+pages are found with keyset pagination on (created_at, id): the next page
+starts after the last survey of this one, so old pages cost the same as the
+first instead of growing with an OFFSET. the ids of a page are picked from
+that index first, then one aggregate query counts the responses of just those
+surveys.
+
+surveys without a created_at (inserted in bulk without it) come last, ordered
+by id alone.
+"""
+
+SURVEYS_PER_PAGE = 20
+
+
+def encode_cursor(survey):
+    """Cursor pointing just after a survey, used as ?after= in the next page link."""
+    created_at = survey.created_at.isoformat() if survey.created_at else ''
+    return f'{created_at}_{survey.id}'
+
+
+def decode_cursor(cursor):
+    """
+    Read a cursor made by encode_cursor.
+
+    Returns:
+        (created_at, survey_id), or None if the cursor is missing or invalid.
+        created_at is None for a survey without one.
+    """
+    if not cursor:
+        return None
+
+    try:
+        created_at, survey_id = cursor.rsplit('_', 1)
+        return (datetime.fromisoformat(created_at) if created_at else None), int(survey_id)
+    except ValueError:
+        return None
+
+
+def dated_page_query(after=None, limit=SURVEYS_PER_PAGE + 1):
+    """
+    Query of the ids of the next surveys with a created_at, newest first.
+
+    Parameters:
+        after: (created_at, survey_id) of the last survey of the previous page
+        limit: Surveys to fetch
+    """
+    query = db.session.query(Survey.id).filter(Survey.created_at.isnot(None))
+    if after is not None:
+        # (created_at, id) < (?, ?) is a range seek on the index
+        query = query.filter(tuple_(Survey.created_at, Survey.id) < tuple_(*after))
+    return query.order_by(Survey.created_at.desc(), Survey.id.desc()).limit(limit)
+
+
+def undated_page_query(after_id=None, limit=SURVEYS_PER_PAGE + 1):
+    """Query of the ids of the next surveys without a created_at, newest (highest id) first."""
+    query = db.session.query(Survey.id).filter(Survey.created_at.is_(None))
+    if after_id is not None:
+        query = query.filter(Survey.id < after_id)
+    return query.order_by(Survey.id.desc()).limit(limit)
+
+
+def response_counts_query(survey_ids):
+    """Query of (survey, response count, complete count) for some surveys."""
+    complete_count = func.sum(case((Response.is_complete.is_(True), 1), else_=0))
+    return (
+        db.session.query(Survey, func.count(Response.id), complete_count)
+        .outerjoin(Response, Response.survey_id == Survey.id)
+        .filter(Survey.id.in_(survey_ids))
+        .group_by(Survey.id)
+    )
+
+
+def get_page_survey_ids(after=None, limit=SURVEYS_PER_PAGE + 1):
+    """
+    Ids of the surveys of a page, newest first. The surveys with a date come
+    first and are found with a seek on the (created_at, id) index, the ones
+    without (only after all the dated ones) by id.
+    """
+    survey_ids = []
+    if after is None or after[0] is not None:
+        survey_ids = [survey_id for survey_id, in dated_page_query(after, limit)]
+
+    if len(survey_ids) < limit:
+        after_id = after[1] if after is not None and after[0] is None else None
+        survey_ids += [survey_id for survey_id, in undated_page_query(after_id, limit - len(survey_ids))]
+
+    return survey_ids
+
+
+def get_dashboard_page(cursor=None, per_page=SURVEYS_PER_PAGE):
+    """
+    Get one page of surveys, newest first, with their response counts.
+
+    Parameters:
+        cursor: ?after= value of the page (None for the first page)
+        per_page: Surveys per page
+
+    Returns:
+        Dict with 'surveys' (Survey objects), 'response_counts'
+        (survey_id -> {'total', 'complete', 'in_progress'}) and 'next_cursor'
+        (None on the last page)
+    """
+    # the surveys of the page first (one extra tells us whether there is
+    # another page), then the responses are counted for those surveys only
+    survey_ids = get_page_survey_ids(decode_cursor(cursor), per_page + 1)
+    has_more = len(survey_ids) > per_page
+    survey_ids = survey_ids[:per_page]
+
+    rows = response_counts_query(survey_ids).all() if survey_ids else []
+    position = {survey_id: index for index, survey_id in enumerate(survey_ids)}
+    rows.sort(key=lambda row: position[row[0].id])
+
+    surveys = []
+    response_counts = {}
+    for survey, total, complete in rows:
+        surveys.append(survey)
+        response_counts[survey.id] = {
+            'total': total,
+            'complete': complete or 0,
+            'in_progress': total - (complete or 0)
+        }
+
+    return {
+        'surveys': surveys,
+        'response_counts': response_counts,
+        'next_cursor': encode_cursor(surveys[-1]) if has_more else None
+    }
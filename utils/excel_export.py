@@ -0,0 +1,187 @@
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment
+from openpyxl.utils import get_column_letter
+from database import db
+from data_tables.answer import Answer
+from data_tables.question import Question
+from data_tables.response import Response
+from data_tables.section import Section
+from utils.statistics import get_survey_statistics, no_percentage
+
+"""
+writes the results of a survey to an Excel file without building the whole
+workbook in memory.
+
+the workbook is opened in openpyxl write-only mode so every row is written out
+as soon as it is appended, and the comments / raw answers are read from the
+database with a streaming cursor (yield_per) instead of being loaded all at once.
+memory stays about the same whatever the number of respondents or comments.
+"""
+
+# rows fetched from the database at a time by the streaming queries
+STREAM_BATCH_SIZE = 1000
+
+HEADER_FILL = PatternFill(start_color='1B3A5C', end_color='1B3A5C', fill_type='solid')
+HEADER_FONT = Font(bold=True, color='FFFFFF')
+HEADER_ALIGNMENT = Alignment(horizontal='center', vertical='center', wrap_text=True)
+WRAP_ALIGNMENT = Alignment(wrap_text=True, vertical='top')
+
+RESULTS_HEADERS = ['Q#', 'Section', 'Question Text', 'Total Responses',
+                   'Yes %', 'No %', 'Abstain', 'Comments']
+RESULTS_COLUMN_WIDTHS = [6, 18, 60, 16, 10, 10, 10, 60]
+
+
+def header_row(sheet, headers):
+    """Styled header cells for a write-only sheet."""
+    cells = []
+    for title in headers:
+        cell = WriteOnlyCell(sheet, value=title)
+        cell.fill = HEADER_FILL
+        cell.font = HEADER_FONT
+        cell.alignment = HEADER_ALIGNMENT
+        cells.append(cell)
+    return cells
+
+
+def wrapped_cell(sheet, value):
+    """Write-only cell with wrapped, top-aligned text."""
+    cell = WriteOnlyCell(sheet, value=value)
+    cell.alignment = WRAP_ALIGNMENT
+    return cell
+
+
+def iter_comments_by_question(survey_id):
+    """
+    Stream the non-empty elaborations of a survey in the same order as
+    get_survey_statistics (section, then question, then answer order).
+
+    Yields:
+        (question_id, comment) pairs
+    """
+    rows = (
+        db.session.query(Answer.question_id, Answer.elaboration)
+        .join(Question, Answer.question_id == Question.id)
+        .join(Section, Question.section_id == Section.id)
+        .filter(Section.survey_id == survey_id)
+        .filter(Answer.elaboration.isnot(None))
+        .order_by(Section.section_number, Section.id, Question.question_number, Question.id, Answer.id)
+        .yield_per(STREAM_BATCH_SIZE)
+    )
+    for question_id, elaboration in rows:
+        comment = elaboration.strip()
+        if comment:
+            yield question_id, comment
+
+
+def iter_snapshot_comments(snapshot):
+    """Same as iter_comments_by_question, from the frozen results of a closed survey."""
+    for stats in snapshot.statistics:
+        for item in snapshot.elaborations.get(stats['question_id'], []):
+            comment = item['elaboration'].strip()
+            if comment:
+                yield stats['question_id'], comment
+
+
+def write_results_sheet(workbook, survey_id, snapshot=None):
+    """Add the 'Results' sheet: one row per question with its statistics and comments."""
+    sheet = workbook.create_sheet('Results')
+
+    # Column widths have to be set before any row is written
+    for i, width in enumerate(RESULTS_COLUMN_WIDTHS, start=1):
+        sheet.column_dimensions[get_column_letter(i)].width = width
+
+    sheet.append(header_row(sheet, RESULTS_HEADERS))
+
+    if snapshot:
+        statistics = snapshot.statistics
+        comments = iter_snapshot_comments(snapshot)
+    else:
+        statistics = get_survey_statistics(survey_id)
+        comments = iter_comments_by_question(survey_id)
+    next_comment = next(comments, None)
+
+    for stats in statistics:
+        # both come back in question order, so collect this question's comments
+        # from the stream and move on (only one question's comments in memory)
+        question_comments = []
+        while next_comment is not None and next_comment[0] == stats['question_id']:
+            question_comments.append(next_comment[1])
+            next_comment = next(comments, None)
+
+        sheet.append([
+            stats['question_number'],
+            stats['section_title'],
+            wrapped_cell(sheet, stats['question_text']),
+            stats['total_responses'],
+            f"{stats['yes_percentage']}%",
+            f"{no_percentage(stats)}%",
+            stats['abstain_count'],
+            wrapped_cell(sheet, ' | '.join(question_comments)),
+        ])
+
+
+def write_raw_answers_sheet(workbook, survey_id, snapshot=None):
+    """
+    Add the 'Raw Answers' sheet: one row per respondent with their choice for
+    every question, streamed from a single query ordered by response.
+    """
+    sheet = workbook.create_sheet('Raw Answers')
+
+    questions = snapshot.statistics if snapshot else get_survey_statistics(survey_id)
+    column_of_question = {stats['question_id']: index for index, stats in enumerate(questions)}
+
+    headers = ['Response ID', 'Name', 'Status', 'Submitted At']
+    headers += [f"S{stats['section_number']} Q{stats['question_number']}" for stats in questions]
+    sheet.append(header_row(sheet, headers))
+
+    rows = (
+        db.session.query(Response.id, Response.participant_name, Response.is_complete,
+                         Response.submitted_at, Answer.question_id, Answer.choice)
+        .outerjoin(Answer, Answer.response_id == Response.id)
+        .filter(Response.survey_id == survey_id)
+        .order_by(Response.id)
+        .yield_per(STREAM_BATCH_SIZE)
+    )
+
+    current_id = None
+    current_row = None
+
+    for response_id, name, is_complete, submitted_at, question_id, choice in rows:
+        if response_id != current_id:
+            if current_row is not None:
+                sheet.append(current_row)
+            current_id = response_id
+            current_row = [
+                response_id,
+                name or 'Anonymous',
+                'Complete' if is_complete else 'In progress',
+                submitted_at,
+            ] + [''] * len(questions)
+
+        if question_id in column_of_question:
+            current_row[4 + column_of_question[question_id]] = choice
+
+    if current_row is not None:
+        sheet.append(current_row)
+
+
+def write_results_workbook(survey_id, file_path, include_raw_answers=False, snapshot=None):
+    """
+    Write the results workbook of a survey to a file.
+
+    Parameters:
+        survey_id: Id of the survey
+        file_path: Where to save the .xlsx file
+        include_raw_answers: Also add the per-respondent 'Raw Answers' sheet
+        snapshot: FrozenResults of a closed survey to take the statistics and
+                  comments from (the raw answers are always streamed)
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+
+    write_results_sheet(workbook, survey_id, snapshot)
+    if include_raw_answers:
+        write_raw_answers_sheet(workbook, survey_id, snapshot)
+
+    workbook.save(file_path)
+
@@ -1,4 +1,21 @@
 import pandas as pd
+from openpyxl import load_workbook
+
+def clean_question_column(column):
+    """
+    Clean a column of question texts in one go instead of row by row.
+    
+    Parameters:
+        column: pandas Series read from the Excel file
+    
+    Returns:
+        Series of stripped question texts with empty cells removed
+    """
+    column = column.dropna().astype(str).str.strip()
+    
+    # Skip empty rows
+    return column[(column != '') & (column != 'nan')]
+
 
 def process_excel_file(file_path):
     """
@@ -10,32 +27,177 @@ def process_excel_file(file_path):
     Returns:
         List of question texts (strings)
     """
-    # Read the Excel file
-    excel_data = pd.read_excel(file_path)
-    
-    # Get the first column (where questions are)
+    # Read only the first column (where questions are)
+    excel_data = pd.read_excel(file_path, usecols=[0])
     first_column = excel_data.columns[0]
     
-    # Extract questions
-    questions_list = []
+    return clean_question_column(excel_data[first_column]).tolist()
 
 
+def iter_excel_questions(file_path):
+    """
+    Stream the questions of an Excel file one at a time.
+    
+    Uses openpyxl's read-only mode so the workbook is read row by row and is
+    never loaded into memory as a whole. Gives the same questions as
+    process_excel_file (the first row is the header, like pandas treats it).
+    Only works for .xlsx files.
+    
+    Parameters:
+        file_path: Path to the .xlsx file
     
-    for row_index, row_data in excel_data.iterrows():
-        # Get the question text
-        question_text = str(row_data[first_column])
-        question_text = question_text.strip()  # Remove extra spaces
+    Yields:
+        Question texts (strings)
+    """
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    
+    try:
+        sheet = workbook.worksheets[0]
+        rows = sheet.iter_rows(min_col=1, max_col=1, values_only=True)
         
-        # Skip empty rows
-        is_empty = pd.isna(row_data[first_column])
-        if is_empty or question_text == '' or question_text == 'nan':
-            continue
+        # Skip the header row
+        next(rows, None)
         
+        for (cell_value,) in rows:
+            if cell_value is None:
+                continue
+            
+            question_text = str(cell_value).strip()
+            if question_text == '' or question_text == 'nan':
+                continue
+            
+            yield question_text
+    finally:
+        workbook.close()
+
+
+def find_section_column(header):
+    """
+    Find the "Section" column in a header row.
+    
+    Returns:
+        Index of the column, or None if the sheet has no Section column
+    """
+    for index, name in enumerate(header):
+        if name is not None and str(name).strip().lower() == 'section':
+            return index
+    return None
+
+
+def find_question_column(header, section_column):
+    """
+    Find the column with the questions: the one called "Question" if there is
+    one, otherwise the first column that isn't the Section column.
+    """
+    for index, name in enumerate(header):
+        if index != section_column and name is not None and str(name).strip().lower() in ('question', 'questions'):
+            return index
+    
+    return 1 if section_column == 0 else 0
+
+
+def clean_cell(value):
+    """Text of a cell, or None if it is empty."""
+    if value is None:
+        return None
+    
+    text = str(value).strip()
+    if text == '' or text == 'nan':
+        return None
+    return text
 
-        # Add to list
-        questions_list.append(question_text)
+
+def iter_excel_sections(file_path):
+    """
+    Stream the sections and questions of a whole workbook in one pass.
+    
+    Every worksheet is read in read-only mode, one row at a time:
+        - if its header row has a "Section" column, each row goes into the
+          section named in that column
+        - otherwise the sheet is one section named after the sheet and the
+          questions are read from the first column
     
-    return questions_list
+    Parameters:
+        file_path: Path to the .xlsx file
+    
+    Yields:
+        (section_title, question_text) pairs in workbook order
+    """
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    
+    try:
+        for sheet in workbook.worksheets:
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                continue
+            
+            section_column = find_section_column(header)
+            question_column = find_question_column(header, section_column)
+            sheet_title = sheet.title.strip()
+            
+            for row in rows:
+                if question_column >= len(row):
+                    continue
+                
+                question_text = clean_cell(row[question_column])
+                if question_text is None:
+                    continue
+                
+                if section_column is None:
+                    section_title = sheet_title
+                else:
+                    # rows without a section name stay in the sheet's own section
+                    section_value = row[section_column] if section_column < len(row) else None
+                    section_title = clean_cell(section_value) or sheet_title
+                
+                yield section_title, question_text
+    finally:
+        workbook.close()
+
+
+def process_excel_sections(file_path):
+    """
+    Same as iter_excel_sections but reads the workbook with pandas, for .xls
+    files that openpyxl can't stream.
+    
+    Returns:
+        List of (section_title, question_text) pairs in workbook order
+    """
+    all_sheets = pd.read_excel(file_path, sheet_name=None, header=None, dtype=object)
+    pairs = []
+    
+    for sheet_title, sheet_data in all_sheets.items():
+        if sheet_data.empty:
+            continue
+        
+        # same rules as the streaming reader, on lists of cell values
+        header = [None if pd.isna(value) else value for value in sheet_data.iloc[0].tolist()]
+        section_column = find_section_column(header)
+        question_column = find_question_column(header, section_column)
+        
+        if question_column >= len(header):
+            continue
+        
+        data = sheet_data.iloc[1:]
+        questions = data.iloc[:, question_column].where(data.iloc[:, question_column].notna(), None)
+        if section_column is None:
+            sections = [None] * len(data)
+        else:
+            sections = data.iloc[:, section_column].where(data.iloc[:, section_column].notna(), None).tolist()
+        
+        for question_value, section_value in zip(questions.tolist(), sections):
+            question_text = clean_cell(question_value)
+            if question_text is None:
+                continue
+            pairs.append((clean_cell(section_value) or str(sheet_title).strip(), question_text))
+    
+    return pairs
+
+
+def can_stream_excel_file(filename):
+    """Only .xlsx files can be streamed with openpyxl (.xls needs pandas)."""
+    return filename.rsplit('.', 1)[-1].lower() == 'xlsx'
 
 
 def check_if_excel_file(filename):
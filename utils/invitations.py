@@ -0,0 +1,244 @@
+import csv
+import re
+import secrets
+from datetime import datetime
+import openpyxl
+import pandas as pd
+from sqlalchemy import case, func
+from database import db
+from data_tables.invitation import Invitation
+from data_tables.invitation_batch import InvitationBatch
+from data_tables.outbound_email import OutboundEmail
+from data_tables.response import Response
+from data_tables.response_revision import ResponseRevision
+from utils.bulk_import import BATCH_SIZE, insert_rows, insert_rows_returning_ids
+
+"""
+invites a list of people to a survey.
+
+the recipient list (CSV or Excel) is read once. every recipient gets an
+invitation with their own token, and an email with the survey link for that
+token. emails and invitations are written with batched inserts, and the emails
+are sent by the background mail queue (utils/mail_queue.py), batched and rate
+limited.
+
+nothing is added to the responses until an invitee saves their first answer:
+the response is then made with the invitation's token as its resume token
+(see start_response in routes/take_survey.py), so the same link lets them
+continue later.
+"""
+
+INVITATION_FILE_TYPES = ['csv', 'xlsx', 'xls']
+
+# good enough to catch typos and empty cells, the mail server does the rest
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+
+def check_if_recipient_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in INVITATION_FILE_TYPES
+
+
+def iter_file_rows(file_path):
+    """Rows of a CSV or Excel file as lists of cell values."""
+    extension = file_path.rsplit('.', 1)[1].lower()
+
+    if extension == 'csv':
+        with open(file_path, newline='', encoding='utf-8-sig') as csv_file:
+            yield from csv.reader(csv_file)
+    elif extension == 'xlsx':
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            yield from (list(row) for row in workbook.active.iter_rows(values_only=True))
+        finally:
+            workbook.close()
+    else:
+        data_frame = pd.read_excel(file_path, header=None, dtype=str)
+        yield from (list(row) for row in data_frame.itertuples(index=False))
+
+
+def find_recipient_columns(header):
+    """
+    Find the email and name columns from a header row.
+
+    Returns:
+        (email column, name column or None), or None if the row isn't a header
+    """
+    names = [str(cell).strip().lower() if cell is not None else '' for cell in header]
+
+    email_column = next((i for i, name in enumerate(names) if 'email' in name or 'e-mail' in name), None)
+    if email_column is None:
+        return None
+
+    name_column = next((i for i, name in enumerate(names) if 'name' in name and i != email_column), None)
+    return email_column, name_column
+
+
+def read_recipients(file_path):
+    """
+    Read the recipients of an invitation list. The email column is the one
+    whose header contains "email" (the first column if there is no header) and
+    the name column the one whose header contains "name".
+
+    Returns:
+        (list of (email, name) without duplicates, number of rows skipped)
+    """
+    rows = iter_file_rows(file_path)
+    first_row = next(rows, None)
+    if first_row is None:
+        return [], 0
+
+    columns = find_recipient_columns(first_row)
+    if columns is None:
+        # no header: first column is the email, second the name
+        columns = (0, 1 if len(first_row) > 1 else None)
+        rows = _chain_first(first_row, rows)
+    email_column, name_column = columns
+
+    recipients = []
+    seen = set()
+    skipped = 0
+
+    for row in rows:
+        email = str(row[email_column]).strip() if email_column < len(row) and row[email_column] is not None else ''
+        if not email and not any(cell not in (None, '') for cell in row):
+            continue  # blank line
+
+        if not EMAIL_PATTERN.match(email) or email.lower() in seen:
+            skipped += 1
+            continue
+        seen.add(email.lower())
+
+        name = None
+        if name_column is not None and name_column < len(row) and row[name_column] not in (None, ''):
+            name = str(row[name_column]).strip()[:200] or None
+
+        recipients.append((email, name))
+
+    return recipients, skipped
+
+
+def _chain_first(first_row, rows):
+    yield first_row
+    yield from rows
+
+
+def invitation_email(survey_title, name, link):
+    """Subject and body of one invitation email."""
+    greeting = f'Dear {name},' if name else 'Hello,'
+    subject = f'Invitation: {survey_title}'
+    body = f'''{greeting}
+
+You are invited to take part in: {survey_title}
+
+Please use your personal link below to answer the survey. You can stop at any
+time and continue later from the same link:
+{link}
+
+This link is unique to you, please don't forward it.
+
+Best regards,
+EACTS Survey System
+'''
+    return subject, body
+
+
+def invitation_query(token, survey_id):
+    """Query of the invitation to a survey that a personal link's token belongs to."""
+    return (
+        Invitation.query
+        .join(InvitationBatch, Invitation.batch_id == InvitationBatch.id)
+        .filter(Invitation.token == token, InvitationBatch.survey_id == survey_id)
+    )
+
+
+def create_invitations(survey, recipients, link_for, file_name=None, skipped=0, batch_size=BATCH_SIZE):
+    """
+    Create the invitations and queued emails of an invitation list. Caller is
+    responsible for committing and should call mail_queue.notify() after.
+
+    Recipients who were invited to this survey before are left out.
+
+    Parameters:
+        survey: Survey to invite people to
+        recipients: List of (email, name) from read_recipients
+        link_for: Function that turns an invitation token into the survey link
+        file_name: Name of the uploaded list, shown on the invitations page
+        skipped: Rows of the list already skipped as invalid or duplicate
+
+    Returns:
+        The InvitationBatch
+    """
+    already_invited = {
+        email for (email,) in
+        db.session.query(func.lower(Invitation.email))
+        .join(InvitationBatch, Invitation.batch_id == InvitationBatch.id)
+        .filter(InvitationBatch.survey_id == survey.id)
+        .all()
+    }
+    new_recipients = [(email, name) for email, name in recipients if email.lower() not in already_invited]
+
+    batch = InvitationBatch(survey_id=survey.id,
+                            file_name=file_name,
+                            total=len(new_recipients),
+                            skipped=skipped + len(recipients) - len(new_recipients))
+    db.session.add(batch)
+    db.session.flush()
+
+    now = datetime.utcnow()
+    for start in range(0, len(new_recipients), batch_size):
+        chunk = new_recipients[start:start + batch_size]
+        tokens = [secrets.token_urlsafe(32) for _ in chunk]
+
+        email_rows = []
+        for (email, name), token in zip(chunk, tokens):
+            subject, body = invitation_email(survey.title, name, link_for(token))
+            email_rows.append({'kind': 'invitation', 'recipient': email, 'subject': subject, 'body': body,
+                               'status': 'queued', 'attempts': 0, 'created_at': now, 'next_attempt_at': now})
+        email_ids = insert_rows_returning_ids(OutboundEmail.__table__, email_rows)
+
+        insert_rows(Invitation.__table__, [
+            {'batch_id': batch.id, 'email_id': email_id, 'email': email, 'name': name, 'token': token}
+            for (email, name), token, email_id in zip(chunk, tokens, email_ids)
+        ])
+
+    return batch
+
+
+def get_batch_progress(batch_ids):
+    """
+    How far the sending of each invitation batch has got, in one query.
+
+    Returns:
+        Dict of batch_id -> {'queued', 'sent', 'failed', 'started', 'complete'}
+        ('queued' includes emails being sent or waiting for a retry, 'started'
+        counts recipients who saved at least one answer)
+    """
+    progress = {batch_id: {'queued': 0, 'sent': 0, 'failed': 0, 'started': 0, 'complete': 0} for batch_id in batch_ids}
+    if not batch_ids:
+        return progress
+
+    def count(condition):
+        return func.sum(case((condition, 1), else_=0))
+
+    rows = (
+        db.session.query(
+            Invitation.batch_id,
+            count(OutboundEmail.status.in_(['queued', 'sending'])),
+            count(OutboundEmail.status == 'sent'),
+            count(OutboundEmail.status == 'failed'),
+            # a response has a revision once answers were saved on it
+            count(ResponseRevision.response_id.isnot(None)),
+            count(Response.is_complete.is_(True)),
+        )
+        .join(OutboundEmail, Invitation.email_id == OutboundEmail.id)
+        # invitees who haven't saved anything yet have no response
+        .outerjoin(Response, Response.resume_token == Invitation.token)
+        .outerjoin(ResponseRevision, ResponseRevision.response_id == Response.id)
+        .filter(Invitation.batch_id.in_(batch_ids))
+        .group_by(Invitation.batch_id)
+        .all()
+    )
+    for batch_id, queued, sent, failed, started, complete in rows:
+        progress[batch_id] = {'queued': int(queued or 0), 'sent': int(sent or 0), 'failed': int(failed or 0),
+                              'started': int(started or 0), 'complete': int(complete or 0)}
+    return progress
@@ -0,0 +1,160 @@
+import json
+import threading
+import time
+from database import db
+from utils.statistics import get_survey_statistics, count_responses
+
+"""
+live results for the results page, pushed to the browser with Server-Sent Events.
+
+the survey-taking routes call results_notifier.publish() after they commit
+answers. every admin watching the survey's results has an open event stream
+waiting on the notifier, and when it fires the statistics are recomputed once
+(live_results caches them per change) and each stream sends only the questions
+whose counts changed since its last event.
+
+the notifier only sees changes made by this process. to pick up answers saved
+by other processes the statistics are also recomputed when they are older
+than LIVE_RESULTS_POLL_SECONDS, at most once per interval whoever is watching.
+"""
+
+
+class ChangeNotifier:
+    """In-process counter per survey that threads can wait on until it changes."""
+
+    def __init__(self):
+        self._versions = {}
+        self._condition = threading.Condition()
+
+    def publish(self, survey_id):
+        """Signal that the answers of a survey changed."""
+        with self._condition:
+            self._versions[survey_id] = self._versions.get(survey_id, 0) + 1
+            self._condition.notify_all()
+
+    def version(self, survey_id):
+        with self._condition:
+            return self._versions.get(survey_id, 0)
+
+    def wait(self, survey_id, seen_version, timeout):
+        """
+        Wait until the survey's version is different from seen_version, or the timeout.
+
+        Returns:
+            The current version (the same as seen_version after a timeout)
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._versions.get(survey_id, 0) != seen_version, timeout)
+            return self._versions.get(survey_id, 0)
+
+
+def compute_results_snapshot(survey_id):
+    """The numbers shown in the results table, keyed by question id (as a string, like in JSON)."""
+    statistics = get_survey_statistics(survey_id)
+    return {
+        'responses': count_responses(survey_id),
+        'questions': {
+            str(stat['question_id']): {
+                'yes': stat['yes_count'],
+                'no': stat['no_count'],
+                'abstain': stat['abstain_count'],
+                'total': stat['total_responses'],
+                'yes_percentage': stat['yes_percentage'],
+                'meets_threshold': stat['meets_threshold'],
+            }
+            for stat in statistics
+        }
+    }
+
+
+class LiveResults:
+    """
+    Results snapshots shared by all the streams of a process: computed once per
+    change of the notifier version (or once per poll interval), whoever asks.
+    """
+
+    def __init__(self, poll_seconds=10):
+        self.poll_seconds = poll_seconds
+        self._snapshots = {}  # survey_id -> (version, computed_at, snapshot)
+        self._lock = threading.Lock()
+        self.computations = 0
+
+    def snapshot(self, survey_id, version):
+        # streams asking at the same time wait for the one computing and reuse its result
+        with self._lock:
+            cached = self._snapshots.get(survey_id)
+            now = time.monotonic()
+            if cached is not None and cached[0] == version and now - cached[1] < self.poll_seconds:
+                return cached[2]
+
+            snapshot = compute_results_snapshot(survey_id)
+            self._snapshots[survey_id] = (version, now, snapshot)
+            self.computations += 1
+            return snapshot
+
+    def forget(self, survey_id):
+        with self._lock:
+            self._snapshots.pop(survey_id, None)
+
+
+def diff_snapshots(previous, current):
+    """
+    What changed between two snapshots, for one event.
+
+    Returns:
+        Dict with 'responses', 'passed', 'failed' and the changed 'questions',
+        or None if nothing changed
+    """
+    changed = {question_id: numbers for question_id, numbers in current['questions'].items()
+               if previous is None or previous['questions'].get(question_id) != numbers}
+
+    if previous is not None and not changed and previous['responses'] == current['responses']:
+        return None
+
+    passed = sum(1 for numbers in current['questions'].values() if numbers['meets_threshold'])
+    return {
+        'responses': current['responses'],
+        'passed': passed,
+        'failed': len(current['questions']) - passed,
+        'questions': changed
+    }
+
+
+def format_event(event, data):
+    """One Server-Sent Event."""
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+def stream_results(survey_id, heartbeat_seconds=15):
+    """
+    Generator of the event stream of one watching admin. The first event has
+    every question, the next ones only the questions that changed. A 'reload'
+    event is sent when questions were added or removed (the page is rebuilt).
+    """
+    version = results_notifier.version(survey_id)
+    last = None
+
+    while True:
+        current = live_results.snapshot(survey_id, version)
+        # don't hold a database connection (or an old snapshot) while waiting
+        db.session.remove()
+
+        if last is not None and current['questions'].keys() != last['questions'].keys():
+            yield format_event('reload', {})
+            return
+
+        changes = diff_snapshots(last, current)
+        if changes is not None:
+            yield format_event('tallies', changes)
+        last = current
+
+        new_version = results_notifier.wait(survey_id, version, heartbeat_seconds)
+        if new_version == version:
+            # comment line, keeps proxies from closing the idle connection
+            yield ': keepalive\n\n'
+        version = new_version
+
+
+# one notifier and one snapshot cache per process
+results_notifier = ChangeNotifier()
+live_results = LiveResults()
@@ -0,0 +1,218 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from flask_mail import Message
+from sqlalchemy import case, or_, update
+from database import db
+from data_tables.outbound_email import OutboundEmail
+
+"""
+sends emails from a background thread instead of inside the request.
+
+a request adds an OutboundEmail row and returns straight away. the mailer
+thread picks up the queued emails in batches and sends each batch over one
+SMTP connection of the app's Mail instance. an email that fails is tried
+again later with a growing delay, and marked failed after MAIL_MAX_ATTEMPTS,
+so the table always shows what happened to every message.
+
+sending is rate limited (MAIL_RATE_LIMIT_PER_MINUTE) so a large invitation
+list doesn't hit the mail provider's limits, and resume links go out before
+queued invitations.
+"""
+
+# emails of these kinds are sent first, someone is waiting for them
+URGENT_KINDS = ['resume']
+
+
+class RateLimiter:
+    """Spaces calls to wait() so there are at most per_minute of them a minute."""
+
+    def __init__(self, per_minute=None):
+        self.per_minute = per_minute
+        self._next_at = 0.0
+
+    def wait(self):
+        if not self.per_minute:
+            return
+        now = time.monotonic()
+        if now < self._next_at:
+            time.sleep(self._next_at - now)
+            now = self._next_at
+        self._next_at = now + 60.0 / self.per_minute
+
+
+def missing_mail_settings():
+    """
+    Settings that still have to be set before emails can be sent: a sender
+    address, and the password if the SMTP server is logged into with
+    MAIL_USERNAME (a local relay without a login only needs the sender).
+
+    Returns:
+        List of the missing settings, for the "not configured" messages
+    """
+    missing = []
+    if not current_app.config.get('MAIL_DEFAULT_SENDER'):
+        missing.append('MAIL_USERNAME (or MAIL_DEFAULT_SENDER)')
+    if current_app.config.get('MAIL_USERNAME') and not current_app.config.get('MAIL_PASSWORD'):
+        missing.append('MAIL_PASSWORD')
+    return missing
+
+
+def queue_email(kind, recipient, subject, body):
+    """
+    Add an email to the queue. Caller is responsible for committing and
+    should call mail_queue.notify() after the commit.
+
+    Returns:
+        The OutboundEmail
+    """
+    email = OutboundEmail(kind=kind, recipient=recipient, subject=subject, body=body)
+    db.session.add(email)
+    return email
+
+
+def claim_email(email_id):
+    """Mark a queued email as being sent. False if another mailer got to it first."""
+    result = db.session.execute(
+        update(OutboundEmail)
+        .where(OutboundEmail.id == email_id, OutboundEmail.status == 'queued')
+        .values(status='sending', claimed_at=datetime.utcnow())
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def record_failure(email, error, max_attempts, backoff_seconds):
+    """Schedule another try with exponential backoff, or give up after max_attempts."""
+    email.attempts += 1
+    email.last_error = str(error)
+
+    if email.attempts >= max_attempts:
+        email.status = 'failed'
+        print(f"Email {email.id} to {email.recipient} failed for good: {error}")
+    else:
+        email.status = 'queued'
+        email.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff_seconds * 2 ** (email.attempts - 1))
+
+
+def send_due_emails(batch_size=50, max_attempts=5, backoff_seconds=30, rate_limiter=None):
+    """
+    Send one batch of the queued emails that are due, over a single SMTP connection.
+    Resume emails go first, then the rest in the order they were queued.
+
+    Returns:
+        Number of emails that were sent
+    """
+    due = (
+        OutboundEmail.query
+        .filter(OutboundEmail.status == 'queued')
+        .filter(or_(OutboundEmail.next_attempt_at.is_(None), OutboundEmail.next_attempt_at <= datetime.utcnow()))
+        .order_by(case((OutboundEmail.kind.in_(URGENT_KINDS), 0), else_=1), OutboundEmail.id)
+        .limit(batch_size)
+        .all()
+    )
+    claimed = [email for email in due if claim_email(email.id)]
+    if not claimed:
+        return 0
+
+    mail = current_app.extensions['mail']
+    sent = 0
+    unsent = list(claimed)
+
+    try:
+        with mail.connect() as connection:
+            while unsent:
+                email = unsent[0]
+                if rate_limiter is not None:
+                    rate_limiter.wait()
+                try:
+                    connection.send(Message(subject=email.subject, recipients=[email.recipient], body=email.body))
+                    email.status = 'sent'
+                    email.attempts += 1
+                    email.sent_at = datetime.utcnow()
+                    email.last_error = None
+                    sent += 1
+                except Exception as error:
+                    record_failure(email, error, max_attempts, backoff_seconds)
+                unsent.pop(0)
+                db.session.commit()
+
+    except Exception as error:
+        # the connection itself failed: the rest of the batch is tried again later
+        for email in unsent:
+            record_failure(email, error, max_attempts, backoff_seconds)
+        db.session.commit()
+
+    return sent
+
+
+class MailQueue:
+    """
+    Background thread that sends the queued emails.
+
+    It sleeps until notify() is called or poll_seconds pass (for retries and
+    emails queued by other processes), then sends everything that is due.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.thread = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self.rate_limiter = RateLimiter()
+
+    def init_app(self, app):
+        self.app = app
+        self.rate_limiter.per_minute = app.config.get('MAIL_RATE_LIMIT_PER_MINUTE')
+
+    def notify(self):
+        """Wake the mailer up to send newly queued emails."""
+        self._start()
+        self._wake.set()
+
+    def resume_pending(self):
+        """
+        Queue again the emails left half sent by a mailer that stopped, and send
+        them. Emails another running process is sending right now are left to it.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=self.app.config.get('MAIL_STALE_SECONDS', 600))
+        db.session.execute(
+            update(OutboundEmail)
+            .where(OutboundEmail.status == 'sending',
+                   or_(OutboundEmail.claimed_at.is_(None), OutboundEmail.claimed_at < cutoff))
+            .values(status='queued'),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.commit()
+
+        if OutboundEmail.query.filter_by(status='queued').first() is not None:
+            self.notify()
+
+    def _start(self):
+        with self._lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='mail-queue', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.app.config.get('MAIL_POLL_SECONDS', 5))
+            self._wake.clear()
+
+            with self.app.app_context():
+                try:
+                    # keep going while full batches are being sent
+                    batch_size = self.app.config.get('MAIL_BATCH_SIZE', 50)
+                    while send_due_emails(batch_size,
+                                          self.app.config.get('MAIL_MAX_ATTEMPTS', 5),
+                                          self.app.config.get('MAIL_RETRY_BACKOFF_SECONDS', 30),
+                                          self.rate_limiter) >= batch_size:
+                        pass
+                except Exception as error:
+                    db.session.rollback()
+                    print(f"Mail queue error: {error}")
+
+
+# one mailer per process
+mail_queue = MailQueue()
@@ -0,0 +1,254 @@
+"""
+in-process counters and histograms for /metrics, in the Prometheus text format.
+
+every thread counts into its own shard (a plain dict only that thread writes),
+so recording a request or a save never waits on a lock. the shards are only
+added up when /metrics is scraped. the shards of threads that have finished
+(the dev server starts one per request) are folded into one retired total
+whenever a new thread starts counting, so there are never more shards than
+live threads. the gauges (responses in progress, mail queue, connection pool)
+are read from the database and the engine at scrape time instead of being
+kept up to date.
+
+the numbers are per process: with several server processes, scrape each one
+or add them up in Prometheus.
+"""
+
+import bisect
+import threading
+import time
+from flask import g, request, request_started, request_finished
+from sqlalchemy import func
+from database import db
+
+# request latency buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# report generation takes much longer than a request
+REPORT_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'eacts_http_request_duration_seconds': (
+        'histogram', 'Time to handle a request, by endpoint and method.', LATENCY_BUCKETS),
+    'eacts_http_responses_total': (
+        'counter', 'Responses sent, by endpoint and status code.', None),
+    'eacts_answers_saved_total': (
+        'counter', 'Answers written (new, changed or cleared), by survey.', None),
+    'eacts_submits_total': (
+        'counter', 'Responses submitted, by survey.', None),
+    'eacts_report_duration_seconds': (
+        'histogram', 'Time to generate a PDF / Excel report, by format and outcome.', REPORT_BUCKETS),
+}
+
+
+class Metrics:
+    """Counters and histograms kept in one shard per thread."""
+
+    def __init__(self):
+        self._local = threading.local()
+        # (thread, shard) of every thread that has counted and may still be running
+        self._shards = []
+        # what the finished threads counted
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            # the only time a lock is taken: the first count of a new thread
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire_finished()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_finished(self):
+        """Fold the shards of finished threads into the retired total. Call with the lock held."""
+        running = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                running.append((thread, shard))
+            else:
+                # nothing writes to it any more
+                add_shard(self._retired, shard)
+        self._shards = running
+
+    def inc(self, name, labels=(), amount=1):
+        """
+        Add to a counter.
+
+        Parameters:
+            name: Counter name from METRICS
+            labels: Tuple of (label, value) pairs
+            amount: How much to add
+        """
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        """Record one value (e.g. seconds) in a histogram from METRICS."""
+        shard = self._shard()
+        key = (name, labels)
+        counts = shard.get(key)
+        if counts is None:
+            # one count per bucket plus +Inf, then the sum of the values
+            counts = shard[key] = [0] * (len(METRICS[name][2]) + 1) + [0.0]
+        counts[bisect.bisect_left(METRICS[name][2], value)] += 1
+        counts[-1] += value
+
+    def collect(self):
+        """Add up the shards of all threads. Returns a dict of (name, labels) -> value or bucket list."""
+        with self._lock:
+            self._retire_finished()
+            totals = {}
+            add_shard(totals, self._retired)
+            shards = [shard for _, shard in self._shards]
+
+        for shard in shards:
+            add_shard(totals, shard)
+        return totals
+
+    def init_app(self, app):
+        """Time every request of the app."""
+        request_started.connect(self._request_started, app)
+        request_finished.connect(self._request_finished, app)
+
+    def _request_started(self, sender, **extra):
+        g.metrics_started = time.perf_counter()
+
+    def _request_finished(self, sender, response, **extra):
+        started = g.get('metrics_started')
+        if started is None:
+            return
+
+        endpoint = request.endpoint or 'unmatched'
+        self.observe('eacts_http_request_duration_seconds',
+                     (('endpoint', endpoint), ('method', request.method)),
+                     time.perf_counter() - started)
+        self.inc('eacts_http_responses_total', (('endpoint', endpoint), ('status', str(response.status_code))))
+
+
+def add_shard(totals, shard):
+    """Add the counters and histogram buckets of a shard into totals (a dict of the same shape)."""
+    # a copy, the thread may add a key while this runs
+    for key, value in list(shard.items()):
+        if isinstance(value, list):
+            total = totals.get(key)
+            totals[key] = list(value) if total is None else [a + b for a, b in zip(total, value)]
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+
+# one set of metrics per process
+metrics = Metrics()
+
+
+def format_labels(labels):
+    """{name="value",...} with the value escaped, or '' without labels."""
+    if not labels:
+        return ''
+    parts = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def format_number(value):
+    if isinstance(value, float):
+        return repr(value) if value != int(value) else str(int(value))
+    return str(value)
+
+
+def format_counters(totals):
+    """Text lines of the counters and histograms in METRICS."""
+    lines = []
+    for name, (metric_type, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+
+        for (key_name, labels), value in sorted(totals.items(), key=lambda item: item[0]):
+            if key_name != name:
+                continue
+
+            if metric_type == 'histogram':
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    le_labels = labels + (('le', format_number(float(bound)) if bound != '+Inf' else bound),)
+                    lines.append(f'{name}_bucket{format_labels(le_labels)} {cumulative}')
+                lines.append(f'{name}_sum{format_labels(labels)} {format_number(value[-1])}')
+                lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+            else:
+                lines.append(f'{name}{format_labels(labels)} {format_number(value)}')
+    return lines
+
+
+def format_gauge(name, help_text, samples):
+    """Text lines of a gauge from (labels, value) pairs."""
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+    for labels, value in samples:
+        lines.append(f'{name}{format_labels(labels)} {format_number(value)}')
+    return lines
+
+
+def collect_gauges():
+    """Gauges read at scrape time: responses in progress, mail queue and the connection pool."""
+    from data_tables.outbound_email import OutboundEmail
+    from data_tables.report_job import ReportJob
+    from data_tables.response import Response
+    from data_tables.survey import Survey
+
+    in_progress = (
+        db.session.query(Response.survey_id, func.count(Response.id))
+        .join(Survey, Response.survey_id == Survey.id)
+        .filter(Survey.is_active.is_(True), Response.is_complete.isnot(True))
+        .group_by(Response.survey_id)
+        .order_by(Response.survey_id)
+        .all()
+    )
+    lines = format_gauge('eacts_responses_in_progress',
+                         'Started but not submitted responses of the active surveys.',
+                         [((('survey_id', str(survey_id)),), count) for survey_id, count in in_progress])
+
+    mail_counts = dict(
+        db.session.query(OutboundEmail.status, func.count(OutboundEmail.id))
+        .filter(OutboundEmail.status.in_(['queued', 'sending', 'failed']))
+        .group_by(OutboundEmail.status)
+        .all()
+    )
+    lines += format_gauge('eacts_mail_queue_depth', 'Emails waiting, being sent or given up on, by status.',
+                          [((('status', status),), mail_counts.get(status, 0))
+                           for status in ['queued', 'sending', 'failed']])
+
+    report_counts = dict(
+        db.session.query(ReportJob.status, func.count(ReportJob.id))
+        .filter(ReportJob.status.in_(['queued', 'running']))
+        .group_by(ReportJob.status)
+        .all()
+    )
+    lines += format_gauge('eacts_report_jobs', 'Reports waiting for or being generated, by status.',
+                          [((('status', status),), report_counts.get(status, 0)) for status in ['queued', 'running']])
+
+    # QueuePool has these, other pools (e.g. for in-memory SQLite) don't
+    pool = db.engine.pool
+    for name, method, help_text in [
+        ('eacts_db_pool_size', 'size', 'Connections the pool keeps open.'),
+        ('eacts_db_pool_checked_out', 'checkedout', 'Connections in use by a request or job.'),
+        ('eacts_db_pool_checked_in', 'checkedin', 'Idle connections in the pool.'),
+        ('eacts_db_pool_overflow', 'overflow', 'Connections opened beyond the pool size.'),
+    ]:
+        if hasattr(pool, method):
+            # overflow counts up from -size while the pool isn't full yet
+            value = max(0, getattr(pool, method)())
+            lines += format_gauge(name, help_text, [((), value)])
+
+    return lines
+
+
+def render_metrics():
+    """The whole /metrics page."""
+    lines = format_counters(metrics.collect()) + collect_gauges()
+    return '\n'.join(lines) + '\n'
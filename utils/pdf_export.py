@@ -0,0 +1,178 @@
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import cm
+from reportlab.lib import colors
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, HRFlowable
+from utils.statistics import get_survey_statistics, get_survey_elaborations, count_responses, no_percentage
+
+"""
+builds the PDF report of a survey's results (questions that did not pass
+first, then the ones that passed, each with its comments).
+"""
+
+
+def write_results_pdf(survey_id, survey_title, output, snapshot=None):
+    """
+    Write the results report of a survey as a PDF.
+
+    Parameters:
+        survey_id: Id of the survey
+        survey_title: Title printed at the top of the report
+        output: File path or binary file object to write the PDF to
+        snapshot: FrozenResults of a closed survey to use instead of the tables
+    """
+    doc = SimpleDocTemplate(
+        output,
+        pagesize=A4,
+        leftMargin=2 * cm,
+        rightMargin=2 * cm,
+        topMargin=2 * cm,
+        bottomMargin=2 * cm,
+    )
+
+    styles = getSampleStyleSheet()
+
+    style_title = ParagraphStyle(
+        'SurveyTitle',
+        parent=styles['Title'],
+        fontSize=20,
+        textColor=colors.HexColor('#1B3A5C'),
+        spaceAfter=6,
+    )
+    style_subtitle = ParagraphStyle(
+        'Subtitle',
+        parent=styles['Normal'],
+        fontSize=11,
+        textColor=colors.HexColor('#555555'),
+        spaceAfter=16,
+    )
+    style_section_fail = ParagraphStyle(
+        'SectionFail',
+        parent=styles['Heading1'],
+        fontSize=14,
+        textColor=colors.HexColor('#C0392B'),
+        spaceBefore=18,
+        spaceAfter=6,
+    )
+    style_section_pass = ParagraphStyle(
+        'SectionPass',
+        parent=styles['Heading1'],
+        fontSize=14,
+        textColor=colors.HexColor('#27AE60'),
+        spaceBefore=18,
+        spaceAfter=6,
+    )
+    style_question = ParagraphStyle(
+        'QuestionText',
+        parent=styles['Normal'],
+        fontSize=11,
+        textColor=colors.HexColor('#2C3E50'),
+        fontName='Helvetica-Bold',
+        spaceBefore=10,
+        spaceAfter=3,
+    )
+    style_stats = ParagraphStyle(
+        'StatsLine',
+        parent=styles['Normal'],
+        fontSize=10,
+        textColor=colors.HexColor('#444444'),
+        spaceAfter=4,
+        leftIndent=12,
+    )
+    style_comment_label = ParagraphStyle(
+        'CommentLabel',
+        parent=styles['Normal'],
+        fontSize=10,
+        fontName='Helvetica-Bold',
+        textColor=colors.HexColor('#555555'),
+        spaceBefore=4,
+        spaceAfter=2,
+        leftIndent=12,
+    )
+    style_comment = ParagraphStyle(
+        'Comment',
+        parent=styles['Normal'],
+        fontSize=10,
+        textColor=colors.HexColor('#333333'),
+        spaceAfter=3,
+        leftIndent=24,
+        bulletIndent=14,
+    )
+
+    # Collect question data
+    if snapshot:
+        all_statistics = snapshot.statistics
+        elaborations = snapshot.elaborations
+        total_responses = snapshot.total_responses
+    else:
+        all_statistics = get_survey_statistics(survey_id)
+        elaborations = get_survey_elaborations(survey_id)
+        total_responses = count_responses(survey_id)
+
+    failed_questions = []
+    passed_questions = []
+
+    for stats in all_statistics:
+        comments = [e['elaboration'].strip() for e in elaborations.get(stats['question_id'], [])]
+        entry = {
+            'number': stats['question_number'],
+            'text': stats['question_text'],
+            'total': stats['total_responses'],
+            'yes_pct': stats['yes_percentage'],
+            'no_pct': no_percentage(stats),
+            'abstain': stats['abstain_count'],
+            'comments': comments,
+        }
+        if stats['meets_threshold']:
+            passed_questions.append(entry)
+        else:
+            failed_questions.append(entry)
+
+    passed_count = len(passed_questions)
+    failed_count = len(failed_questions)
+
+    story = []
+
+    # Title
+    story.append(Paragraph(survey_title, style_title))
+    story.append(Paragraph(
+        f"Total Responses: {total_responses} &nbsp;&nbsp;|&nbsp;&nbsp; "
+        f"Passed: {passed_count} &nbsp;&nbsp;|&nbsp;&nbsp; Did Not Pass: {failed_count}",
+        style_subtitle
+    ))
+    story.append(HRFlowable(width='100%', thickness=1, color=colors.HexColor('#DDDDDD'), spaceAfter=10))
+
+    def add_questions(question_list):
+        for q in question_list:
+            story.append(Paragraph(
+                f"Q{q['number']}. {q['text']}",
+                style_question
+            ))
+            story.append(Paragraph(
+                f"Respondents: {q['total']} &nbsp;&nbsp;|&nbsp;&nbsp; "
+                f"Yes: {q['yes_pct']}% &nbsp;&nbsp;|&nbsp;&nbsp; "
+                f"No: {q['no_pct']}% &nbsp;&nbsp;|&nbsp;&nbsp; "
+                f"Abstained: {q['abstain']}",
+                style_stats
+            ))
+            if q['comments']:
+                story.append(Paragraph('Comments:', style_comment_label))
+                for comment in q['comments']:
+                    # Escape any HTML special characters in comment text
+                    safe_comment = comment.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+                    story.append(Paragraph(f"\u2022 {safe_comment}", style_comment))
+            story.append(Spacer(1, 6))
+
+    # Did Not Pass section
+    if failed_questions:
+        story.append(Paragraph('DID NOT PASS', style_section_fail))
+        story.append(HRFlowable(width='100%', thickness=1, color=colors.HexColor('#E8A0A0'), spaceAfter=6))
+        add_questions(failed_questions)
+
+    # Passed section
+    if passed_questions:
+        story.append(Paragraph('PASSED', style_section_pass))
+        story.append(HRFlowable(width='100%', thickness=1, color=colors.HexColor('#A0D8AF'), spaceAfter=6))
+        add_questions(passed_questions)
+
+    doc.build(story)
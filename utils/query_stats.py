@@ -0,0 +1,253 @@
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request, request_started, request_finished, \
+    before_render_template, template_rendered
+from sqlalchemy import event
+from database import db
+
+"""
+counts and times the SQL statements of every request, to catch N+1 queries
+before production slows down.
+
+switched on with QUERY_STATS=true (Config.QUERY_STATS_ENABLED). the engine's
+cursor events time each statement and add it to the current request, and the
+flask request / template signals time the whole request and its rendering.
+every response then gets a Server-Timing header (shown in the browser's network
+tab) and the numbers are added up per endpoint for /admin/diagnostics.
+
+count_queries and assert_query_budget work without the switch, they are for
+scripts and tests that check how many statements a route runs.
+"""
+
+# longest statement text kept for the diagnostics page
+STATEMENT_MAX_CHARS = 500
+
+
+class RequestStats:
+    """Statements and timings of the request being handled."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+        self.render_started = None
+        self.statements = []  # (seconds, statement)
+
+
+def add_slowest(slowest, statement, seconds, keep):
+    """
+    Keep the `keep` slowest statements in a dict of statement -> seconds
+    (a statement that runs many times is listed once, with its slowest run).
+    """
+    if seconds > slowest.get(statement, -1):
+        slowest[statement] = seconds
+    if len(slowest) > keep * 2:
+        for fastest, _ in sorted(slowest.items(), key=lambda item: item[1])[:len(slowest) - keep]:
+            del slowest[fastest]
+
+
+class QueryStats:
+    """
+    Per-request SQL instrumentation, added up per endpoint.
+
+    Nothing is hooked up unless QUERY_STATS_ENABLED is set, so it costs nothing
+    when it's off.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.slowest_count = 5
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('QUERY_STATS_ENABLED', False)
+        self.slowest_count = app.config.get('QUERY_STATS_SLOWEST', 5)
+        if not self.enabled:
+            return
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+        request_started.connect(self._request_started, app)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        request_finished.connect(self._request_finished, app)
+
+    # ── SQLAlchemy engine events ─────────────────────────────────────────────
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_stats_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['query_stats_started'].pop()
+
+        # report jobs and the mailer run outside of requests
+        if not has_request_context():
+            return
+        stats = g.get('query_stats')
+        if stats is None:
+            return
+
+        stats.queries += 1
+        stats.sql_seconds += seconds
+        stats.statements.append((seconds, statement))
+
+    # ── flask signals ────────────────────────────────────────────────────────
+
+    def _request_started(self, sender, **extra):
+        g.query_stats = RequestStats()
+
+    def _before_render(self, sender, template, context, **extra):
+        stats = g.get('query_stats')
+        if stats is not None:
+            stats.render_started = time.perf_counter()
+
+    def _after_render(self, sender, template, context, **extra):
+        stats = g.get('query_stats')
+        if stats is not None and stats.render_started is not None:
+            stats.render_seconds += time.perf_counter() - stats.render_started
+            stats.render_started = None
+
+    def _request_finished(self, sender, response, **extra):
+        stats = g.get('query_stats')
+        if stats is None:
+            return
+
+        total_seconds = time.perf_counter() - stats.started
+        response.headers['Server-Timing'] = server_timing_header(stats, total_seconds)
+        self.record(request.endpoint or 'unmatched', stats, total_seconds)
+
+    # ── per endpoint totals ──────────────────────────────────────────────────
+
+    def record(self, endpoint, stats, total_seconds):
+        """Add one finished request to the totals of its endpoint."""
+        with self._lock:
+            totals = self._endpoints.get(endpoint)
+            if totals is None:
+                totals = self._endpoints[endpoint] = {
+                    'requests': 0,
+                    'seconds': 0.0,
+                    'max_seconds': 0.0,
+                    'queries': 0,
+                    'max_queries': 0,
+                    'sql_seconds': 0.0,
+                    'render_seconds': 0.0,
+                    'slowest': {},
+                }
+
+            totals['requests'] += 1
+            totals['seconds'] += total_seconds
+            totals['max_seconds'] = max(totals['max_seconds'], total_seconds)
+            totals['queries'] += stats.queries
+            totals['max_queries'] = max(totals['max_queries'], stats.queries)
+            totals['sql_seconds'] += stats.sql_seconds
+            totals['render_seconds'] += stats.render_seconds
+
+            for seconds, statement in stats.statements:
+                add_slowest(totals['slowest'], statement[:STATEMENT_MAX_CHARS], seconds, self.slowest_count)
+
+    def snapshot(self):
+        """
+        Averages of every endpoint seen since the last reset, slowest in total first.
+
+        Returns:
+            List of dicts with endpoint, requests, avg_ms, max_ms, avg_queries,
+            max_queries, avg_sql_ms, avg_render_ms and slowest ((ms, statement) pairs)
+        """
+        with self._lock:
+            endpoints = [(endpoint, dict(totals, slowest=dict(totals['slowest'])))
+                         for endpoint, totals in self._endpoints.items()]
+
+        rows = []
+        for endpoint, totals in sorted(endpoints, key=lambda item: item[1]['seconds'], reverse=True):
+            requests = totals['requests']
+            slowest = sorted(totals['slowest'].items(), key=lambda item: item[1], reverse=True)
+            rows.append({
+                'endpoint': endpoint,
+                'requests': requests,
+                'avg_ms': totals['seconds'] / requests * 1000,
+                'max_ms': totals['max_seconds'] * 1000,
+                'avg_queries': totals['queries'] / requests,
+                'max_queries': totals['max_queries'],
+                'avg_sql_ms': totals['sql_seconds'] / requests * 1000,
+                'avg_render_ms': totals['render_seconds'] / requests * 1000,
+                'slowest': [(seconds * 1000, statement) for statement, seconds in slowest[:self.slowest_count]],
+            })
+        return rows
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+
+def server_timing_header(stats, total_seconds):
+    """Server-Timing value of a request: SQL time (with the statement count), render time and total."""
+    return (f'db;dur={stats.sql_seconds * 1000:.1f};desc="{stats.queries} queries", '
+            f'render;dur={stats.render_seconds * 1000:.1f}, '
+            f'total;dur={total_seconds * 1000:.1f}')
+
+
+# one set of totals per process
+query_stats = QueryStats()
+
+
+@contextmanager
+def count_queries(app):
+    """
+    Collect the SQL statements this thread runs inside the with block.
+
+        with count_queries(app) as statements:
+            client.get('/admin/')
+        print(len(statements))
+
+    Yields:
+        List the statements are appended to
+    """
+    with app.app_context():
+        engine = db.engine
+
+    statements = []
+    thread_id = threading.get_ident()
+
+    def collect(conn, cursor, statement, parameters, context, executemany):
+        # the test client runs the request in this thread, background jobs don't count
+        if threading.get_ident() == thread_id:
+            statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', collect)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', collect)
+
+
+def assert_query_budget(client, url, max_queries, method='GET', **kwargs):
+    """
+    Request a route with a test client and fail if it runs more than max_queries
+    SQL statements.
+
+    Parameters:
+        client: Flask test client (logged in already for admin routes)
+        url: URL to request
+        max_queries: Most statements the route may run
+        method: HTTP method, kwargs are passed on to client.open (data=, json=, ...)
+
+    Returns:
+        The response, for further checks
+
+    Raises:
+        AssertionError listing the statements when the budget is exceeded
+    """
+    with count_queries(client.application) as statements:
+        response = client.open(url, method=method, **kwargs)
+
+    if len(statements) > max_queries:
+        listing = '\n'.join(f'  {n}. {statement}' for n, statement in enumerate(statements, start=1))
+        raise AssertionError(f'{method} {url} ran {len(statements)} queries, '
+                             f'the budget is {max_queries}:\n{listing}')
+    return response
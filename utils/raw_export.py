@@ -0,0 +1,205 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+from database import db
+from data_tables.answer import Answer
+from data_tables.response import Response
+from utils.statistics import get_survey_statistics
+
+"""
+raw answers of a survey as Parquet files, for loading into analysis tools.
+
+two layouts:
+- long: one row per (response, question) with the choice, elaboration,
+  participant, timestamps and where the question is in the survey
+- wide: one row per respondent with a choice and a comment column per question
+
+the answers are read with a streaming cursor (yield_per) and written one row
+group of RAW_EXPORT_BATCH_SIZE rows at a time, so memory stays the same
+whatever the number of respondents. closed surveys are streamed the same way,
+only their questions come from the results snapshot (utils/results_snapshot.py).
+"""
+
+# rows per Parquet row group, and fetched from the database at a time
+RAW_EXPORT_BATCH_SIZE = 10000
+
+LONG_SCHEMA = pa.schema([
+    ('response_id', pa.int64()),
+    ('participant_name', pa.string()),
+    ('is_complete', pa.bool_()),
+    ('submitted_at', pa.timestamp('us')),
+    ('section_number', pa.int32()),
+    ('section_title', pa.string()),
+    ('question_id', pa.int64()),
+    ('question_number', pa.int32()),
+    ('question_text', pa.string()),
+    ('choice', pa.string()),
+    ('elaboration', pa.string()),
+])
+
+RESPONDENT_COLUMNS = [
+    ('response_id', pa.int64()),
+    ('participant_name', pa.string()),
+    ('is_complete', pa.bool_()),
+    ('submitted_at', pa.timestamp('us')),
+]
+
+
+def get_questions(survey_id, snapshot=None):
+    """
+    The questions of a survey in order.
+
+    Returns:
+        Dict of question_id -> (section_number, section_title, question_number, question_text)
+    """
+    statistics = snapshot.statistics if snapshot else get_survey_statistics(survey_id)
+    return {stats['question_id']: (stats['section_number'], stats['section_title'],
+                                   stats['question_number'], stats['question_text'])
+            for stats in statistics}
+
+
+def iter_answer_rows(survey_id, include_unanswered=False):
+    """
+    Stream the answers of a survey ordered by response, then question id.
+
+    Parameters:
+        include_unanswered: Also yield a row (question_id None) for responses
+                            without any answer
+
+    Yields:
+        (response_id, participant_name, is_complete, submitted_at, question_id, choice, elaboration)
+    """
+    query = db.session.query(Response.id, Response.participant_name, Response.is_complete, Response.submitted_at,
+                             Answer.question_id, Answer.choice, Answer.elaboration)
+    if include_unanswered:
+        query = query.outerjoin(Answer, Answer.response_id == Response.id)
+    else:
+        query = query.join(Answer, Answer.response_id == Response.id)
+
+    rows = (
+        query.filter(Response.survey_id == survey_id)
+        .order_by(Response.id, Answer.question_id)
+        .yield_per(RAW_EXPORT_BATCH_SIZE)
+    )
+    for row in rows:
+        yield tuple(row)
+
+
+def write_in_batches(file_path, schema, rows, batch_size=RAW_EXPORT_BATCH_SIZE):
+    """
+    Write rows (tuples in schema order) to a Parquet file, one row group per batch.
+
+    Returns:
+        Number of rows written
+    """
+    total = 0
+    with pq.ParquetWriter(file_path, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                writer.write_batch(rows_to_batch(schema, batch))
+                total += len(batch)
+                batch = []
+
+        if batch:
+            writer.write_batch(rows_to_batch(schema, batch))
+            total += len(batch)
+
+    return total
+
+
+def rows_to_batch(schema, rows):
+    """Arrow record batch from a list of row tuples."""
+    columns = list(zip(*rows))
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+        schema=schema
+    )
+
+
+def write_long_parquet(survey_id, file_path, snapshot=None):
+    """
+    Write the raw answers of a survey, one row per (response, question).
+
+    Parameters:
+        survey_id: Id of the survey
+        file_path: Where to save the .parquet file
+        snapshot: FrozenResults of a closed survey to take the questions from
+    """
+    questions = get_questions(survey_id, snapshot)
+
+    def rows():
+        for response_id, name, is_complete, submitted_at, question_id, choice, elaboration in \
+                iter_answer_rows(survey_id):
+            # answers to questions deleted from the survey have no place in it any more
+            question = questions.get(question_id)
+            if question is None:
+                continue
+            section_number, section_title, question_number, question_text = question
+            yield (response_id, name, bool(is_complete), submitted_at, section_number, section_title,
+                   question_id, question_number, question_text, choice, elaboration)
+
+    return write_in_batches(file_path, LONG_SCHEMA, rows())
+
+
+def respondent_schema(questions):
+    """
+    Schema of the wide layout: the respondent columns, then s<section>_q<question>
+    and s<section>_q<question>_comment for every question.
+
+    Returns:
+        (schema, dict of question_id -> index of its choice column)
+    """
+    fields = list(RESPONDENT_COLUMNS)
+    column_of_question = {}
+    names = set()
+
+    for question_id, (section_number, _, question_number, _) in questions.items():
+        name = f's{section_number}_q{question_number}'
+        if name in names:
+            # two questions with the same number, keep both
+            name = f'{name}_{question_id}'
+        names.add(name)
+
+        column_of_question[question_id] = len(fields)
+        fields.append((name, pa.string()))
+        fields.append((f'{name}_comment', pa.string()))
+
+    return pa.schema(fields), column_of_question
+
+
+def write_wide_parquet(survey_id, file_path, snapshot=None):
+    """
+    Write the raw answers of a survey, one row per respondent.
+
+    Parameters:
+        survey_id: Id of the survey
+        file_path: Where to save the .parquet file
+        snapshot: FrozenResults of a closed survey to take the questions from
+    """
+    questions = get_questions(survey_id, snapshot)
+    schema, column_of_question = respondent_schema(questions)
+    width = len(schema)
+
+    def rows():
+        current_id = None
+        current_row = None
+
+        for response_id, name, is_complete, submitted_at, question_id, choice, elaboration in \
+                iter_answer_rows(survey_id, include_unanswered=True):
+            if response_id != current_id:
+                if current_row is not None:
+                    yield tuple(current_row)
+                current_id = response_id
+                current_row = [response_id, name, bool(is_complete), submitted_at] + [None] * (width - 4)
+
+            column = column_of_question.get(question_id)
+            if column is not None:
+                current_row[column] = choice
+                current_row[column + 1] = elaboration
+
+        if current_row is not None:
+            yield tuple(current_row)
+
+    # a respondent row has a value per column, keep a batch to about as many values as a long one
+    return write_in_batches(file_path, schema, rows(), batch_size=max(100, RAW_EXPORT_BATCH_SIZE * len(LONG_SCHEMA) // width))
@@ -0,0 +1,409 @@
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, case, delete, func, or_, update
+from database import db
+from data_tables.answer import Answer
+from data_tables.report_job import ReportJob
+from data_tables.response import Response
+from data_tables.response_revision import ResponseRevision
+from data_tables.survey import Survey
+from utils.excel_export import write_results_workbook
+from utils.pdf_export import write_results_pdf
+from utils.raw_export import write_long_parquet, write_wide_parquet
+from utils.survey_cache import get_survey_version
+from utils.metrics import metrics
+
+"""
+generates PDF and Excel reports in background threads instead of inside the
+request.
+
+every report is a row in the report_jobs table. a worker thread writes the file
+under REPORT_FOLDER and marks the job done, and later downloads are served from
+that file until the survey's answers change (see get_data_version).
+
+the files are content addressed: their name is a hash of survey id, format and
+data version, which is also the ETag browsers revalidate with. the folder is
+kept under REPORT_CACHE_MAX_BYTES by removing the least recently used files.
+"""
+
+# what each report format is called, how its file is named and written
+# (downloads are called <title>_<file_suffix>.<extension>, Results by default)
+REPORT_FORMATS = {
+    'pdf': {
+        'label': 'PDF',
+        'extension': 'pdf',
+        'mimetype': 'application/pdf',
+    },
+    'xlsx': {
+        'label': 'Excel',
+        'extension': 'xlsx',
+        'mimetype': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    },
+    'xlsx_raw': {
+        'label': 'Excel with Raw Answers',
+        'extension': 'xlsx',
+        'mimetype': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    },
+    'parquet': {
+        'label': 'Raw Data (Parquet)',
+        'extension': 'parquet',
+        'mimetype': 'application/vnd.apache.parquet',
+        'file_suffix': 'Raw_Answers',
+    },
+    'parquet_wide': {
+        'label': 'Raw Data per Respondent (Parquet)',
+        'extension': 'parquet',
+        'mimetype': 'application/vnd.apache.parquet',
+        'file_suffix': 'Respondents',
+    },
+}
+
+# jobs in these states still count as the report for their data version
+ACTIVE_STATUSES = ['queued', 'running', 'done']
+
+
+def get_data_version(survey_id):
+    """
+    A string that changes whenever the answers or structure of a survey change.
+
+    Made from the survey's structure version, the number of responses (and how
+    many are complete), the number of answers, the highest answer id and the
+    sum of the response revisions. Answers are updated in place, so an edited
+    choice or comment only shows in the revisions.
+    """
+    answer_count, max_answer_id = (
+        db.session.query(func.count(Answer.id), func.max(Answer.id))
+        .join(Response, Answer.response_id == Response.id)
+        .filter(Response.survey_id == survey_id)
+        .one()
+    )
+    response_count, complete_count = (
+        db.session.query(func.count(Response.id), func.sum(case((Response.is_complete, 1), else_=0)))
+        .filter(Response.survey_id == survey_id)
+        .one()
+    )
+    revisions = (
+        db.session.query(func.sum(ResponseRevision.revision))
+        .join(Response, ResponseRevision.response_id == Response.id)
+        .filter(Response.survey_id == survey_id)
+        .scalar()
+    )
+    structure_version = get_survey_version(survey_id)
+
+    return (f'{structure_version}-{response_count}-{complete_count or 0}-'
+            f'{answer_count}-{max_answer_id or 0}-{revisions or 0}')
+
+
+def report_cache_key(survey_id, report_format, data_version):
+    """Hash that names a report file and is used as its ETag."""
+    key = f'{survey_id}:{report_format}:{data_version}'
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+
+def report_etag(job):
+    """ETag of the file of a finished report job."""
+    return report_cache_key(job.survey_id, job.report_format, job.data_version)
+
+
+def touch_report(job):
+    """Mark a report file as just used, so size-based eviction keeps it longest."""
+    if job.file_path and os.path.exists(job.file_path):
+        os.utime(job.file_path)
+
+
+def write_report(report_format, survey_id, file_path):
+    """Write one report of a survey to a file (from its frozen results if it is closed)."""
+    from utils.results_snapshot import get_results_snapshot
+
+    survey = db.session.get(Survey, survey_id)
+    snapshot = get_results_snapshot(survey_id, survey.is_active)
+
+    if report_format == 'pdf':
+        write_results_pdf(survey_id, survey.title, file_path, snapshot=snapshot)
+    elif report_format == 'xlsx':
+        write_results_workbook(survey_id, file_path, snapshot=snapshot)
+    elif report_format == 'xlsx_raw':
+        write_results_workbook(survey_id, file_path, include_raw_answers=True, snapshot=snapshot)
+    elif report_format == 'parquet':
+        write_long_parquet(survey_id, file_path, snapshot=snapshot)
+    elif report_format == 'parquet_wide':
+        write_wide_parquet(survey_id, file_path, snapshot=snapshot)
+    else:
+        raise ValueError(f'Unknown report format: {report_format}')
+
+
+def run_report_job(job_id):
+    """
+    Generate the file of a queued job. Runs in a worker thread inside an app context.
+    """
+    # only one worker runs a job, even when two processes have it queued
+    claimed = db.session.execute(
+        update(ReportJob)
+        .where(ReportJob.id == job_id, ReportJob.status == 'queued')
+        .values(status='running', claimed_at=datetime.utcnow())
+    )
+    db.session.commit()
+    if claimed.rowcount != 1:
+        return
+
+    job = db.session.get(ReportJob, job_id)
+    started = time.perf_counter()
+
+    try:
+        report_folder = current_app.config['REPORT_FOLDER']
+        if not os.path.exists(report_folder):
+            os.makedirs(report_folder)
+
+        extension = REPORT_FORMATS[job.report_format]['extension']
+        file_name = f'{report_etag(job)}.{extension}'
+        file_path = os.path.abspath(os.path.join(report_folder, file_name))
+
+        write_report(job.report_format, job.survey_id, file_path)
+
+        job.status = 'done'
+        job.file_path = file_path
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+    except Exception as error:
+        db.session.rollback()
+        job = db.session.get(ReportJob, job_id)
+        if job is not None:
+            job.status = 'failed'
+            job.error = str(error)
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+            metrics.observe('eacts_report_duration_seconds', (('format', job.report_format), ('status', 'failed')),
+                            time.perf_counter() - started)
+        print(f"Report job {job_id} failed: {error}")
+        return
+
+    metrics.observe('eacts_report_duration_seconds', (('format', job.report_format), ('status', 'done')),
+                    time.perf_counter() - started)
+
+    # tidying up the older files isn't part of the job, it stays done if this fails
+    try:
+        remove_older_reports(job)
+        enforce_report_cache_size(current_app.config.get('REPORT_CACHE_MAX_BYTES'), keep_job_id=job.id)
+    except Exception as error:
+        db.session.rollback()
+        print(f"Removing old reports after job {job_id} failed: {error}")
+
+
+def stale_jobs_filter(stale_seconds):
+    """
+    Filter of the queued or running jobs that no worker took up for stale_seconds.
+    Their process stopped (or was restarted) before it finished them.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_seconds)
+    return and_(ReportJob.status.in_(['queued', 'running']),
+                or_(ReportJob.claimed_at.is_(None), ReportJob.claimed_at < cutoff))
+
+
+def reclaim_job(job_id, stale_seconds):
+    """Queue a stale job again for this process. False if it isn't stale or another process got to it first."""
+    result = db.session.execute(
+        update(ReportJob)
+        .where(ReportJob.id == job_id, stale_jobs_filter(stale_seconds))
+        .values(status='queued', claimed_at=datetime.utcnow()),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def remove_file(file_path):
+    """Delete a file, if it is still there (another worker may have removed it already)."""
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def delete_jobs(job_ids):
+    """Delete report jobs by id. Rows another worker deleted already are skipped."""
+    if job_ids:
+        db.session.execute(delete(ReportJob).where(ReportJob.id.in_(job_ids)),
+                           execution_options={'synchronize_session': False})
+
+
+def remove_older_reports(job):
+    """Delete the earlier finished or failed reports of the same survey and format."""
+    older_jobs = db.session.query(ReportJob.id, ReportJob.file_path).filter(
+        ReportJob.survey_id == job.survey_id,
+        ReportJob.report_format == job.report_format,
+        ReportJob.id < job.id,
+        ReportJob.status.in_(['done', 'failed'])
+    ).all()
+
+    for older_job_id, file_path in older_jobs:
+        # a different version of the data has a different file, never this job's one
+        if file_path and file_path != job.file_path:
+            remove_file(file_path)
+
+    delete_jobs([older_job_id for older_job_id, file_path in older_jobs])
+    db.session.commit()
+
+
+def enforce_report_cache_size(max_bytes, keep_job_id=None):
+    """
+    Remove the least recently used report files until the finished reports take
+    up no more than max_bytes on disk. Their jobs are deleted too, so the next
+    export makes the report again.
+
+    Parameters:
+        max_bytes: Size limit of all report files together (no limit if None)
+        keep_job_id: Job that must not be evicted (the one that just finished)
+    """
+    if not max_bytes:
+        return
+
+    files = []
+    total_size = 0
+    for job_id, file_path in db.session.query(ReportJob.id, ReportJob.file_path).filter_by(status='done').all():
+        if not file_path:
+            continue
+        try:
+            file_stats = os.stat(file_path)
+        except FileNotFoundError:
+            continue
+        files.append((file_stats.st_mtime, file_stats.st_size, job_id, file_path))
+        total_size += file_stats.st_size
+
+    # oldest last-used first
+    files.sort(key=lambda item: item[0])
+
+    evicted = []
+    for last_used, size, job_id, file_path in files:
+        if total_size <= max_bytes:
+            break
+        if job_id == keep_job_id:
+            continue
+        remove_file(file_path)
+        evicted.append(job_id)
+        total_size -= size
+
+    delete_jobs(evicted)
+    db.session.commit()
+
+
+def remove_report_files(file_paths):
+    """Delete report files from disk (after their survey was deleted)."""
+    for file_path in file_paths:
+        if file_path:
+            remove_file(file_path)
+
+
+class ReportQueue:
+    """
+    Thread pool that runs report jobs in the background.
+
+    Each job runs in its own app context, so it gets its own database session.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.executor = None
+        self.stale_seconds = 30 * 60
+
+    def init_app(self, app):
+        self.app = app
+        self.stale_seconds = app.config.get('REPORT_STALE_SECONDS', self.stale_seconds)
+        self.executor = ThreadPoolExecutor(max_workers=app.config.get('REPORT_WORKERS', 2),
+                                           thread_name_prefix='report-job')
+
+    def submit(self, job_id):
+        """Run a job in the background. Returns the Future of the run."""
+        return self.executor.submit(self._run, job_id)
+
+    def submit_task(self, function, *args):
+        """
+        Run another slow piece of work (e.g. a results snapshot) on the same
+        workers, in its own app context. Returns the Future of the run.
+        """
+        return self.executor.submit(self._run_task, function, args)
+
+    def resume_unfinished(self):
+        """
+        Queue again the jobs whose process stopped before finishing them. Jobs
+        that another running process has queued or is working on are left to it.
+        """
+        stale = db.session.query(ReportJob.id).filter(stale_jobs_filter(self.stale_seconds)).all()
+        for job_id, in stale:
+            if reclaim_job(job_id, self.stale_seconds):
+                self.submit(job_id)
+
+    def resume_if_stale(self, job):
+        """Run an unfinished job here if its process is gone. Returns True if it was queued again."""
+        if job.status not in ('queued', 'running') or not reclaim_job(job.id, self.stale_seconds):
+            return False
+        self.submit(job.id)
+        return True
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            run_report_job(job_id)
+
+    def _run_task(self, function, args):
+        with self.app.app_context():
+            return function(*args)
+
+
+# one queue per process
+report_queue = ReportQueue()
+
+
+def request_report(survey_id, report_format):
+    """
+    Get the report of a survey for its current data, starting a job if there isn't one.
+
+    Returns:
+        The ReportJob (status 'done' if the file can be downloaded straight away)
+    """
+    from utils.results_snapshot import get_snapshot_data_version
+
+    # a closed survey's snapshot has the version its data was frozen at
+    data_version = get_snapshot_data_version(survey_id) or get_data_version(survey_id)
+
+    job = (
+        ReportJob.query
+        .filter_by(survey_id=survey_id, report_format=report_format, data_version=data_version)
+        .filter(ReportJob.status.in_(ACTIVE_STATUSES))
+        .order_by(ReportJob.id.desc())
+        .first()
+    )
+
+    # a finished job whose file was removed from disk has to be made again
+    if job is not None and (job.status != 'done' or os.path.exists(job.file_path)):
+        # one left behind by a process that stopped is started again here
+        if report_queue.resume_if_stale(job):
+            db.session.refresh(job)
+        return job
+
+    job = ReportJob(survey_id=survey_id, report_format=report_format, data_version=data_version)
+    db.session.add(job)
+    db.session.commit()
+
+    report_queue.submit(job.id)
+    return job
+
+
+def get_latest_reports(survey_ids):
+    """
+    Latest report job of every format for each survey, for the dashboard.
+
+    Returns:
+        Dict of survey_id -> {report_format: ReportJob}
+    """
+    if not survey_ids:
+        return {}
+
+    latest = {}
+    jobs = ReportJob.query.filter(ReportJob.survey_id.in_(survey_ids)).order_by(ReportJob.id).all()
+    for job in jobs:
+        latest.setdefault(job.survey_id, {})[job.report_format] = job
+    return latest
@@ -0,0 +1,123 @@
+import math
+from database import db
+from data_tables.answer import Answer
+from data_tables.response import Response
+from utils.survey_cache import survey_cache
+
+"""
+builds the individual responses of a survey as a respondent x question matrix.
+
+the answers of all the respondents on a page are fetched with one query ordered
+by response and put into a dict, so filling in every question of every
+respondent is a dict lookup instead of a scan through their answers.
+"""
+
+RESPONSES_PER_PAGE = 25
+
+# ?status= values of the responses page
+STATUS_FILTERS = ['all', 'complete', 'incomplete']
+
+
+def filter_responses(survey_id, status='all', name=None):
+    """Query of the responses of a survey with the status / name filters applied."""
+    query = Response.query.filter(Response.survey_id == survey_id)
+
+    if status == 'complete':
+        query = query.filter(Response.is_complete.is_(True))
+    elif status == 'incomplete':
+        query = query.filter(Response.is_complete.isnot(True))
+
+    if name:
+        query = query.filter(Response.participant_name.ilike(f'%{name}%'))
+
+    return query
+
+
+def answer_matrix_query(response_ids):
+    """Query of (response_id, question_id, choice, elaboration) of several responses, ordered by response."""
+    return (
+        db.session.query(Answer.response_id, Answer.question_id, Answer.choice, Answer.elaboration)
+        .filter(Answer.response_id.in_(response_ids))
+        .order_by(Answer.response_id, Answer.question_id)
+    )
+
+
+def get_answer_matrix(response_ids):
+    """
+    Fetch the answers of several responses in one ordered query.
+
+    Returns:
+        Dict of (response_id, question_id) -> (choice, elaboration)
+    """
+    if not response_ids:
+        return {}
+
+    return {(response_id, question_id): (choice, elaboration)
+            for response_id, question_id, choice, elaboration in answer_matrix_query(response_ids)}
+
+
+def get_response_page(survey_id, page=1, per_page=RESPONSES_PER_PAGE, status='all', name=None):
+    """
+    Get one page of a survey's individual responses with all their answers.
+
+    Parameters:
+        survey_id: Id of the survey
+        page: Page number, starting at 1
+        per_page: Responses per page
+        status: 'all', 'complete' or 'incomplete'
+        name: Only responses whose participant name contains this text
+
+    Returns:
+        Dict with 'responses' (same shape the template always used),
+        'page', 'pages' and 'total'
+    """
+    query = filter_responses(survey_id, status, name)
+
+    total = query.count()
+    pages = max(1, math.ceil(total / per_page))
+    page = min(max(1, page), pages)
+
+    responses = (
+        query.with_entities(Response.id, Response.participant_name, Response.submitted_at, Response.is_complete)
+        .order_by(Response.submitted_at.desc(), Response.id.desc())
+        .offset((page - 1) * per_page)
+        .limit(per_page)
+        .all()
+    )
+
+    structure = survey_cache.get(survey_id)
+    sections = structure.sections if structure else ()
+    answers = get_answer_matrix([resp.id for resp in responses])
+
+    individual_responses = []
+    for resp in responses:
+        resp_sections = []
+        for section in sections:
+            section_answers = []
+            for question in section.questions:
+                answer = answers.get((resp.id, question.id))
+                section_answers.append({
+                    'question_number': question.question_number,
+                    'question_text':   question.question_text,
+                    'choice':          answer[0] if answer else '—',
+                    'elaboration':     answer[1] if answer else ''
+                })
+            resp_sections.append({
+                'section_title': section.title,
+                'answers': section_answers
+            })
+
+        individual_responses.append({
+            'id':           resp.id,
+            'name':         resp.participant_name or 'Anonymous',
+            'submitted_at': resp.submitted_at,
+            'is_complete':  resp.is_complete,
+            'sections':     resp_sections
+        })
+
+    return {
+        'responses': individual_responses,
+        'page': page,
+        'pages': pages,
+        'total': total
+    }
@@ -0,0 +1,289 @@
+import json
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from database import db
+from database.upsert import upsert
+from data_tables.results_snapshot import ResultsSnapshot
+from data_tables.survey import Survey
+from utils.reports import get_data_version, report_queue
+from utils.statistics import get_survey_statistics, get_survey_elaborations, count_responses
+
+"""
+frozen results of closed surveys.
+
+when a survey is deactivated its answers stop changing, so the statistics and
+comments are worked out once and stored in the results_snapshots table as
+compressed JSON. the results page and the PDF / Excel reports of an inactive
+survey then take them from the snapshot instead of the tally and answer
+tables. the answers themselves are not copied: they are just as frozen in the
+answers table, and the responses page and the raw exports keep reading them
+from there a page or a streamed batch at a time.
+
+the snapshot is built in the background on the report workers (see
+utils/reports.py), so closing a survey doesn't wait for it. until it's there
+everything reads the live tables as for an active survey. it is thrown away
+when the survey is reopened and whenever its data changes anyway (a response
+deleted, the survey edited, an admin previewing it), and the next read of a
+closed survey without a snapshot queues a new one, so surveys closed before
+this existed get theirs the first time they're opened.
+
+decoded snapshots are also kept in memory per process, up to
+SNAPSHOT_CACHE_MAX_BYTES, and reused while the data version in the table stays
+the same.
+"""
+
+# size of the snapshots kept decoded in memory per process, counted as the
+# length of their JSON (the decoded dicts take about six times that)
+SNAPSHOT_CACHE_MAX_BYTES = 8 * 1024 * 1024
+
+
+def format_datetime(value):
+    return value.isoformat() if value else None
+
+
+def parse_datetime(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+class FrozenResults:
+    """Decoded snapshot of a closed survey."""
+
+    def __init__(self, data_version, payload, size):
+        self.data_version = data_version
+
+        # length of the snapshot's JSON, what the cache counts
+        self.size = size
+
+        # same dicts as get_survey_statistics / get_survey_elaborations / count_responses
+        self.statistics = payload['statistics']
+        self.total_responses = payload['total_responses']
+        self.elaborations = {
+            question_id: [{'choice': choice, 'elaboration': elaboration, 'submitted_at': parse_datetime(submitted_at)}
+                          for choice, elaboration, submitted_at in items]
+            for question_id, items in payload['elaborations']
+        }
+
+
+def build_snapshot_payload(survey_id):
+    """The statistics and comments of a survey, as JSON-friendly lists."""
+    elaborations = get_survey_elaborations(survey_id)
+
+    return {
+        'statistics': get_survey_statistics(survey_id),
+        'total_responses': count_responses(survey_id),
+        'elaborations': [
+            [question_id, [[item['choice'], item['elaboration'], format_datetime(item['submitted_at'])] for item in items]]
+            for question_id, items in elaborations.items()
+        ],
+    }
+
+
+def encode_payload(payload):
+    """Returns (compressed blob, length of the JSON)."""
+    data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return zlib.compress(data), len(data)
+
+
+def decode_payload(blob):
+    """Returns (payload, length of the JSON)."""
+    data = zlib.decompress(blob)
+    return json.loads(data.decode('utf-8')), len(data)
+
+
+class SnapshotCache:
+    """LRU of decoded snapshots keyed by survey id, bounded by their total size."""
+
+    def __init__(self, max_bytes=SNAPSHOT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._snapshots = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, survey_id, data_version):
+        with self._lock:
+            snapshot = self._snapshots.get(survey_id)
+            if snapshot is None or snapshot.data_version != data_version:
+                return None
+            self._snapshots.move_to_end(survey_id)
+            return snapshot
+
+    def put(self, survey_id, snapshot):
+        with self._lock:
+            self._remove(survey_id)
+            # one that doesn't fit on its own is decoded again on every read
+            if snapshot.size > self.max_bytes:
+                return
+
+            self._snapshots[survey_id] = snapshot
+            self._bytes += snapshot.size
+            while self._bytes > self.max_bytes:
+                _, oldest = self._snapshots.popitem(last=False)
+                self._bytes -= oldest.size
+
+    def invalidate(self, survey_id=None):
+        with self._lock:
+            if survey_id is None:
+                self._snapshots.clear()
+                self._bytes = 0
+            else:
+                self._remove(survey_id)
+
+    def _remove(self, survey_id):
+        snapshot = self._snapshots.pop(survey_id, None)
+        if snapshot is not None:
+            self._bytes -= snapshot.size
+
+
+# one cache per process
+snapshot_cache = SnapshotCache()
+
+
+def build_results_snapshot(survey_id):
+    """
+    Work out the results of a closed survey and store them as its snapshot.
+    Commits. Runs on a report worker (see SnapshotBuilder).
+
+    Returns:
+        The FrozenResults, or None if the survey was reopened, deleted or its
+        data changed while it was being built
+    """
+    survey = db.session.get(Survey, survey_id)
+    if survey is None or survey.is_active:
+        return None
+
+    data_version = get_data_version(survey_id)
+    payload = build_snapshot_payload(survey_id)
+    blob, size = encode_payload(payload)
+
+    # end the reading transaction, the write below (and the check after it)
+    # has to see what other requests committed meanwhile
+    db.session.commit()
+
+    upsert(ResultsSnapshot, [{
+        'survey_id': survey_id,
+        'data_version': data_version,
+        'payload': blob,
+        'created_at': datetime.utcnow(),
+    }], ['survey_id'], update_columns=['data_version', 'payload', 'created_at'])
+
+    # the request that reopened the survey (or changed its data) meanwhile has
+    # already discarded the snapshot, don't put an outdated one back
+    row = db.session.query(Survey.is_active).filter(Survey.id == survey_id).first()
+    if row is None or row.is_active or get_data_version(survey_id) != data_version:
+        db.session.rollback()
+        return None
+    db.session.commit()
+
+    snapshot = FrozenResults(data_version, payload, size)
+    snapshot_cache.put(survey_id, snapshot)
+    return snapshot
+
+
+class SnapshotBuilder:
+    """Queues snapshot builds on the report workers, at most one at a time per survey."""
+
+    def __init__(self):
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def queue(self, survey_id):
+        """
+        Build the snapshot of a closed survey in the background.
+
+        Returns:
+            The Future of the build, or None if one is already queued
+        """
+        with self._lock:
+            if survey_id in self._pending:
+                return None
+            self._pending.add(survey_id)
+
+        try:
+            return report_queue.submit_task(self._build, survey_id)
+        except Exception:
+            with self._lock:
+                self._pending.discard(survey_id)
+            raise
+
+    def _build(self, survey_id):
+        try:
+            return build_results_snapshot(survey_id)
+        except Exception as error:
+            db.session.rollback()
+            print(f"Results snapshot of survey {survey_id} failed: {error}")
+            return None
+        finally:
+            with self._lock:
+                self._pending.discard(survey_id)
+
+
+# one builder per process
+snapshot_builder = SnapshotBuilder()
+
+
+def discard_results_snapshot(survey_id=None):
+    """
+    Throw away the snapshot of a survey (of every survey if None) because its
+    data changed. Caller is responsible for committing.
+    """
+    statement = ResultsSnapshot.__table__.delete()
+    if survey_id is not None:
+        statement = statement.where(ResultsSnapshot.survey_id == survey_id)
+    db.session.execute(statement)
+    snapshot_cache.invalidate(survey_id)
+
+
+def get_snapshot_data_version(survey_id):
+    """Data version of the survey's snapshot, or None if it has none (e.g. it is active)."""
+    return (
+        db.session.query(ResultsSnapshot.data_version)
+        .filter(ResultsSnapshot.survey_id == survey_id)
+        .scalar()
+    )
+
+
+def get_results_snapshot(survey_id, is_active=None):
+    """
+    Frozen results of a closed survey. If it has none yet, one is queued and
+    None is returned, so the caller reads the live tables this time.
+
+    Parameters:
+        survey_id: Id of the survey
+        is_active: Whether the survey is active, if the caller knows (looked up otherwise)
+
+    Returns:
+        FrozenResults, or None for an active survey or one whose snapshot isn't ready
+    """
+    if is_active is None:
+        row = db.session.query(Survey.is_active).filter(Survey.id == survey_id).first()
+        if row is None:
+            return None
+        is_active = row.is_active
+    if is_active:
+        return None
+
+    data_version = get_snapshot_data_version(survey_id)
+    if data_version is None:
+        snapshot_builder.queue(survey_id)
+        return None
+
+    snapshot = snapshot_cache.get(survey_id, data_version)
+    if snapshot is not None:
+        return snapshot
+
+    row = (
+        db.session.query(ResultsSnapshot.data_version, ResultsSnapshot.payload)
+        .filter(ResultsSnapshot.survey_id == survey_id)
+        .one_or_none()
+    )
+    if row is None:
+        # discarded by another request since the version was read
+        snapshot_builder.queue(survey_id)
+        return None
+
+    payload, size = decode_payload(row.payload)
+    snapshot = FrozenResults(row.data_version, payload, size)
+    snapshot_cache.put(survey_id, snapshot)
+    return snapshot
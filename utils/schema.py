@@ -0,0 +1,193 @@
+import re
+from datetime import datetime
+from sqlalchemy import delete, func, inspect, select
+from sqlalchemy.orm import Query
+from sqlalchemy.exc import OperationalError, IntegrityError
+from database import db
+from data_tables.answer import Answer
+
+"""
+makes sure the columns and indexes declared on the models exist and that the
+queries the app runs most often actually use them.
+
+db.create_all() only creates columns and indexes together with a brand new
+table, so a database made before one was added to a model gets it from
+create_missing_columns() / create_missing_indexes() instead.
+"""
+
+def hot_queries():
+    """
+    The queries run on every page view / save, built by the same functions the
+    app runs them with, so the check follows any change to them. Each one is
+    checked with EXPLAIN QUERY PLAN by check_query_plans(). The ids are
+    samples, the plan doesn't depend on the values.
+
+    Returns:
+        Dict of name -> ORM Query or SQLAlchemy statement
+    """
+    from routes.take_survey import resume_response_query
+    from utils.answers import lock_response_statement, saved_answers_query, delete_answers_statement
+    from utils.dashboard import dated_page_query, undated_page_query, response_counts_query
+    from utils.invitations import invitation_query
+    from utils.response_pivot import answer_matrix_query
+    from utils.statistics import survey_statistics_query, survey_elaborations_query, response_count_query
+    from utils.survey_cache import survey_structure_query, survey_version_query
+    from utils.tallies import tally_update_statement, response_answers_query
+
+    return {
+        'resume link lookup': resume_response_query('token', survey_id=1),
+        'invitation link lookup': invitation_query('token', 1),
+        'resume session lookup': resume_response_query('token'),
+        'survey structure': survey_structure_query(1),
+        'survey version': survey_version_query(1),
+        'lock a response': lock_response_statement(1),
+        'old answers of a section': saved_answers_query(1, [1, 2]),
+        'delete cleared answers': delete_answers_statement(1, [1, 2]),
+        'tally update': tally_update_statement(),
+        'answers of a response': response_answers_query(1),
+        'survey statistics from tallies': survey_statistics_query(1),
+        'elaborations of a survey': survey_elaborations_query(1),
+        'response count of a survey': response_count_query(1),
+        'answers of a page of responses': answer_matrix_query([1, 2]),
+        'dashboard page': dated_page_query((datetime(2000, 1, 1), 1)),
+        'dashboard page without dates': undated_page_query(1),
+        'dashboard response counts': response_counts_query([1, 2]),
+    }
+
+
+# "SCAN answers" is a full table scan, "SEARCH answers USING INDEX ..." is a lookup
+FULL_SCAN_PATTERN = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+
+
+def create_missing_columns():
+    """
+    Add the columns declared on the models that the database's tables don't
+    have yet. Only nullable columns can be added this way, existing rows get NULL.
+
+    Returns:
+        List of "table.column" names that were added
+    """
+    added = []
+    engine = db.engine
+    inspector = inspect(engine)
+
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+
+            column_type = column.type.compile(dialect=engine.dialect)
+            with engine.begin() as connection:
+                connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}')
+            added.append(f'{table.name}.{column.name}')
+
+    return added
+
+
+def create_missing_indexes():
+    """
+    Create every index declared on the models that the database doesn't have yet.
+
+    Returns:
+        List of index names that could not be created (for example a unique
+        index over rows that already contain duplicates)
+    """
+    failed = []
+    engine = db.engine
+
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except (OperationalError, IntegrityError) as error:
+                print(f"Could not create index {index.name}: {error}")
+                if index.name == 'uq_answers_response_question':
+                    print('Saving answers needs this index. Run "flask remove-duplicate-answers" once to remove '
+                          'the duplicate answers of older databases and create it.')
+                failed.append(index.name)
+
+    return failed
+
+
+def remove_duplicate_answers():
+    """
+    Keep only the latest answer per (response, question) in databases made before
+    the unique index on answers existed, so the index (which the answer upsert
+    relies on) can be created. Does nothing once the index is there.
+
+    A one-off migration that deletes rows, run by "flask remove-duplicate-answers",
+    never when the app starts.
+
+    Returns:
+        Number of duplicate answers deleted
+    """
+    index_names = {index['name'] for index in inspect(db.engine).get_indexes('answers')}
+    if 'uq_answers_response_question' in index_names:
+        return 0
+
+    latest = select(func.max(Answer.id)).group_by(Answer.response_id, Answer.question_id)
+    result = db.session.execute(delete(Answer).where(Answer.id.not_in(latest)))
+
+    if result.rowcount:
+        # the tallies counted the duplicates too
+        from utils.tallies import rebuild_tallies
+        rebuild_tallies()
+
+    db.session.commit()
+    return result.rowcount
+
+
+def explain_query(statement):
+    """
+    Run EXPLAIN QUERY PLAN on one query.
+
+    Parameters:
+        statement: ORM Query or SQLAlchemy statement, compiled the way the app runs it
+
+    Returns:
+        List of the plan's detail lines, e.g. 'SEARCH answers USING INDEX ...'
+    """
+    if isinstance(statement, Query):
+        statement = statement.statement
+
+    # render_postcompile writes out IN (...) lists like at execution time
+    compiled = statement.compile(dialect=db.engine.dialect, compile_kwargs={'render_postcompile': True})
+
+    # parameters left for executemany (e.g. the tally deltas) are bound to 1
+    parameters = tuple(1 if compiled.params.get(name) is None else compiled.params[name]
+                       for name in compiled.positiontup)
+
+    rows = db.session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled.string}', parameters).all()
+
+    # rows are (id, parent, notused, detail)
+    return [row[-1] for row in rows]
+
+
+def check_query_plans(queries=None):
+    """
+    Check that none of the hot queries does a full table scan.
+
+    Parameters:
+        queries: Dict of name -> Query or statement (hot_queries() if None)
+
+    Returns:
+        Dict of name -> {'plan': [detail lines], 'full_scans': [table names]}
+    """
+    queries = queries or hot_queries()
+    table_names = set(db.metadata.tables.keys())
+
+    report = {}
+    for name, statement in queries.items():
+        plan = explain_query(statement)
+        full_scans = []
+        for detail in plan:
+            match = FULL_SCAN_PATTERN.match(detail)
+            if match and match.group(1) in table_names:
+                full_scans.append(match.group(1))
+        report[name] = {'plan': plan, 'full_scans': full_scans}
+
+    return report
@@ -0,0 +1,94 @@
+import sqlite3
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+"""
+settings applied to every SQLite connection the app opens.
+
+out of the box SQLite uses a rollback journal (readers and the writer block
+each other) and gives up on a locked database almost straight away, which is
+what caused the "database is locked" errors when many respondents submitted
+at once. the pragmas in Config.SQLITE_PRAGMAS are run on each new connection
+from the pool: WAL lets readers carry on while one writer commits, and
+busy_timeout makes writers wait their turn instead of failing.
+"""
+
+# pragmas that only make sense once per database file, not per connection
+PERSISTENT_PRAGMAS = ['journal_mode']
+
+
+def is_sqlite(engine):
+    return engine.dialect.name == 'sqlite'
+
+
+def set_pragmas(dbapi_connection, pragmas):
+    """Run PRAGMA name=value for each setting on a raw DB-API connection."""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+    finally:
+        cursor.close()
+
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """
+    Run the pragmas on every connection the engine opens from now on.
+
+    Parameters:
+        engine: SQLAlchemy engine of the app (nothing happens if it isn't SQLite)
+        pragmas: Dict of pragma name -> value, e.g. {'journal_mode': 'WAL'}
+    """
+    if not pragmas or not is_sqlite(engine):
+        return
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        set_pragmas(dbapi_connection, pragmas)
+
+
+def get_sqlite_pragmas(engine, names):
+    """
+    Current value of some pragmas on a connection from the pool (to check the
+    profile was applied).
+
+    Returns:
+        Dict of pragma name -> value
+    """
+    values = {}
+    with engine.connect() as connection:
+        for name in names:
+            values[name] = connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+    return values
+
+
+def optimize_sqlite(engine):
+    """
+    Let SQLite refresh the statistics its query planner uses. Meant to be run
+    when the app shuts down, as the SQLite docs recommend.
+
+    With several server processes they all stop at about the same time, so
+    another one is often still writing. Then this is skipped: the next process
+    to stop runs it, and shutting down shouldn't wait for the busy timeout.
+    """
+    if not is_sqlite(engine):
+        return
+
+    try:
+        with engine.connect() as connection:
+            connection.exec_driver_sql('PRAGMA busy_timeout=0')
+            connection.exec_driver_sql('PRAGMA optimize')
+    except OperationalError as error:
+        if not is_busy(error):
+            print(f"Could not run PRAGMA optimize: {error}")
+    except Exception as error:
+        print(f"Could not run PRAGMA optimize: {error}")
+
+
+def is_busy(error):
+    """Whether a SQLAlchemy error is SQLite's "database is locked" (SQLITE_BUSY / SQLITE_LOCKED)."""
+    error_code = getattr(error.orig, 'sqlite_errorcode', None)
+    if error_code is not None:
+        # the low byte is the primary code, the rest says which kind of busy
+        return error_code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return 'database is locked' in str(error.orig)
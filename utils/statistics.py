@@ -0,0 +1,150 @@
+from sqlalchemy import func
+from database import db
+from data_tables.answer import Answer
+from data_tables.question import Question
+from data_tables.question_tally import QuestionTally
+from data_tables.response import Response
+from data_tables.section import Section
+
+"""
+statistics for a whole survey worked out by the database instead of python loops.
+
+the yes/no/abstain counts come from the question_tallies table (kept up to date
+by utils/tallies.py) so the results page and the exports never load Answer
+objects just to count them.
+"""
+
+# consensus is reached when yes / (yes + no) is at least this percentage
+CONSENSUS_THRESHOLD = 75.0
+
+
+def build_question_statistics(question_number, question_text, yes_count, no_count, abstain_count):
+    """
+    Turn the yes/no/abstain counts of one question into its statistics dict.
+
+    Parameters:
+        question_number: Number of the question inside its section
+        question_text: Text of the question
+        yes_count, no_count, abstain_count: How many people chose each option
+
+    Returns:
+        Dict with the same keys as Question.calculate_statistics()
+    """
+    total_yes_no = yes_count + no_count
+
+    # Avoid division by zero when everyone abstained
+    if total_yes_no == 0:
+        yes_percentage = 0.0
+    else:
+        yes_percentage = round((yes_count / total_yes_no) * 100, 1)
+
+    return {
+        'question_number': question_number,
+        'question_text': question_text,
+        'total_responses': yes_count + no_count + abstain_count,
+        'yes_count': yes_count,
+        'no_count': no_count,
+        'abstain_count': abstain_count,
+        'yes_percentage': yes_percentage,
+        'meets_threshold': yes_percentage >= CONSENSUS_THRESHOLD
+    }
+
+
+def no_percentage(stats):
+    """No percentage of a statistics dict (same denominator as yes, excludes abstains)."""
+    total_yes_no = stats['yes_count'] + stats['no_count']
+    if total_yes_no == 0:
+        return 0.0
+    return round((stats['no_count'] / total_yes_no) * 100, 1)
+
+
+def survey_statistics_query(survey_id, completed_only=False):
+    """
+    Query of (question id, number, text, section number, section title, yes,
+    no, abstain) for every question of a survey in order, counts from the tallies.
+    """
+    if completed_only:
+        count_columns = (QuestionTally.complete_yes_count, QuestionTally.complete_no_count, QuestionTally.complete_abstain_count)
+    else:
+        count_columns = (QuestionTally.yes_count, QuestionTally.no_count, QuestionTally.abstain_count)
+
+    return (
+        db.session.query(Question.id, Question.question_number, Question.question_text,
+                         Section.section_number, Section.title, *count_columns)
+        .join(Section, Question.section_id == Section.id)
+        .outerjoin(QuestionTally, QuestionTally.question_id == Question.id)
+        .filter(Section.survey_id == survey_id)
+        .order_by(Section.section_number, Section.id, Question.question_number, Question.id)
+    )
+
+
+def get_survey_statistics(survey_id, completed_only=False):
+    """
+    Get statistics for every question of a survey.
+
+    The counts are read from the question_tallies table, so this costs one
+    query over the questions no matter how many people have answered.
+
+    Parameters:
+        survey_id: Id of the survey
+        completed_only: Only count answers of submitted responses
+
+    Returns:
+        List of statistics dicts in question order. Each dict has the keys of
+        Question.calculate_statistics() plus 'question_id', 'section_number'
+        and 'section_title'.
+    """
+    rows = survey_statistics_query(survey_id, completed_only).all()
+
+    all_stats = []
+    for question_id, question_number, question_text, section_number, section_title, yes_count, no_count, abstain_count in rows:
+        # questions nobody has answered yet have no tally row
+        stats = build_question_statistics(question_number, question_text,
+                                          yes_count or 0, no_count or 0, abstain_count or 0)
+        stats['question_id'] = question_id
+        stats['section_number'] = section_number
+        stats['section_title'] = section_title
+        all_stats.append(stats)
+
+    return all_stats
+
+
+def survey_elaborations_query(survey_id):
+    """Query of (question_id, choice, elaboration, submitted_at) of every non-empty elaboration of a survey."""
+    return (
+        db.session.query(Answer.question_id, Answer.choice,
+                         Answer.elaboration, Response.submitted_at)
+        .join(Response, Answer.response_id == Response.id)
+        .filter(Response.survey_id == survey_id)
+        .filter(Answer.elaboration.isnot(None))
+        .filter(func.trim(Answer.elaboration) != '')
+        .order_by(Answer.question_id, Answer.id)
+    )
+
+
+def get_survey_elaborations(survey_id):
+    """
+    Get every non-empty elaboration of a survey in one query.
+
+    Returns:
+        Dict of question_id -> list of {'choice', 'elaboration', 'submitted_at'}
+        in the order the answers were saved
+    """
+    elaborations = {}
+    for question_id, choice, elaboration, submitted_at in survey_elaborations_query(survey_id):
+        elaborations.setdefault(question_id, []).append({
+            'choice': choice,
+            'elaboration': elaboration,
+            'submitted_at': submitted_at
+        })
+    return elaborations
+
+
+def response_count_query(survey_id):
+    """Query of the number of responses (complete or not) of a survey."""
+    return db.session.query(func.count(Response.id)).filter(Response.survey_id == survey_id)
+
+
+def count_responses(survey_id):
+    """Number of responses (complete or not) for a survey."""
+    return response_count_query(survey_id).scalar()
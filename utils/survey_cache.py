@@ -0,0 +1,231 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from flask import abort
+from sqlalchemy.orm import selectinload
+from database import db
+from database.upsert import upsert
+from data_tables.survey import Survey
+from data_tables.section import Section
+from data_tables.survey_version import SurveyVersion
+
+"""
+process-local cache of the structure of surveys that are being taken.
+
+once a survey is published its sections and questions hardly ever change, so
+the survey-taking pages get a compact read-only copy of them from memory
+instead of rebuilding the ORM tree from the database on every page view.
+
+every entry remembers the survey's version (survey_versions table). the admin
+routes that change a survey bump that version and drop the entry, and other
+processes notice the new version the next time they revalidate.
+"""
+
+# read-only copies of the survey tree. they have the same attribute names as
+# the models so templates and save_section_answers can use either.
+SurveyStructure = namedtuple('SurveyStructure', 'id title description is_active version sections')
+SectionStructure = namedtuple('SectionStructure', 'id section_number title description questions')
+QuestionStructure = namedtuple('QuestionStructure', 'id question_number question_text')
+
+
+def survey_structure_query(survey_id):
+    """Query of a survey with its sections and questions loaded (one SELECT each)."""
+    return (
+        Survey.query
+        .options(selectinload(Survey.sections).selectinload(Section.questions))
+        .filter_by(id=survey_id)
+    )
+
+
+def load_survey_structure(survey_id, version=None):
+    """
+    Load a survey with its sections and questions in a fixed number of queries
+    (survey, sections, questions) and turn it into a SurveyStructure.
+
+    Returns:
+        SurveyStructure, or None if the survey doesn't exist
+    """
+    survey = survey_structure_query(survey_id).first()
+    if survey is None:
+        return None
+
+    if version is None:
+        version = get_survey_version(survey_id)
+
+    # relationships are ordered by section_number / question_number
+    sections = tuple(
+        SectionStructure(
+            id=section.id,
+            section_number=section.section_number,
+            title=section.title,
+            description=section.description,
+            questions=tuple(
+                QuestionStructure(id=q.id, question_number=q.question_number, question_text=q.question_text)
+                for q in section.questions
+            )
+        )
+        for section in survey.sections
+    )
+
+    return SurveyStructure(
+        id=survey.id,
+        title=survey.title,
+        description=survey.description,
+        is_active=survey.is_active,
+        version=version,
+        sections=sections
+    )
+
+
+def survey_version_query(survey_id):
+    """Query of (survey id, structure version) of a survey."""
+    return (
+        db.session.query(Survey.id, SurveyVersion.version)
+        .outerjoin(SurveyVersion, SurveyVersion.survey_id == Survey.id)
+        .filter(Survey.id == survey_id)
+    )
+
+
+def get_survey_version(survey_id):
+    """
+    Current structure version of a survey.
+
+    Returns:
+        The version (0 if it was never changed), or None if the survey doesn't exist
+    """
+    row = survey_version_query(survey_id).first()
+    if row is None:
+        return None
+    return row[1] or 0
+
+
+def bump_survey_version(survey_id):
+    """
+    Mark the structure of a survey as changed. Caller is responsible for committing,
+    and should call survey_cache.invalidate() after the commit.
+    """
+    upsert(SurveyVersion, [{'survey_id': survey_id, 'version': 1}],
+           index_elements=['survey_id'],
+           set_={'version': SurveyVersion.__table__.c.version + 1})
+
+
+class SurveyStructureCache:
+    """
+    LRU cache of SurveyStructure objects keyed by survey id.
+
+    An entry is served without touching the database until it is older than
+    revalidate_seconds. After that one small query checks the survey's version
+    and the structure is only reloaded if it changed.
+    """
+
+    def __init__(self, max_size=128, revalidate_seconds=5):
+        self.max_size = max_size
+        self.revalidate_seconds = revalidate_seconds
+        self._entries = OrderedDict()  # survey_id -> (structure, checked_at)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, max_size, revalidate_seconds):
+        """Apply the size and revalidation settings from the app config."""
+        with self._lock:
+            self.max_size = max_size
+            self.revalidate_seconds = revalidate_seconds
+            self._evict()
+
+    def get(self, survey_id):
+        """
+        Get the structure of a survey, loading it if it isn't cached or is out of date.
+
+        Returns:
+            SurveyStructure, or None if the survey doesn't exist
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(survey_id)
+            if entry is not None:
+                self._entries.move_to_end(survey_id)
+
+        version = None
+        if entry is not None:
+            structure, checked_at = entry
+
+            if now - checked_at < self.revalidate_seconds:
+                self._count_hit()
+                return structure
+
+            # time to check that no other process changed the survey
+            version = get_survey_version(survey_id)
+            if version == structure.version:
+                self._store(survey_id, structure, now)
+                self._count_hit()
+                return structure
+
+        with self._lock:
+            self.misses += 1
+
+        if entry is None:
+            version = get_survey_version(survey_id)
+        if version is None:
+            self.invalidate(survey_id)
+            return None
+
+        structure = load_survey_structure(survey_id, version)
+        if structure is None:
+            self.invalidate(survey_id)
+            return None
+
+        self._store(survey_id, structure, now)
+        return structure
+
+    def invalidate(self, survey_id):
+        """Drop a survey from the cache (after it was edited, toggled or deleted)."""
+        with self._lock:
+            self._entries.pop(survey_id, None)
+
+    def clear(self):
+        """Drop every cached survey."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters and current size of the cache."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'max_size': self.max_size
+            }
+
+    def _count_hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def _store(self, survey_id, structure, checked_at):
+        with self._lock:
+            self._entries[survey_id] = (structure, checked_at)
+            self._entries.move_to_end(survey_id)
+            self._evict()
+
+    def _evict(self):
+        # least recently used entries are at the front
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+# one cache per process, shared by every request
+survey_cache = SurveyStructureCache()
+
+
+def get_survey_structure_or_404(survey_id):
+    """Cached structure of a survey for the survey-taking pages, 404 if it doesn't exist."""
+    structure = survey_cache.get(survey_id)
+    if structure is None:
+        abort(404)
+    return structure
@@ -0,0 +1,158 @@
+from sqlalchemy import delete
+from database import db
+from data_tables.answer import Answer
+from data_tables.question import Question
+from data_tables.question_tally import QuestionTally
+from data_tables.section import Section
+
+"""
+applies the edit survey form to a survey as a diff instead of rebuilding it.
+
+the form sends the id of every section and question that already existed, so
+they are matched to their rows and only what changed is written: new rows are
+inserted, changed rows are updated and rows that are no longer in the form are
+deleted. answers (and tallies) of the questions that are kept are never
+touched, so fixing a typo on a live survey keeps the votes already collected.
+"""
+
+
+def parse_form_id(value):
+    """Id sent by the form for an existing section or question, None for a new one."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_survey_form(form):
+    """
+    Read the sections and questions of the edit survey form.
+
+    The form names its fields section_<n>_title, section_<n>_description,
+    section_<n>_id, section_<n>_question_<m> and section_<n>_question_<m>_id,
+    numbered from 1 in the order they are shown.
+
+    Returns:
+        List of {'id', 'title', 'description', 'questions': [{'id', 'text'}]}
+        in form order (ids are None for new sections / questions)
+    """
+    sections = []
+    section_index = 1
+
+    while True:
+        section_title = form.get(f'section_{section_index}_title')
+        if section_title is None:
+            break
+
+        questions = []
+        question_index = 1
+        while True:
+            question_key = f'section_{section_index}_question_{question_index}'
+            question_text = form.get(question_key)
+            if question_text is None:
+                break
+
+            question_text = question_text.strip()
+            if question_text:
+                questions.append({
+                    'id': parse_form_id(form.get(f'{question_key}_id')),
+                    'text': question_text
+                })
+            question_index += 1
+
+        sections.append({
+            'id': parse_form_id(form.get(f'section_{section_index}_id')),
+            'title': section_title,
+            'description': form.get(f'section_{section_index}_description', ''),
+            'questions': questions
+        })
+        section_index += 1
+
+    return sections
+
+
+def set_if_changed(row, **values):
+    """Set attributes that differ, so the ORM only UPDATEs rows that really changed."""
+    for name, value in values.items():
+        if getattr(row, name) != value:
+            setattr(row, name, value)
+
+
+def apply_survey_edit(survey_id, form_sections):
+    """
+    Make the sections and questions of a survey match the edit form.
+    Caller is responsible for committing (and bumping the survey version).
+
+    Parameters:
+        survey_id: Id of the survey being edited
+        form_sections: Output of parse_survey_form
+
+    Returns:
+        Dict with how many sections / questions were added, updated and deleted
+    """
+    # plain queries rather than the relationships: the ORM cascades on
+    # Section.questions would otherwise delete questions that were moved
+    existing_sections = {section.id: section for section in
+                         Section.query.filter_by(survey_id=survey_id).all()}
+    existing_questions = {question.id: question for question in
+                          Question.query.filter(Question.section_id.in_(existing_sections)).all()}
+
+    changes = {'sections_added': 0, 'sections_updated': 0, 'sections_deleted': 0,
+               'questions_added': 0, 'questions_updated': 0, 'questions_deleted': 0}
+    kept_sections = set()
+    kept_questions = set()
+
+    for section_number, form_section in enumerate(form_sections, start=1):
+        # ids that aren't from this survey are treated as new rows
+        section = existing_sections.get(form_section['id'])
+        if section is not None and section.id not in kept_sections:
+            set_if_changed(section,
+                           section_number=section_number,
+                           title=form_section['title'],
+                           description=form_section['description'])
+            if db.session.is_modified(section):
+                changes['sections_updated'] += 1
+        else:
+            section = Section(survey_id=survey_id,
+                              section_number=section_number,
+                              title=form_section['title'],
+                              description=form_section['description'])
+            db.session.add(section)
+            db.session.flush()
+            changes['sections_added'] += 1
+        kept_sections.add(section.id)
+
+        for question_number, form_question in enumerate(form_section['questions'], start=1):
+            question = existing_questions.get(form_question['id'])
+            if question is not None and question.id not in kept_questions:
+                # a question moved to another section keeps its answers too
+                set_if_changed(question,
+                               section_id=section.id,
+                               question_number=question_number,
+                               question_text=form_question['text'])
+                if db.session.is_modified(question):
+                    changes['questions_updated'] += 1
+                kept_questions.add(question.id)
+            else:
+                db.session.add(Question(section_id=section.id,
+                                        question_number=question_number,
+                                        question_text=form_question['text']))
+                changes['questions_added'] += 1
+
+    db.session.flush()
+
+    # only what was removed from the form is deleted, with set-based deletes
+    removed_questions = [qid for qid in existing_questions if qid not in kept_questions]
+    removed_sections = [sid for sid in existing_sections if sid not in kept_sections]
+
+    if removed_questions:
+        db.session.execute(delete(Answer).where(Answer.question_id.in_(removed_questions)))
+        db.session.execute(delete(QuestionTally).where(QuestionTally.question_id.in_(removed_questions)))
+        db.session.execute(delete(Question).where(Question.id.in_(removed_questions)))
+        changes['questions_deleted'] = len(removed_questions)
+
+    if removed_sections:
+        db.session.execute(delete(Section).where(Section.id.in_(removed_sections)))
+        changes['sections_deleted'] = len(removed_sections)
+
+    return changes
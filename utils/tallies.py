@@ -0,0 +1,216 @@
+from collections import Counter
+from sqlalchemy import bindparam, func, update
+from database import db
+from database.upsert import insert_ignore
+from data_tables.answer import Answer
+from data_tables.question import Question
+from data_tables.question_tally import QuestionTally
+from data_tables.response import Response
+from data_tables.section import Section
+
+"""
+keeps the question_tallies table in step with the answers table.
+
+instead of recounting every answer, the places that change answers pass in
+what was there before and what is there now, and only the difference is added
+to the running counts in the same transaction.
+"""
+
+# which tally column each choice is counted in
+CHOICE_COLUMNS = {'Yes': 'yes_count', 'No': 'no_count', 'Abstain': 'abstain_count'}
+COMPLETE_CHOICE_COLUMNS = {'Yes': 'complete_yes_count', 'No': 'complete_no_count', 'Abstain': 'complete_abstain_count'}
+ALL_COLUMNS = list(CHOICE_COLUMNS.values()) + list(COMPLETE_CHOICE_COLUMNS.values())
+
+
+def ensure_tally_rows(question_ids):
+    """Create an all-zero tally row for any of these questions that doesn't have one yet."""
+    question_ids = set(question_ids)
+    if not question_ids:
+        return
+
+    # ON CONFLICT DO NOTHING so two respondents saving at once can't both insert the row
+    insert_ignore(QuestionTally, [{'question_id': question_id} for question_id in sorted(question_ids)],
+                  index_elements=['question_id'])
+
+
+def tally_update_statement():
+    """UPDATE adding delta_<column> to every column of the tally row of tally_question_id."""
+    tally_table = QuestionTally.__table__
+    return (
+        update(tally_table)
+        .where(tally_table.c.question_id == bindparam('tally_question_id'))
+        .values({column: tally_table.c[column] + bindparam(f'delta_{column}') for column in ALL_COLUMNS})
+    )
+
+
+def _apply_deltas(deltas):
+    """
+    Add the deltas to the tally rows with one batched UPDATE.
+
+    Parameters:
+        deltas: Dict of question_id -> {column_name: change}
+    """
+    deltas = {question_id: changes for question_id, changes in deltas.items() if any(changes.values())}
+    if not deltas:
+        return
+
+    ensure_tally_rows(deltas.keys())
+
+    # one UPDATE statement executed for every changed question (executemany)
+    statement = tally_update_statement()
+    # rows are always updated in question order, so two transactions updating
+    # the same questions wait for each other instead of deadlocking
+    parameters = []
+    for question_id, changes in sorted(deltas.items()):
+        row = {'tally_question_id': question_id}
+        for column in ALL_COLUMNS:
+            row[f'delta_{column}'] = changes.get(column, 0)
+        parameters.append(row)
+
+    db.session.execute(statement, parameters)
+
+
+def _count_changes(old_answers, new_answers, column_maps):
+    """Work out per question how much each tally column changes between old and new answers."""
+    difference = Counter((question_id, choice) for question_id, choice in new_answers)
+    difference.subtract(Counter((question_id, choice) for question_id, choice in old_answers))
+
+    deltas = {}
+    for (question_id, choice), change in difference.items():
+        if change == 0:
+            continue
+        for column_map in column_maps:
+            column = column_map.get(choice)
+            if column:
+                question_deltas = deltas.setdefault(question_id, {})
+                question_deltas[column] = question_deltas.get(column, 0) + change
+    return deltas
+
+
+def update_tallies(old_answers, new_answers, is_complete=False):
+    """
+    Apply the difference between the old and new answers of one response.
+    Caller is responsible for committing.
+
+    Parameters:
+        old_answers: (question_id, choice) pairs that were removed
+        new_answers: (question_id, choice) pairs that were added
+        is_complete: True if the response is already submitted, so the
+                     completed-only counts change too
+    """
+    column_maps = [CHOICE_COLUMNS, COMPLETE_CHOICE_COLUMNS] if is_complete else [CHOICE_COLUMNS]
+    _apply_deltas(_count_changes(old_answers, new_answers, column_maps))
+
+
+def response_answers_query(response_id):
+    """Query of (question_id, choice) of every answer a response has saved."""
+    return db.session.query(Answer.question_id, Answer.choice).filter(Answer.response_id == response_id)
+
+
+def get_response_answers(response_id):
+    """(question_id, choice) pairs of every answer a response has saved."""
+    return response_answers_query(response_id).all()
+
+
+def add_response_to_complete_tallies(response_id):
+    """Count every answer of a response that has just been submitted in the completed-only tallies."""
+    answers = get_response_answers(response_id)
+    _apply_deltas(_count_changes([], answers, [COMPLETE_CHOICE_COLUMNS]))
+
+
+def remove_response_from_tallies(response):
+    """Take every answer of a response out of the tallies before the response is deleted."""
+    update_tallies(get_response_answers(response.id), [], is_complete=response.is_complete)
+
+
+def count_tallies_from_answers(survey_id=None):
+    """
+    Recount the tallies from the answers table.
+
+    Parameters:
+        survey_id: Only recount this survey (all surveys if None)
+
+    Returns:
+        Dict of question_id -> {column_name: count} for every question in scope
+    """
+    question_query = db.session.query(Question.id)
+    count_query = (
+        db.session.query(Answer.question_id, Answer.choice, Response.is_complete, func.count(Answer.id))
+        .join(Response, Answer.response_id == Response.id)
+        .group_by(Answer.question_id, Answer.choice, Response.is_complete)
+    )
+
+    if survey_id is not None:
+        question_query = question_query.join(Section, Question.section_id == Section.id).filter(Section.survey_id == survey_id)
+        count_query = count_query.filter(Response.survey_id == survey_id)
+
+    actual = {question_id: {column: 0 for column in ALL_COLUMNS} for (question_id,) in question_query.all()}
+
+    for question_id, choice, is_complete, total in count_query.all():
+        if question_id not in actual or choice not in CHOICE_COLUMNS:
+            continue
+        actual[question_id][CHOICE_COLUMNS[choice]] += total
+        if is_complete:
+            actual[question_id][COMPLETE_CHOICE_COLUMNS[choice]] += total
+
+    return actual
+
+
+def verify_tallies(survey_id=None):
+    """
+    Compare the stored tallies with a fresh count of the answers.
+
+    Returns:
+        List of drift dicts with 'question_id', 'column', 'stored' and 'actual'
+        (empty when everything matches)
+    """
+    actual = count_tallies_from_answers(survey_id)
+    stored = {
+        tally.question_id: tally
+        for tally in QuestionTally.query.filter(QuestionTally.question_id.in_(list(actual.keys()))).all()
+    } if actual else {}
+
+    drift = []
+    for question_id, counts in actual.items():
+        tally = stored.get(question_id)
+        for column in ALL_COLUMNS:
+            stored_value = getattr(tally, column) if tally else 0
+            if stored_value != counts[column]:
+                drift.append({
+                    'question_id': question_id,
+                    'column': column,
+                    'stored': stored_value,
+                    'actual': counts[column]
+                })
+    return drift
+
+
+def rebuild_tallies(survey_id=None):
+    """
+    Throw away the stored tallies and recount them from the answers table.
+    Caller is responsible for committing.
+
+    Returns:
+        The drift that was found before rebuilding (see verify_tallies)
+    """
+    drift = verify_tallies(survey_id)
+    actual = count_tallies_from_answers(survey_id)
+
+    if actual:
+        QuestionTally.query.filter(QuestionTally.question_id.in_(list(actual.keys()))).delete(synchronize_session=False)
+        db.session.execute(
+            QuestionTally.__table__.insert(),
+            [dict(question_id=question_id, **counts) for question_id, counts in actual.items()]
+        )
+
+    return drift
+
+
+def backfill_tallies():
+    """Build the tallies once for a database that has answers from before the tally table existed."""
+    has_tallies = db.session.query(QuestionTally.question_id).first() is not None
+    has_answers = db.session.query(Answer.id).first() is not None
+
+    if has_answers and not has_tallies:
+        rebuild_tallies()
+        db.session.commit()